@@ -1 +1 @@
-from .authorization import authorized_user
+from .authorization import authorized_user, start_key_refresh, stop_key_refresh
@@ -1,10 +1,15 @@
+import asyncio
+import hashlib
 import os
+import time
+from collections import OrderedDict
 from typing import Optional
 
 import requests
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from jose import exceptions, jwt
+from starlette.concurrency import run_in_threadpool
 
 from app.models.user import User
 
@@ -16,12 +21,203 @@ if not ALLOWED_TOKEN_AUD:
     raise KeyError("env var ALLOWED_TOKEN_AUD not found")
 ENVIRONMENT = os.environ.get("ENVIRONMENT", default="production")
 
-# Get the keys from B2C URL
-key = requests.get(B2C_DISCOVERY_KEYS_URL).json()
+
+class jwks_key_store(object):
+    """The signing keys of the token issuer, fetched from the JWKS url.
+
+    The keys are fetched on first use rather than at import, reloaded in the
+    background every refresh_interval_seconds once start() has been called, and
+    reloaded on demand when a token is signed with a key id (kid) that is not
+    in the current set, so that key rotation is picked up at once.  On-demand
+    reloads are made at most once every min_refresh_interval_seconds, so tokens
+    with made up key ids cannot flood the issuer with requests.  If a reload
+    fails, the previous keys are kept.
+
+    version is incremented every time the set of keys changes.
+
+    Parameters
+    ----------
+    url : str
+        The JWKS url (B2C_DISCOVERY_KEYS_URL)
+    refresh_interval_seconds : float, optional
+        Seconds between background reloads.  Defaults to the environment variable
+        JWKS_REFRESH_SECONDS, or 3600
+    min_refresh_interval_seconds : float, optional
+        Minimum seconds between reloads caused by unknown key ids
+    """
+
+    def __init__(
+        self, url: str, refresh_interval_seconds=None, min_refresh_interval_seconds=30
+    ):
+        if refresh_interval_seconds is None:
+            refresh_interval_seconds = float(os.getenv("JWKS_REFRESH_SECONDS", "3600"))
+        self.url = url
+        self.refresh_interval_seconds = refresh_interval_seconds
+        self.min_refresh_interval_seconds = min_refresh_interval_seconds
+        self.jwks = None
+        self.keys = {}
+        self.version = 0
+        self.fetched_at = None
+        self.lock = None
+        self.refresh_task = None
+
+    def fetch(self):
+        """Downloads the key set.  Blocking, run in the threadpool"""
+        response = requests.get(self.url, timeout=10)
+        response.raise_for_status()
+        return response.json()
+
+    async def refresh(self, min_age_seconds: float = 0):
+        """Reloads the keys, unless they have been loaded less than
+        min_age_seconds ago (e.g. by a concurrent caller)
+        """
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        async with self.lock:
+            if (
+                self.fetched_at is not None
+                and time.monotonic() - self.fetched_at < min_age_seconds
+            ):
+                return
+            try:
+                jwks = await run_in_threadpool(self.fetch)
+            finally:
+                self.fetched_at = time.monotonic()
+            if jwks != self.jwks:
+                self.jwks = jwks
+                self.keys = {
+                    c["kid"]: c for c in jwks.get("keys", []) if "kid" in c
+                }
+                self.version += 1
+
+    async def get_key(self, kid: str = None):
+        """Returns the key with the given key id, or None if the issuer has no
+        such key.  Without a key id, the whole key set is returned for jwt.decode
+        to choose from
+        """
+        if self.jwks is None:
+            await self.refresh()
+        elif kid is not None and kid not in self.keys:
+            try:
+                await self.refresh(self.min_refresh_interval_seconds)
+            except Exception:
+                pass
+        if kid is None:
+            return self.jwks
+        return self.keys.get(kid)
+
+    async def _refresh_loop(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception:
+                pass
+            await asyncio.sleep(self.refresh_interval_seconds)
+
+    def start(self):
+        """Starts reloading the keys in the background"""
+        if self.refresh_task is None:
+            self.refresh_task = asyncio.get_running_loop().create_task(
+                self._refresh_loop()
+            )
+
+    async def stop(self):
+        if self.refresh_task is not None:
+            self.refresh_task.cancel()
+            try:
+                await self.refresh_task
+            except asyncio.CancelledError:
+                pass
+            self.refresh_task = None
+
+
+class verified_token_cache(object):
+    """Bounded cache of the claims of tokens whose signature has been verified,
+    so that a token reused over many requests is only decoded once.
+
+    Entries are keyed by the SHA-256 hash of the token, so the tokens themselves
+    are not kept in memory, and expire at the exp claim of the token.  Tokens
+    without exp are not cached.  An entry is only valid for the version of the
+    jwks_key_store it was verified with, so cached tokens are verified again
+    after a key rotation.  The least recently used entry is evicted when the
+    cache holds max_size tokens.
+    """
+
+    def __init__(self, max_size: int = 1024):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+
+    @staticmethod
+    def _get_token_hash(token: str):
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def get(self, token: str, key_version: int):
+        """Returns the verified claims of the token, or None if it is not cached"""
+        token_hash = self._get_token_hash(token)
+        entry = self.entries.get(token_hash)
+        if entry is None:
+            return None
+        claims, expires_at, entry_key_version = entry
+        if time.time() >= expires_at or entry_key_version != key_version:
+            del self.entries[token_hash]
+            return None
+        self.entries.move_to_end(token_hash)
+        return claims
+
+    def put(self, token: str, claims: dict, key_version: int):
+        expires_at = claims.get("exp")
+        if not isinstance(expires_at, (int, float)):
+            return
+        token_hash = self._get_token_hash(token)
+        self.entries[token_hash] = (claims, expires_at, key_version)
+        self.entries.move_to_end(token_hash)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+
+key_store = jwks_key_store(B2C_DISCOVERY_KEYS_URL)
+token_cache = verified_token_cache()
 
 get_bearer_token = HTTPBearer(auto_error=False)
 
 
+def start_key_refresh():
+    """Starts reloading the signing keys in the background, unless tokens are
+    not validated (ENVIRONMENT "development")
+    """
+    if ENVIRONMENT != "development":
+        key_store.start()
+
+
+async def stop_key_refresh():
+    await key_store.stop()
+
+
+async def _verify_token(token: str):
+    """Returns the claims of the token, from token_cache if the token has been
+    verified before
+    """
+    claims = token_cache.get(token, key_store.version)
+    if claims is not None:
+        return claims
+    header = jwt.get_unverified_header(token)
+    try:
+        key = await key_store.get_key(header.get("kid"))
+    except Exception:
+        raise HTTPException(
+            status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Token signing keys are unavailable",
+        )
+    if key is None:
+        raise exceptions.JWTError("unknown signing key")
+    key_version = key_store.version
+    claims = jwt.decode(
+        token=token, key=key, audience=ALLOWED_TOKEN_AUD, algorithms=header.get("alg")
+    )
+    token_cache.put(token, claims, key_version)
+    return claims
+
+
 async def get_user(
     authorization: Optional[HTTPAuthorizationCredentials] = Depends(get_bearer_token),
 ) -> User:
@@ -42,6 +238,7 @@ async def get_user(
     ------
     HTTPException
         If the authentication header is empty or in the wrong format, or if the token is expired or invalid.
+        With status 503 if the signing keys of the token issuer cannot be fetched.
     """
     if ENVIRONMENT == "development":
         return User(
@@ -56,10 +253,7 @@ async def get_user(
         )
     token = authorization.credentials.replace("Bearer", "").strip()
     try:
-        algorithm = jwt.get_unverified_header(token).get("alg")
-        user_info = jwt.decode(
-            token=token, key=key, audience=ALLOWED_TOKEN_AUD, algorithms=algorithm
-        )
+        user_info = await _verify_token(token)
         return User(
             name=user_info["name"],
             email=user_info["email"],
@@ -68,6 +262,9 @@ async def get_user(
     except exceptions.ExpiredSignatureError:
         raise HTTPException(status.HTTP_401_UNAUTHORIZED, detail="Token has expired")
 
+    except HTTPException:
+        raise
+
     except Exception as e:
         raise HTTPException(status.HTTP_401_UNAUTHORIZED, detail="Token is invalid")
 
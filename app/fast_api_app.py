@@ -7,23 +7,120 @@ from app.routes.analysis_input_routes import get_analysis_input_router
 # from app.routes.result_update_routes import (
 #     result_summary_routes,
 # )
-from .services.database_service import database_service
-from .auth import authorized_user
-from fastapi.responses import JSONResponse
+from .services.async_database_service import (
+    as_async_database_service,
+    async_database_service,
+)
+from .services.document_store import document_store
+from .services.database_backends import get_database_service
+from .services.document_cache import cached_database_service
+from .services.chunked_documents import chunked_database_service
+from .services.change_events import document_change_hub
+from .services.change_feed import change_feed_consumer
+from .services.reference_data_cache import reference_data_cache
+from .services.result_summary_view import result_summary_view
+from .services.warm_up import warm_up
+from .services.request_metrics import (
+    metrics_registry,
+    metrics_middleware,
+    metered_database_service,
+)
+from .services.json_responses import orjson_response
+from .services.compression import compression_middleware
+from .auth import authorized_user, start_key_refresh, stop_key_refresh
+from fastapi.responses import JSONResponse, PlainTextResponse
 from .models.user import User
+from contextlib import asynccontextmanager
+import os
 
 
-def get_app(db_serv=None):
+def get_app(
+    db_serv: document_store | async_database_service = None,
+    cache_documents=None,
+    server_timing=None,
+    follow_change_feed=None,
+):
+    """Creates the FastAPI app
+
+    Parameters
+    ----------
+    db_serv : document_store | async_database_service, optional
+        The database service used by the routes.  Synchronous services (any
+        document_store) are run in the threadpool.  Defaults to the backend selected by the environment
+        variable ANALYSES_STORE_BACKEND (see get_database_service), by default an
+        async_database_service
+    cache_documents : bool, optional
+        Whether documents read from the database are cached in process (see
+        cached_database_service).  Defaults to True when db_serv is not given
+    server_timing : bool, optional
+        Whether a Server-Timing header with the time spent in each phase is added
+        to every response.  Defaults to the environment variable SERVER_TIMING
+    follow_change_feed : bool, optional
+        Whether the change feed is read in the background, to update the
+        in-process caches with the writes of other workers (see
+        change_feed_consumer).  Defaults to the environment variable
+        CHANGE_FEED_ENABLED when db_serv is not given, otherwise False
+    """
+    if cache_documents is None:
+        cache_documents = db_serv is None
+    if follow_change_feed is None:
+        follow_change_feed = db_serv is None and os.getenv(
+            "CHANGE_FEED_ENABLED", "true"
+        ).lower() in ["1", "true"]
     if db_serv is None:
-        db_serv = database_service()
-    app = FastAPI()
+        db_serv = get_database_service()
+    if server_timing is None:
+        server_timing = os.getenv("SERVER_TIMING", "false").lower() in ["1", "true"]
+    db_serv = chunked_database_service(
+        metered_database_service(as_async_database_service(db_serv))
+    )
+    if cache_documents:
+        db_serv = cached_database_service(db_serv)
+    change_hub = document_change_hub()
+    if cache_documents:
+        change_hub.subscribe(db_serv.cache.invalidate)
+    reference_cache = reference_data_cache(db_serv)
+    change_hub.subscribe(reference_cache.invalidate)
+    summary_view = result_summary_view(db_serv, reference_cache)
+    change_hub.subscribe(summary_view.invalidate)
+
+    feed_consumer = change_feed_consumer(db_serv, change_hub)
+    deferred_imports = warm_up()
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        await db_serv.open()
+        reference_cache.start()
+        summary_view.start()
+        if follow_change_feed:
+            feed_consumer.start()
+        start_key_refresh()
+        deferred_imports.start()
+        yield
+        await deferred_imports.stop()
+        await stop_key_refresh()
+        await feed_consumer.stop()
+        await summary_view.stop()
+        await reference_cache.stop()
+        await db_serv.close()
+
+    app = FastAPI(lifespan=lifespan, default_response_class=orjson_response)
+    app.add_middleware(compression_middleware)
+    registry = metrics_registry()
+    if follow_change_feed:
+        registry.add_collector(feed_consumer)
+    app.add_middleware(
+        metrics_middleware, registry=registry, server_timing=server_timing
+    )
     api = APIRouter(prefix="/api", dependencies=[authorized_user])  #
-    vessels_routes = get_vessel_router(db_serv)
-    analyses_routes = get_analysis_router(db_serv)
+    vessels_routes = get_vessel_router(db_serv, change_hub)
+    analyses_routes = get_analysis_router(
+        db_serv, reference_cache, change_hub, summary_view
+    )
     api.include_router(vessels_routes)
     api.include_router(analyses_routes)
-    api.include_router(get_soil_router(db_serv))
-    api.include_router(get_analysis_input_router(db_serv))
+    api.include_router(get_soil_router(db_serv, change_hub))
+    api.include_router(get_analysis_input_router(db_serv, change_hub))
     app.include_router(api)
 
     @app.get("/user")
@@ -34,4 +131,18 @@ def get_app(db_serv=None):
     def pingpong():
         return "pong"
 
+    # the metrics and cache statistics reveal routes, load and cache contents,
+    # and are only served to authorized users like the api
+    @app.get("/metrics", dependencies=[authorized_user])
+    def metrics():
+        return PlainTextResponse(
+            registry.render(), media_type="text/plain; version=0.0.4"
+        )
+
+    @app.get("/cache_stats", dependencies=[authorized_user])
+    def cache_stats():
+        if not cache_documents:
+            return {}
+        return db_serv.get_cache_stats()
+
     return app
@@ -1,7 +1,16 @@
-from pydantic import BaseModel, Field, field_serializer
+from pydantic import (
+    BaseModel,
+    ConfigDict,
+    Field,
+    field_serializer,
+    model_validator,
+    with_config,
+)
 from uuid import uuid4, UUID
-from typing import List, Literal, Optional
+from typing import Annotated, List, Literal, Optional
+from typing_extensions import NotRequired, TypedDict
 from .general_configs import ALLOWABLE_UNITS
+from .query_filter import collection_filter
 
 DEFAULT_UNITS = {
     "angle rx": "deg",
@@ -65,6 +74,10 @@ ALLOWABLE_RESULT_TYPES = Literal[
     "velocity z",
 ]
 
+ALLOWABLE_CURRENTS = Literal[
+    "None", "1yr", "10yr", "10pct", "25pct", "75pct", "90pct", "median"
+]
+
 #ALLOWABLE_UNITS = Literal["m", "N", "kN", "Nm", "kNm", "deg", "rad", "m/s"]
 
 
@@ -82,6 +95,50 @@ class update_analyses_summary_input(BaseModel, extra="forbid"):
     updates: List[update_analysis_summary_input]
 
 
+class interpolation_input(BaseModel, extra="forbid"):
+    location: ALLOWABLE_LOCATIONS
+    result_type: ALLOWABLE_RESULT_TYPES
+    method: str
+    hs: List[float]
+    tp: List[float]
+
+    @model_validator(mode="after")
+    def check_same_length(self):
+        if len(self.hs) != len(self.tp):
+            raise ValueError("hs and tp must have the same length")
+        return self
+
+
+class batch_get_input(BaseModel, extra="forbid"):
+    ids: List[str] = Field(min_length=1, max_length=1000)
+    selected_keys: Optional[
+        List[Literal["id", "metadata", "general_results", "all_seastate_results"]]
+    ] = None
+
+
+class analyses_filter(collection_filter):
+    vessel_id: str | None = None
+    project_id: int | None = None
+    analysis_type: str | None = None
+    client: str | None = None
+    current: ALLOWABLE_CURRENTS | None = None
+    xt: bool | None = None
+    water_depth_min: float | None = None
+    water_depth_max: float | None = None
+
+    def get_query_filters(self):
+        filters = [
+            (f"metadata.{c}", "=", getattr(self, c))
+            for c in ["vessel_id", "project_id", "analysis_type", "client", "current", "xt"]
+            if getattr(self, c) is not None
+        ]
+        if self.water_depth_min is not None:
+            filters.append(("metadata.water_depth", ">=", self.water_depth_min))
+        if self.water_depth_max is not None:
+            filters.append(("metadata.water_depth", "<=", self.water_depth_max))
+        return filters
+
+
 class general_results(BaseModel, extra="forbid"):
     m_eq_dominant_direction: Optional[float] = Field(None, ge=0.0)
     m_eq_local_scatter_dom_dir: Optional[float] = Field(None, ge=0.0)
@@ -126,9 +183,7 @@ class analyses_metadata(BaseModel, extra="forbid"):
     water_depth: float = Field(gt=0.0)
     wave_direction: float = Field(ge=0.0, le=360.0)
     vessel_heading: float = Field(ge=0.0, le=360.0)
-    current: Literal[
-        "None", "1yr", "10yr", "10pct", "25pct", "75pct", "90pct", "median"
-    ]
+    current: ALLOWABLE_CURRENTS
     vessel_id: str = Field(default_factory=uuid4)
     xt: bool
     soil_profile: str = Field(min_length=1)
@@ -177,3 +232,69 @@ class analysis_result(BaseModel, extra="forbid"):
     metadata: analyses_metadata
     general_results: general_results
     all_seastate_results: List[result_scatter]
+
+
+# Document mode: the seastate results of large analyses are validated as
+# TypedDicts, with the same fields and constraints as the models above.  Their
+# validation returns the plain dicts to be stored, so that pydantic-core
+# validates the whole arrays without creating a model instance per seastate,
+# and the document does not have to be rebuilt with model_dump
+
+
+@with_config(ConfigDict(extra="forbid"))
+class summary_value_document(TypedDict):
+    method: Literal["std", "max", "min", "mean", "m_eq"]
+    value: float
+
+
+@with_config(ConfigDict(extra="forbid"))
+class one_seastate_result_document(TypedDict):
+    summary_values: List[summary_value_document]
+    # set to None by analysis_result_document.validate_document_json if missing
+    time_series_id: NotRequired[Optional[str]]
+
+
+@with_config(ConfigDict(extra="forbid"))
+class seastate_result_document(TypedDict):
+    hs: Annotated[float, Field(gt=0.0)]
+    tp: Annotated[float, Field(gt=0.0)]
+    result: one_seastate_result_document
+
+
+@with_config(ConfigDict(extra="forbid"))
+class scatter_result_metadata_document(TypedDict):
+    location: ALLOWABLE_LOCATIONS
+    result_type: ALLOWABLE_RESULT_TYPES
+    unit: ALLOWABLE_UNITS
+
+
+@with_config(ConfigDict(extra="forbid"))
+class result_scatter_document(TypedDict):
+    meta: scatter_result_metadata_document
+    data: List[seastate_result_document]
+
+
+class analysis_result_document(BaseModel, extra="forbid"):
+    """analysis_result validated in document mode.  Accepts and rejects the same
+    documents as analysis_result, and validate_document_json returns the same
+    dict as analysis_result.model_validate_json(body).model_dump()
+    """
+
+    id: UUID = None
+    metadata: analyses_metadata
+    general_results: general_results
+    all_seastate_results: List[result_scatter_document]
+
+    @classmethod
+    def validate_document_json(cls, body) -> dict:
+        """Validates the raw json (bytes or str) of an analysis and returns the
+        document to be stored.  Raises pydantic.ValidationError if it is invalid
+        """
+        validated = cls.model_validate_json(body)
+        document = validated.model_dump(exclude={"all_seastate_results"})
+        # the validated seastate results are stored as they are
+        document["all_seastate_results"] = validated.all_seastate_results
+        for one_scatter in validated.all_seastate_results:
+            for one_seastate in one_scatter["data"]:
+                one_seastate["result"].setdefault("time_series_id", None)
+        return document
@@ -1,9 +1,29 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, model_validator
 from uuid import uuid4, UUID
 from typing import List, Literal
 
 
 class json_patch_modify(BaseModel, extra="forbid"):
-    op: str
+    """One RFC 6902 operation, or the cosmos "set" operation (replace the value
+    if it exists, otherwise add it).  value is required by add, replace, set and
+    test, and from by move and copy
+    """
+
+    op: Literal["add", "remove", "replace", "set", "move", "copy", "test"]
     path: str
-    value: str | float
+    value: str | float | None = None
+    from_: str | None = Field(None, alias="from")
+
+    @model_validator(mode="after")
+    def check_operation_arguments(self):
+        if self.op in ["add", "replace", "set", "test"] and "value" not in (
+            self.model_fields_set
+        ):
+            raise ValueError(f"{self.op} operations need a value")
+        if self.op in ["move", "copy"] and self.from_ is None:
+            raise ValueError(f"{self.op} operations need a from path")
+        return self
+
+    def to_update(self):
+        """Returns the operation as a dict for patch_one_document"""
+        return self.model_dump(by_alias=True, exclude_unset=True)
@@ -0,0 +1,12 @@
+from pydantic import BaseModel
+
+
+class collection_filter(BaseModel, extra="forbid"):
+    """Base class of the query parameter models used to filter a collection.
+    Subclasses add the filter fields and convert the given fields to query
+    conditions in get_query_filters
+    """
+
+    def get_query_filters(self):
+        """Returns the (field_path, operator, value) conditions for build_query"""
+        return []
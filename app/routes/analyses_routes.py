@@ -1,165 +1,298 @@
-import pandas as pd
-import numpy as np
-from .one_collection_routes import get_router_one_collection
-from ..services.database_service import database_service
-from app.models.analyses import analysis_result
-from ..services.analysis_dict_manipulator import (
-    update_seastate_summary_results,
-    extract_all_summary_results,
-)
+import math
+from .one_collection_routes import get_router_one_collection, get_ndjson_response
+from fastapi import Depends, Header, HTTPException, Query, Request, Response
+from ..services.async_database_service import async_database_service
+from ..services.change_events import document_change_hub
+from ..services.reference_data_cache import reference_data_cache
+from ..services.result_summary_view import result_summary_view
+from ..services.derived_data_cache import derived_data_cache
+from ..services.bulk_ingest import bulk_insert, iter_ndjson_lines
+from ..services.request_metrics import record_phase
+from ..services.json_responses import get_json_response, orjson_response
+from app.models.analyses import analysis_result_document
+from ..services.analysis_dict_manipulator import update_seastate_summary_results
 
 from typing import Literal
 from ..auth import authorized_user
 from ..models.user import User
-from ..models.analyses import update_analyses_summary_input
+from ..models.analyses import (
+    update_analyses_summary_input,
+    interpolation_input,
+    batch_get_input,
+    analyses_filter,
+)
 
 
-def get_analysis_router(db_serv: database_service):
-    router = get_router_one_collection(db_serv, "analyses", analysis_result)
+def get_analysis_router(
+    db_serv: async_database_service,
+    reference_cache: reference_data_cache = None,
+    change_hub: document_change_hub = None,
+    summary_view: result_summary_view = None,
+):
+    if change_hub is None:
+        change_hub = document_change_hub()
+    if reference_cache is None:
+        reference_cache = reference_data_cache(db_serv, ["vessels"])
+    if summary_view is None:
+        summary_view = result_summary_view(db_serv, reference_cache)
+        change_hub.subscribe(summary_view.invalidate)
+    router = get_router_one_collection(
+        db_serv,
+        "analyses",
+        analysis_result_document,
+        change_hub=change_hub,
+        filter_object=analyses_filter,
+    )
+    derived_cache = derived_data_cache()
+
+    async def get_seastate_matrices(
+        id: str, location: str = None, result_type: str = None
+    ):
+        """Returns the seastate matrices of the analysis, only of the given
+        location and result_type if given, computed once per document version,
+        and the etag of the version.  The matrices are None if the analysis does
+        not exist.  Only the selected scatters are read from analyses stored in
+        the chunked layout
+        """
+        # numpy and scipy are imported on first use rather than with the app, to
+        # keep them out of the cold start (see warm_up)
+        from ..services.seastate_matrix import seastate_matrix
+
+        meta_filter = {
+            k: v
+            for k, v in [("location", location), ("result_type", result_type)]
+            if v is not None
+        }
+        scatters, etag = await db_serv.get_split_items_with_etag(
+            "analyses", id, meta_filter
+        )
+        if etag is None:
+            return None, None
+
+        def build_seastate_matrices():
+            with record_phase("seastate_matrix"):
+                return [seastate_matrix.from_result_scatter(c) for c in scatters]
+
+        matrices = derived_cache.get(
+            ("seastate_matrices", id, location, result_type),
+            etag,
+            build_seastate_matrices,
+        )
+        return matrices, etag
 
     @router.get("/{id}/seastate_results")
-    def get_seastate_results(id: str):
-        doc = db_serv.get_one_document_by_id("analyses", id)
-        summary_res = extract_all_summary_results(doc)
-        return summary_res
+    async def get_seastate_results(
+        id: str,
+        location: str | None = None,
+        result_type: str | None = None,
+        format: Literal["rows", "columnar"] = "rows",
+    ):
+        """
+        Returns all summary values of the analysis as rows, optionally only of
+        one location and/or result_type.  With format=columnar the values are
+        returned as parallel lists instead, with location, result_type, unit and
+        method given as codes into lists of their distinct values:
+            {"dictionaries": {"location": [...], ..., "method": [...]},
+             "columns": {"hs": [...], "tp": [...], "location": [0, ...], ...,
+                         "method": [...], "value": [...]}}
+        """
+        from ..services.seastate_matrix import get_summary_columns
+
+        matrices, _ = await get_seastate_matrices(id, location, result_type)
+        if matrices is None:
+            return _get_not_found_response(id)
+        if format == "columnar":
+            return orjson_response(get_summary_columns(matrices))
+        return orjson_response([row for c in matrices for row in c.get_summary_rows()])
 
     @router.get("/{id}/drio_time_series_ids")
-    def get_drio_time_series_ids(id: str):
-        doc = db_serv.get_one_document_by_id("analyses", id)
+    async def get_drio_time_series_ids(
+        id: str, location: str | None = None, result_type: str | None = None
+    ):
+        matrices, _ = await get_seastate_matrices(id, location, result_type)
+        if matrices is None:
+            return _get_not_found_response(id)
         all_time_series_with_drio_key = {}
-        for one_analysis in doc["all_seastate_results"]:
-            dict_key = f"{one_analysis['meta']['location']}__{one_analysis['meta']['result_type']}"
-
+        for one_matrix in matrices:
+            dict_key = f"{one_matrix.location}__{one_matrix.result_type}"
             all_time_series_with_drio_key[dict_key] = {
-                _get_hs_tp_string(hs=c["hs"], tp=c["tp"]): {
-                    "hs": c["hs"],
-                    "tp": c["tp"],
-                    "time_series_id": c["result"]["time_series_id"],
-                    **one_analysis["meta"],
+                _get_hs_tp_string(hs=hs, tp=tp): {
+                    "hs": hs,
+                    "tp": tp,
+                    "time_series_id": time_series_id,
+                    **one_matrix.meta,
                 }
-                for c in one_analysis["data"]
-                if c["result"]["time_series_id"] is not None
+                for hs, tp, time_series_id in zip(
+                    one_matrix._to_list(one_matrix.hs, "hs"),
+                    one_matrix._to_list(one_matrix.tp, "tp"),
+                    one_matrix.time_series_id,
+                )
+                if time_series_id is not None
             }
         return all_time_series_with_drio_key
 
     @router.get("/{id}/dynamic_interpolator")
-    def get_dynamic_interpolator(id: str):
-        doc = db_serv.get_one_document_by_id("analyses", id)
+    async def get_dynamic_interpolator(id: str):
+        matrices, _ = await get_seastate_matrices(id)
+        if matrices is None:
+            return _get_not_found_response(id)
+        from ..services.seastate_matrix import extract_dynamic_interpolator
+
+        return extract_dynamic_interpolator(matrices)
+
+    @router.post("/{id}/interpolate")
+    async def post_interpolate(id: str, query: interpolation_input):
+        """
+        Interpolates the summary values of one location, result_type and method
+        linearly over the Hs/Tp scatter of the analysis, at the points
+        (hs[i], tp[i]).  Points outside the scatter get the value null.  The
+        interpolator is built once per version of the analysis
+        """
+        from ..services.seastate_interpolator import from_seastate_matrices
 
-        summary_res = pd.DataFrame(extract_all_summary_results(doc))
-        summary_res["res_id"] = summary_res["location"].str.cat(
-            summary_res["result_type"].str.cat(summary_res["method"], sep="__"),
-            sep="__",
+        matrices, etag = await get_seastate_matrices(
+            id, query.location, query.result_type
         )
-        return_documents = []
-
-        for res_id, one_res_id_data in summary_res.groupby("res_id"):
-            return_document = {
-                "meta": {
-                    "location": one_res_id_data["location"].unique()[0],
-                    "result_type": one_res_id_data["result_type"].unique()[0],
-                    "method": one_res_id_data["method"].unique()[0],
-                },
-                "scatters": [],
-            }
-            one_scatter = {
-                "meta": {},
-                "data": [],
+        if matrices is None:
+            return _get_not_found_response(id)
+        key = ("interpolator", id, query.location, query.result_type, query.method)
+        interpolator = derived_cache.get(
+            key,
+            etag,
+            lambda: from_seastate_matrices(
+                matrices, query.location, query.result_type, query.method
+            ),
+        )
+        if interpolator is None:
+            return Response(
+                status_code=404,
+                content=(
+                    f"analysis {id} has no {query.method} values for "
+                    f"{query.result_type} at {query.location}"
+                ),
+            )
+        values = interpolator(query.hs, query.tp)
+        return {
+            "meta": {
+                "location": query.location,
+                "result_type": query.result_type,
+                "method": query.method,
+            },
+            "z": [None if math.isnan(c) else c for c in values.tolist()],
+        }
+
+    @router.post("/batch_get")
+    async def post_batch_get(query: batch_get_input):
+        """
+        Returns the analyses with the given ids, read in batches, as newline
+        delimited json with one line per id in the order given:
+            {"id": id, "found": true, "document": {...}}
+        or, if there is no analysis with the id:
+            {"id": id, "found": false}
+        If selected_keys is given, only these keys (and "id") of the documents
+        are returned
+        """
+
+        async def get_line_pages():
+            start = 0
+            async for documents in db_serv.iter_many_documents_by_id(
+                "analyses", query.ids, query.selected_keys
+            ):
+                ids = query.ids[start : start + len(documents)]
+                start += len(documents)
+                yield [_get_batch_get_line(i, d) for i, d in zip(ids, documents)]
+
+        return get_ndjson_response(get_line_pages())
+
+    @router.post(
+        "/bulk",
+        openapi_extra={
+            "requestBody": {
+                "content": {"application/x-ndjson": {"schema": {"type": "string"}}},
+                "required": True,
             }
-            for _, one_seastate in one_res_id_data.iterrows():
-                one_scatter["data"].append(
-                    {
-                        "Hs": one_seastate["hs"],
-                        "Tp": one_seastate["tp"],
-                        "z": one_seastate["value"],
-                    }
-                )
+        },
+    )
+    async def post_bulk(
+        request: Request, max_concurrency: int = Query(16, gt=0, le=100)
+    ):
+        """
+        Inserts many analyses from a newline delimited json body with one
+        analysis_result per line.  The lines are validated as they are received and
+        written with at most max_concurrency concurrent writes.  Invalid lines do
+        not stop the upload; the response has one status per line:
+            {"created": 2, "failed": 1, "results": [
+                {"line": 1, "status": 201, "id": "..."},
+                {"line": 2, "status": 422, "errors": [...]},
+                ...
+            ]}
+        """
 
-            return_document["scatters"].append(one_scatter)
-            return_documents.append(return_document)
+        async def post_document(document):
+            written = await db_serv.post_one_document("analyses", document)
+            change_hub.publish("analyses", written["id"])
+            return written
 
-        return return_documents
+        results = await bulk_insert(
+            iter_ndjson_lines(request.stream()),
+            analysis_result_document,
+            post_document,
+            max_concurrency,
+        )
+        created = sum(c["status"] == 201 for c in results)
+        return {
+            "created": created,
+            "failed": len(results) - created,
+            "results": results,
+        }
 
     @router.get("/summary/result_summary")
-    def get_result_summary(
+    async def get_result_summary(
         result_type: Literal["simple", "detailed", "full"] = None,
+        page_size: int | None = Query(None, gt=0),
+        continuation: str | None = None,
+        stream: bool = False,
+        filters: analyses_filter = Depends(),
+        if_none_match: str | None = Header(None),
         user: User = authorized_user,
     ):
+        """
+        Returns one summary row per analysis, from the result summary view.
+        page_size, continuation, stream, the filter parameters and If-None-Match
+        work as for GET /api/analyses
+        """
         if result_type is None:
             result_type = "simple"
-        vessel_dict = _get_vessel_dict(db_serv)
-        documents = db_serv.get_all_documents_short(
-            "analyses", ["id", "metadata", "general_results"]
-        )
+        query_filters = filters.get_query_filters()
+        if stream:
+            return get_ndjson_response(
+                summary_view.iter_row_pages(result_type, page_size, query_filters)
+            )
+        if page_size is not None or continuation is not None:
+            offset = 0 if continuation is None else _get_offset(continuation)
+            rows, next_offset = await summary_view.get_rows(
+                result_type, query_filters, offset, page_size
+            )
+            return get_json_response(
+                {
+                    "documents": rows,
+                    "continuation": None if next_offset is None else str(next_offset),
+                },
+                if_none_match,
+            )
+        rows, _ = await summary_view.get_rows(result_type, query_filters)
+        return get_json_response(rows, if_none_match)
 
-        response_values = []
-        for d in documents:
-            if result_type == "simple":
-                if d["metadata"]["xt"]:
-                    xt_string = "Yes"
-                else:
-                    xt_string = "No"
-                if "m_eq_dominant_direction" in d["general_results"]:
-                    m_eq = d["general_results"]["m_eq_dominant_direction"]
-                else:
-                    m_eq = None
-                #                print(i, d["id"],d["metadata"]["vessel_id"])
-                response_values.append(
-                    {
-                        "id": d["id"],
-                        "analysis_type": d["metadata"]["analysis_type"],
-                        "water_depth": d["metadata"]["water_depth"],
-                        "vessel": vessel_dict[d["metadata"]["vessel_id"]],
-                        "project_id": d["metadata"]["project_id"],
-                        "well_name": d["metadata"]["well"]["name"],
-                        "version": d["metadata"]["version"],
-                        "wave_direction_relative_to_rig": float(
-                            np.abs(
-                                d["metadata"]["wave_direction"]
-                                - d["metadata"]["vessel_heading"]
-                            )
-                        ),
-                        "current": d["metadata"]["current"],
-                        "xt": xt_string,
-                        "overpull": d["metadata"]["overpull"],
-                        "well_data": _get_well_summary(d["metadata"]["well"]),
-                        "comment": d["metadata"]["comment"],
-                        "client": d["metadata"]["client"],
-                        "m_eq_dominant_direction": m_eq,
-                    }
-                )
-            elif result_type == "detailed":
-                response_values.append(
-                    {
-                        "id": d["id"],
-                        "analysis_type": d["metadata"]["analysis_type"],
-                        "water_depth": d["metadata"]["water_depth"],
-                        "vessel": vessel_dict[d["metadata"]["vessel_id"]],
-                        "project_id": d["metadata"]["project_id"],
-                        "well_name": d["metadata"]["well"]["name"],
-                        "wave_direction": d["metadata"]["wave_direction"],
-                        "vessel_heading": d["metadata"]["vessel_heading"],
-                        "current": d["metadata"]["current"],
-                        "xt": d["metadata"]["xt"],
-                        "overpull": d["metadata"]["overpull"],
-                        "drillpipe_tension": d["metadata"]["drillpipe_tension"],
-                        "comment": d["metadata"]["comment"],
-                        "offset_percent_of_wd": d["metadata"]["offset_percent_of_wd"],
-                        "client": d["metadata"]["client"],
-                        "well_boundary_type": d["metadata"]["well"][
-                            "well_boundary_type"
-                        ],
-                        **d["general_results"],
-                    }
-                )
-            else:
-                response_values.append(
-                    {"id": d["id"], **d["metadata"], **d["general_results"]}
-                )
-        return response_values
+    @router.post("/summary/result_summary/rebuild")
+    async def post_rebuild_result_summary():
+        """
+        Rebuilds the result summary view from all analyses in the database.  The
+        view is otherwise updated as analyses and vessels are written
+        """
+        return {"analyses": await summary_view.rebuild()}
 
     @router.put("/update/seastate_summary_update")
-    def put_update_summary(updates: update_analyses_summary_input):
+    async def put_update_summary(updates: update_analyses_summary_input):
         """
         Updates seastate summary for one analysis id.  The update should be a list of on or more
         dicts containing the updates to the analyses summary results.  The result to be updated
@@ -168,36 +301,35 @@ def get_analysis_router(db_serv: database_service):
         of selction parameters does not exist
         """
         id = str(updates.dict()["id"])
-        old_document = db_serv.get_one_document_by_id("analyses", id)
+        old_document = await db_serv.get_one_document_by_id("analyses", id)
         updated_doc = update_seastate_summary_results(
             old_document, updates.dict()["updates"]
         )
-        return_val = db_serv.replace_one_document("analyses", id, updated_doc)
+        return_val = await db_serv.replace_one_document("analyses", id, updated_doc)
+        change_hub.publish("analyses", id)
         return return_val
 
     return router
 
 
-def _get_vessel_dict(db_serv):
-    documents = db_serv.get_all_documents("vessels")
-    return {c["id"]: c["name"] for c in list(documents)}
+def _get_batch_get_line(id, document):
+    if document is None:
+        return {"id": id, "found": False}
+    return {"id": id, "found": True, "document": document}
 
 
-def _get_hs_tp_string(hs, tp):
-    return f"H{int(hs*100):04d}_T{int(tp*100):04d}"
+def _get_not_found_response(id):
+    return Response(
+        status_code=404, content=f"document with id {id} not found in analyses"
+    )
+
 
+def _get_offset(continuation):
+    try:
+        return int(continuation)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="invalid continuation")
 
-def _get_well_summary(well):
-    ret_str = f"name: {well['name']}\n"
-    ret_str += f"boundary-type: {well['well_boundary_type']}\n"
-    ret_str += f"well-design-type: {well['design_type']}\n"
-    ret_str += f"well-stiffness: {well['stiffness']}\n"
-    ret_str += f"support-feature: {well['feature']}\n"
-    ret_str += f"support-feature: {well['feature']}\n"
-    if type(well["soil"]) is dict:
-        ret_str += f"soil-type: {well['soil']['soil_type']}\n"
-        ret_str += f"soil-version: {well['soil']['soil_version']}\n"
-        ret_str += f"soil-sensitivity: {well['soil']['soil_sensitivity']}\n"
-    else:
-        ret_str += "soil-type: None\n"
-    return ret_str
+
+def _get_hs_tp_string(hs, tp):
+    return f"H{int(hs*100):04d}_T{int(tp*100):04d}"
@@ -1,15 +1,34 @@
-from fastapi import APIRouter, Response
-from ..services.database_service import database_service
+from fastapi import APIRouter, Depends, Header, Request, Response, Query
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import StreamingResponse
+from ..services.async_database_service import async_database_service
+from ..services.change_events import document_change_hub
 from ..models.jsonpatch import json_patch_modify
+from ..models.query_filter import collection_filter
+from ..services.query_builder import validate_field_path
+from ..services.bulk_ingest import validate_document_json
 import json
+from ..services.json_responses import (
+    content_modification_times,
+    dumps,
+    get_json_response,
+    get_not_modified_response,
+    orjson_response,
+    parse_if_none_match,
+    serialized_document_cache,
+)
+from ..services.request_metrics import record_phase
+from pydantic import ValidationError
 from azure.cosmos.exceptions import CosmosResourceNotFoundError, CosmosHttpResponseError
 
 
 def get_router_one_collection(
-    db_serv: database_service,
+    db_serv: async_database_service,
     collection_name: str,
     validation_object: object,
     add_route_list=None,
+    change_hub: document_change_hub = None,
+    filter_object: type = None,
 ):
     router = APIRouter(
         prefix=f"/{collection_name}",
@@ -18,20 +37,122 @@ def get_router_one_collection(
     router_str = f""
     if add_route_list is None:
         add_route_list = ["get_all", "get_by_id", "post", "delete", "patch"]
+    if change_hub is None:
+        change_hub = document_change_hub()
+    if filter_object is None:
+        filter_object = collection_filter
+    serialized_cache = serialized_document_cache()
+    modification_times = content_modification_times()
 
     if "get_all" in add_route_list:
 
         @router.get(router_str)
-        def get_all():
-            return db_serv.get_all_documents(collection_name)
+        async def get_all(
+            page_size: int | None = Query(None, gt=0),
+            continuation: str | None = None,
+            stream: bool = False,
+            fields: list[str] | None = Query(None),
+            filters: filter_object = Depends(),
+            if_none_match: str | None = Header(None),
+            if_modified_since: str | None = Header(None),
+        ):
+            """
+            Returns all documents in the collection.  If page_size or continuation
+            is given, one page is returned as {"documents": [...], "continuation":
+            token}, where the token is passed as continuation to get the next page
+            (null for the last page).  If stream is true, the documents are streamed
+            as newline delimited json as they are read from the database.
+            fields selects the keys to return, as dotted paths (e.g.
+            fields=id&fields=metadata.well.name), and the filter parameters select
+            the documents; both are evaluated by the database.  Responses that are
+            not streamed have an ETag and a Last-Modified, and are 304 Not Modified
+            if If-None-Match matches the ETag or, without If-None-Match, if they
+            are not modified since If-Modified-Since.
+            """
+            try:
+                selected_keys = (
+                    None if fields is None else [validate_field_path(c) for c in fields]
+                )
+            except ValueError as e:
+                return Response(status_code=422, content=str(e))
+            query_filters = filters.get_query_filters()
+            if stream:
+                return get_ndjson_response(
+                    db_serv.iter_document_pages(
+                        collection_name,
+                        page_size,
+                        selected_keys=selected_keys,
+                        filters=query_filters,
+                    )
+                )
+            if page_size is not None or continuation is not None:
+                documents, next_continuation = await db_serv.get_documents_page(
+                    collection_name,
+                    page_size,
+                    continuation,
+                    selected_keys=selected_keys,
+                    filters=query_filters,
+                )
+                return get_json_response(
+                    {"documents": documents, "continuation": next_continuation},
+                    if_none_match,
+                    modification_times,
+                    if_modified_since,
+                )
+            if selected_keys is not None or len(query_filters) > 0:
+                return get_json_response(
+                    await db_serv.get_all_documents_short(
+                        collection_name, selected_keys, query_filters
+                    ),
+                    if_none_match,
+                    modification_times,
+                    if_modified_since,
+                )
+            return get_json_response(
+                await db_serv.get_all_documents(collection_name),
+                if_none_match,
+                modification_times,
+                if_modified_since,
+            )
 
     if "get_by_id" in add_route_list:
 
         @router.get(router_str + "/{id}")
-        def get_one(id: str):
+        async def get_one(
+            id: str,
+            if_none_match: str | None = Header(None),
+            if_modified_since: str | None = Header(None),
+        ):
+            """
+            Returns the document with its etag in the ETag header and its
+            modification time in the Last-Modified header.  If If-None-Match has
+            the current etag, the response is 304 Not Modified and the document is
+            not read from the database.  Without If-None-Match, the response is
+            304 Not Modified if the document is not modified since
+            If-Modified-Since
+            """
+            tags = parse_if_none_match(if_none_match)
+            # the database compares one etag; other headers are compared below
+            etag = tags[0] if len(tags) == 1 and tags[0] != "*" else None
             try:
-                return_data = db_serv.get_one_document_by_id(collection_name, id)
-                return return_data
+                (
+                    document,
+                    etag,
+                    last_modified,
+                ) = await db_serv.get_one_document_with_version(
+                    collection_name, id, etag
+                )
+                if document is None:
+                    return get_not_modified_response(etag)
+                return serialized_cache.get_response(
+                    collection_name,
+                    id,
+                    document,
+                    etag,
+                    if_none_match,
+                    last_modified,
+                    if_modified_since,
+                )
             except CosmosResourceNotFoundError:
                 return Response(
                     status_code=404,
@@ -46,18 +167,38 @@ def get_router_one_collection(
 
     if "post" in add_route_list:
 
-        @router.post(router_str)
-        def post(validated_body: validation_object):
-            return db_serv.post_one_document(
-                collection_name, validated_body.model_dump()
-            )
+        @router.post(
+            router_str,
+            openapi_extra=get_request_body_openapi(validation_object),
+        )
+        async def post(request: Request):
+            """
+            Inserts the document in the body, validated against the model of the
+            collection.  The raw json is validated directly, without decoding it
+            into Python objects first, and the written document is returned
+            """
+            body = await request.body()
+            try:
+                with record_phase("validation"):
+                    document = validate_document_json(validation_object, body)
+            except ValidationError as e:
+                raise RequestValidationError(
+                    [
+                        {**c, "loc": ("body", *c["loc"])}
+                        for c in e.errors(include_url=False)
+                    ]
+                )
+            return_data = await db_serv.post_one_document(collection_name, document)
+            change_hub.publish(collection_name, document.get("id"))
+            return orjson_response(return_data)
 
     if "delete" in add_route_list:
 
         @router.delete(router_str + "/{id}")
-        def delete(id: str):
+        async def delete(id: str):
             try:
-                return_data = db_serv.delete_one_document_by_id(collection_name, id)
+                return_data = await db_serv.delete_one_document_by_id(collection_name, id)
+                change_hub.publish(collection_name, id)
                 return return_data
             except CosmosResourceNotFoundError:
                 return Response(
@@ -74,24 +215,29 @@ def get_router_one_collection(
     if "patch" in add_route_list:
 
         @router.patch(router_str + "/{id}")
-        def patch(id: str, updates: list[json_patch_modify]):
+        async def patch(id: str, updates: list[json_patch_modify]):
             """
             Updates one document with the updates given in the body.  All updates are given as
             a dict on the following form:
             [
                 {
-                    "op": string with the operation to performe ("add", "replace", "remove")
+                    "op": string with the operation to performe ("add", "replace", "remove", "set")
                     "path": string with the path where the operation should be applied
-                    "value": the value (for replace or add operations)
+                    "value": the value (for replace, add or set operations)
 
                 }
             ]
+            move, copy and test operations (with "from" instead of "value" for move
+            and copy) are also accepted, but are slower as the whole document is
+            rewritten.  Concurrent patches are never lost
             """
-            updates = [dict(c) for c in updates]
+            updates = [c.to_update() for c in updates]
             try:
-                return db_serv.patch_one_document(
+                return_data = await db_serv.patch_one_document(
                     collection_name=collection_name, document_id=id, updates=updates
                 )
+                change_hub.publish(collection_name, id)
+                return return_data
             except CosmosResourceNotFoundError:
                 return Response(
                     status_code=404,
@@ -122,3 +268,49 @@ def get_router_one_collection(
             # return update_document
 
     return router
+
+
+def get_request_body_openapi(validation_object):
+    """Returns the OpenAPI requestBody of a route reading the raw json body, with
+    the json schema of the model (as FastAPI documents a body parameter)
+    """
+    schema = validation_object.model_json_schema()
+    definitions = schema.pop("$defs", {})
+
+    def inline(value):
+        if isinstance(value, dict):
+            if "$ref" in value:
+                return inline(definitions[value["$ref"].split("/")[-1]])
+            return {k: inline(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [inline(c) for c in value]
+        return value
+
+    return {
+        "requestBody": {
+            "content": {"application/json": {"schema": inline(schema)}},
+            "required": True,
+        }
+    }
+
+
+def get_ndjson_response(pages, transform=None):
+    """Returns a StreamingResponse writing the documents from an async iterator of
+    pages (lists of documents) as newline delimited json
+
+    Parameters
+    ----------
+    pages : AsyncIterator[list]
+        The pages of documents to stream
+    transform : callable, optional
+        Applied to each document before it is serialized
+    """
+
+    async def ndjson_lines():
+        async for page in pages:
+            yield b"".join(
+                dumps(c if transform is None else transform(c)) + b"\n"
+                for c in page
+            )
+
+    return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson")
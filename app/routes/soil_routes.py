@@ -1,18 +1,22 @@
 from .one_collection_routes import get_router_one_collection
-from ..services.database_service import database_service
+from ..services.async_database_service import async_database_service
+from ..services.change_events import document_change_hub
 #from fastapi import Response
 #from azure.cosmos.exceptions import CosmosResourceNotFoundError, CosmosHttpResponseError
 
 from app.models.soil import soil_data
 
 
-def get_soil_router(db_serv: database_service):
+def get_soil_router(
+    db_serv: async_database_service, change_hub: document_change_hub = None
+):
     validation_object = soil_data
     ret_router = get_router_one_collection(
         db_serv=db_serv,
         collection_name="soil",
         validation_object=validation_object,
         add_route_list=["get_all", "get_by_id", "post", "patch", "delete"],
+        change_hub=change_hub,
     )
 
     return ret_router
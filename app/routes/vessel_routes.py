@@ -1,28 +1,35 @@
 from .one_collection_routes import get_router_one_collection
-from ..services.database_service import database_service
+from ..services.async_database_service import async_database_service
+from ..services.change_events import document_change_hub
 from fastapi import Response
 from azure.cosmos.exceptions import CosmosResourceNotFoundError, CosmosHttpResponseError
 import json
 from app.models.vessel import vessel
 
 
-def get_vessel_router(db_serv: database_service):
+def get_vessel_router(
+    db_serv: async_database_service, change_hub: document_change_hub = None
+):
     validation_object = vessel
+    if change_hub is None:
+        change_hub = document_change_hub()
     ret_router = get_router_one_collection(
         db_serv=db_serv,
         collection_name="vessels",
         validation_object=validation_object,
         add_route_list=["get_all", "get_by_id", "post", "patch"],
+        change_hub=change_hub,
     )
 
     @ret_router.delete("/{id}")
-    def delete(id: str):
+    async def delete(id: str):
         try:
-            analyses_with_vessel = db_serv.get_analysis_id_by_vesselid(id)
+            analyses_with_vessel = await db_serv.get_analysis_id_by_vesselid(id)
             num_analyses_with_vessel = len(analyses_with_vessel)
 
             if num_analyses_with_vessel == 0:
-                return_data = db_serv.delete_one_document_by_id("vessels", id)
+                return_data = await db_serv.delete_one_document_by_id("vessels", id)
+                change_hub.publish("vessels", id)
                 return return_data
             else:
                 return_dict = {
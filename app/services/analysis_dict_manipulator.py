@@ -76,17 +76,94 @@ def _filter_dict_list(dict_list, filter_dict, sub_level=None):
 
 
 def update_seastate_summary_results(document, list_of_updates):
+    """Applies a list of summary value updates to a copy of the document.  Gives
+    the same result as calling update_one_seastate_sumamry_value once per update,
+    but the document is copied once and the seastates and summary values are
+    found through indices built on first use, so each update is applied in
+    constant time.
+
+    Parameters
+    ----------
+    document : dict
+        An analysis_result document.  It is not modified
+    list_of_updates : list
+        A list of dicts with the keys hs, tp, location, result_type, method and
+        value.  A missing result scatter, seastate or method is appended
+
+    Returns
+    -------
+    dict
+        A copy of the document with the updates applied
+    """
     return_document = deepcopy(document)
+    all_seastate_results = return_document["all_seastate_results"]
+    scatter_index = {}
+    for scatter_position, one_result in enumerate(all_seastate_results):
+        scatter_key = (one_result["meta"]["location"], one_result["meta"]["result_type"])
+        scatter_index.setdefault(scatter_key, []).append(scatter_position)
+    point_indices = {}
+    method_indices = {}
+
     for update in list_of_updates:
-        return_document = update_one_seastate_sumamry_value(
-            document=return_document,
-            hs=update["hs"],
-            tp=update["tp"],
-            location=update["location"],
-            result_type=update["result_type"],
-            method=update["method"],
-            value=update["value"],
+        new_value = {"method": update["method"], "value": update["value"]}
+        scatter_key = (update["location"], update["result_type"])
+        scatter_positions = scatter_index.setdefault(scatter_key, [])
+        if len(scatter_positions) != 1:
+            all_seastate_results.append(
+                {
+                    "meta": {
+                        "location": update["location"],
+                        "result_type": update["result_type"],
+                        "unit": _get_default_unit(result_type=update["result_type"]),
+                    },
+                    "data": [
+                        {
+                            "hs": update["hs"],
+                            "tp": update["tp"],
+                            "result": {"summary_values": [new_value]},
+                        }
+                    ],
+                }
+            )
+            scatter_positions.append(len(all_seastate_results) - 1)
+            continue
+
+        scatter_position = scatter_positions[0]
+        data = all_seastate_results[scatter_position]["data"]
+        if scatter_position not in point_indices:
+            point_index = {}
+            for point_position, one_seastate in enumerate(data):
+                point_index.setdefault(
+                    (one_seastate["hs"], one_seastate["tp"]), []
+                ).append(point_position)
+            point_indices[scatter_position] = point_index
+        point_positions = point_indices[scatter_position].setdefault(
+            (update["hs"], update["tp"]), []
         )
+        if len(point_positions) != 1:
+            data.append(
+                {
+                    "hs": update["hs"],
+                    "tp": update["tp"],
+                    "result": {"summary_values": [new_value]},
+                }
+            )
+            point_positions.append(len(data) - 1)
+            continue
+
+        summary_values = data[point_positions[0]]["result"]["summary_values"]
+        method_key = (scatter_position, point_positions[0])
+        if method_key not in method_indices:
+            method_index = {}
+            for value_position, summary_value in enumerate(summary_values):
+                method_index.setdefault(summary_value["method"], value_position)
+            method_indices[method_key] = method_index
+        method_index = method_indices[method_key]
+        if update["method"] in method_index:
+            summary_values[method_index[update["method"]]] = new_value
+        else:
+            method_index[update["method"]] = len(summary_values)
+            summary_values.append(new_value)
     return return_document
 
 
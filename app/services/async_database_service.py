@@ -0,0 +1,453 @@
+from azure.cosmos import PartitionKey
+from azure.cosmos.aio import CosmosClient
+from azure.cosmos.exceptions import (
+    CosmosAccessConditionFailedError,
+    CosmosResourceNotFoundError,
+)
+from azure.core import MatchConditions
+from starlette.concurrency import run_in_threadpool, iterate_in_threadpool
+import uuid
+import os
+from .document_store import document_store
+from .query_builder import build_query
+from .document_patch import (
+    MAX_PATCH_ATTEMPTS,
+    apply_patch,
+    to_cosmos_patch_operations,
+)
+from .request_metrics import record_cosmos_request, record_cosmos_response
+from .database_service import (
+    _remove_internal_dict_keys,
+    _get_partition_key_path,
+    _get_partition_key_value,
+    _get_document_version,
+    _get_many_documents_query_string,
+    _get_documents_in_id_order,
+    _get_change_feed_options,
+    change_feed_response_hook,
+)
+
+
+class async_database_service(object):
+    """Asynchronous service object to handle data stored in the azure cosmos db
+    document database.  Has the same method surface as database_service, but all
+    methods are coroutines built on azure.cosmos.aio.
+
+    One CosmosClient (and thereby one connection pool) is shared by all requests.
+    The client is created by open() and closed by close(), which are called from
+    the lifespan handler of the FastAPI app.  open() also builds the registry of
+    container clients and partition key paths.
+    """
+
+    def __init__(self):
+        self.host = os.getenv("SQLAZURECONNSTR_AZURE_COSMOS_DB_HOST")
+        self.master_key = os.getenv("SQLAZURECONNSTR_AZURE_COSMOS_DB_MASTER_KEY")
+        self.client = None
+        self.data_base_proxy = None
+        self.containers = {}
+
+    async def open(self):
+        """Creates the shared CosmosClient and builds the container registry.
+        Calling open() on an already open service does nothing
+        """
+        if self.client is None:
+            self.client = CosmosClient(
+                self.host,
+                self.master_key,
+                raw_request_hook=record_cosmos_request,
+                raw_response_hook=record_cosmos_response,
+            )
+            self.data_base_proxy = self.client.get_database_client("dynops-store-data")
+            await self.build_container_registry()
+
+    async def build_container_registry(self):
+        """Registers the container client and partition key path of all containers
+        in the database.  See database_service.build_container_registry
+        """
+        async for properties in self.data_base_proxy.list_containers():
+            self.containers[properties["id"]] = {
+                "client": self.data_base_proxy.get_container_client(properties["id"]),
+                "partition_key_path": _get_partition_key_path(properties),
+            }
+
+    async def close(self):
+        """Closes the shared CosmosClient and its connection pool"""
+        if self.client is not None:
+            await self.client.close()
+            self.client = None
+            self.data_base_proxy = None
+            self.containers = {}
+
+    async def _get_container_entry(self, collection_name: str):
+        if self.client is None:
+            await self.open()
+        if collection_name not in self.containers:
+            container = self.data_base_proxy.get_container_client(collection_name)
+            self.containers[collection_name] = {
+                "client": container,
+                "partition_key_path": _get_partition_key_path(await container.read()),
+            }
+        return self.containers[collection_name]
+
+    async def _get_container(self, collection_name: str):
+        return (await self._get_container_entry(collection_name))["client"]
+
+    async def create_collection_if_not_exists(
+        self, collection_name: str, partition_key_path: str
+    ):
+        """See database_service.create_collection_if_not_exists"""
+        if self.client is None:
+            await self.open()
+        container = await self.data_base_proxy.create_container_if_not_exists(
+            id=collection_name, partition_key=PartitionKey(path=partition_key_path)
+        )
+        self.containers[collection_name] = {
+            "client": container,
+            "partition_key_path": _get_partition_key_path(await container.read()),
+        }
+
+    async def get_one_document_by_id(self, collection_name: str, document_id: str):
+        """Gets one document from the azure cosmos document database.  See
+        database_service.get_one_document_by_id
+        """
+        container_entry = await self._get_container_entry(collection_name)
+        container = container_entry["client"]
+        if container_entry["partition_key_path"] == "/id":
+            try:
+                document = await container.read_item(
+                    item=document_id, partition_key=document_id
+                )
+            except CosmosResourceNotFoundError:
+                return []
+            return _remove_internal_dict_keys(document)
+
+        q_string = "SELECT * FROM d WHERE  d.id =@id"
+        q_results = container.query_items(
+            query=q_string,
+            parameters=[{"name": "@id", "value": document_id}],
+        )
+        q_results = [c async for c in q_results]
+        if len(q_results) < 1:
+            return []
+        else:
+            return [_remove_internal_dict_keys(c) for c in q_results][0]
+
+    async def get_one_document_with_etag(
+        self, collection_name: str, document_id: str, etag: str = None
+    ):
+        """Gets one document together with its etag, reading conditionally if an
+        etag is given.  See database_service.get_one_document_with_etag
+        """
+        document, etag, _ = await self.get_one_document_with_version(
+            collection_name, document_id, etag
+        )
+        return document, etag
+
+    async def get_one_document_with_version(
+        self, collection_name: str, document_id: str, etag: str = None
+    ):
+        """Gets one document together with its etag and modification time.  See
+        database_service.get_one_document_with_version
+        """
+        container_entry = await self._get_container_entry(collection_name)
+        container = container_entry["client"]
+        if container_entry["partition_key_path"] != "/id":
+            q_results = container.query_items(
+                query="SELECT * FROM d WHERE  d.id =@id",
+                parameters=[{"name": "@id", "value": document_id}],
+            )
+            q_results = [c async for c in q_results]
+            document = q_results[0] if len(q_results) > 0 else None
+        else:
+            conditional_kwargs = {}
+            if etag is not None:
+                conditional_kwargs = {
+                    "etag": etag,
+                    "match_condition": MatchConditions.IfModified,
+                }
+            try:
+                document = await container.read_item(
+                    item=document_id, partition_key=document_id, **conditional_kwargs
+                )
+            except CosmosResourceNotFoundError:
+                document = None
+        return _get_document_version(document, etag)
+
+    async def get_many_documents_by_id(
+        self, collection_name: str, document_ids: list, selected_keys: list = None
+    ):
+        """Gets several documents in one round trip.  See
+        database_service.get_many_documents_by_id
+        """
+        unique_ids = list(dict.fromkeys(document_ids))
+        if len(unique_ids) == 0:
+            return []
+        container_entry = await self._get_container_entry(collection_name)
+        container = container_entry["client"]
+        if selected_keys is None and container_entry["partition_key_path"] == "/id":
+            documents = await container.read_items(items=[(c, c) for c in unique_ids])
+        else:
+            items = container.query_items(
+                query=_get_many_documents_query_string(selected_keys),
+                parameters=[{"name": "@ids", "value": unique_ids}],
+            )
+            documents = [c async for c in items]
+        return _get_documents_in_id_order(documents, document_ids)
+
+    async def iter_many_documents_by_id(
+        self,
+        collection_name: str,
+        document_ids: list,
+        selected_keys: list = None,
+        chunk_size: int = 100,
+    ):
+        """Yields the documents chunk_size ids at a time.  See
+        database_service.iter_many_documents_by_id
+        """
+        for start in range(0, len(document_ids), chunk_size):
+            yield await self.get_many_documents_by_id(
+                collection_name, document_ids[start : start + chunk_size], selected_keys
+            )
+
+    async def delete_one_document_by_id(self, collection_name: str, document_id: str):
+        """Deletes one document.  See database_service.delete_one_document_by_id"""
+        container_entry = await self._get_container_entry(collection_name)
+        partition_key = document_id
+        if container_entry["partition_key_path"] != "/id":
+            document = await self.get_one_document_by_id(collection_name, document_id)
+            if not document:
+                raise CosmosResourceNotFoundError()
+            partition_key = _get_partition_key_value(
+                document, container_entry["partition_key_path"]
+            )
+        return await container_entry["client"].delete_item(
+            item=document_id, partition_key=partition_key
+        )
+
+    async def get_all_documents_short(
+        self, collection_name: str, selected_keys: list = None, filters: list = None
+    ):
+        """Gets all documents from the given collection that fulfill the filters,
+        returning only the document keys in the selected_keys list.  See
+        database_service.get_all_documents_short
+        """
+        container = await self._get_container(collection_name)
+        q_string, parameters = build_query(selected_keys, filters)
+        items = container.query_items(query=q_string, parameters=parameters)
+        return [_remove_internal_dict_keys(c) async for c in items]
+
+    async def get_documents_page(
+        self,
+        collection_name: str,
+        page_size: int,
+        continuation: str = None,
+        selected_keys: list = None,
+        filters: list = None,
+    ):
+        """Gets one page of documents and the continuation token for the next
+        page.  See database_service.get_documents_page
+        """
+        container = await self._get_container(collection_name)
+        q_string, parameters = build_query(selected_keys, filters)
+        items = container.query_items(
+            query=q_string, parameters=parameters, max_item_count=page_size
+        )
+        pager = items.by_page(continuation)
+        try:
+            page = await pager.__anext__()
+            documents = [_remove_internal_dict_keys(c) async for c in page]
+        except StopAsyncIteration:
+            documents = []
+        return documents, pager.continuation_token
+
+    async def iter_document_pages(
+        self,
+        collection_name: str,
+        page_size: int = None,
+        selected_keys: list = None,
+        filters: list = None,
+    ):
+        """Yields all documents in the collection one page at a time.  See
+        database_service.iter_document_pages
+        """
+        container = await self._get_container(collection_name)
+        q_string, parameters = build_query(selected_keys, filters)
+        items = container.query_items(
+            query=q_string, parameters=parameters, max_item_count=page_size
+        )
+        async for page in items.by_page():
+            yield [_remove_internal_dict_keys(c) async for c in page]
+
+    async def get_all_documents(self, collection_name: str):
+        """Gets all documents from the given collection.  See
+        database_service.get_all_documents
+        """
+        container = await self._get_container(collection_name)
+        return [_remove_internal_dict_keys(c) async for c in container.read_all_items()]
+
+    async def replace_one_document(
+        self, collection_name: str, doc_id: str, replace_item: dict, etag: str = None
+    ):
+        """Replaces one document, only if it is unchanged since etag if given.  See
+        database_service.replace_one_document
+        """
+        container = await self._get_container(collection_name)
+        if etag is None:
+            return await container.replace_item(item=doc_id, body=replace_item)
+        return await container.replace_item(
+            item=doc_id,
+            body=replace_item,
+            etag=etag,
+            match_condition=MatchConditions.IfNotModified,
+        )
+
+    async def post_one_document(self, collection_name: str, document: dict):
+        """Post a new document into the database.  See
+        database_service.post_one_document
+        """
+        document["id"] = str(uuid.uuid4())
+        container = await self._get_container(collection_name)
+        ret_value = await container.create_item(body=document)
+        return _remove_internal_dict_keys(ret_value)
+
+    async def upsert_one_document(self, collection_name: str, document: dict):
+        """Inserts or replaces one document.  See
+        database_service.upsert_one_document
+        """
+        container = await self._get_container(collection_name)
+        return _remove_internal_dict_keys(await container.upsert_item(body=document))
+
+    async def patch_one_document(
+        self, collection_name: str, document_id: str, updates: list[dict]
+    ):
+        """Patch a document in the database using the RFC 6902 patch syntax, with
+        patch_item when possible and otherwise with an etag guarded replace.  See
+        database_service.patch_one_document
+        """
+        container_entry = await self._get_container_entry(collection_name)
+        partition_key_path = container_entry["partition_key_path"]
+        operations = to_cosmos_patch_operations(updates, partition_key_path)
+        if operations is not None and partition_key_path == "/id":
+            return await container_entry["client"].patch_item(
+                item=document_id, partition_key=document_id, patch_operations=operations
+            )
+
+        for attempt in range(MAX_PATCH_ATTEMPTS):
+            update_document, etag = await self.get_one_document_with_etag(
+                collection_name=collection_name, document_id=document_id
+            )
+            if not update_document:
+                raise CosmosResourceNotFoundError()
+            update_document = apply_patch(update_document, updates)
+            try:
+                return await self.replace_one_document(
+                    collection_name=collection_name,
+                    doc_id=document_id,
+                    replace_item=update_document,
+                    etag=etag,
+                )
+            except CosmosAccessConditionFailedError:
+                if attempt == MAX_PATCH_ATTEMPTS - 1:
+                    raise
+
+    async def get_analysis_id_by_vesselid(self, vessel_id):
+        """Gets the id of all analyses with the given vessel.  See
+        database_service.get_analysis_id_by_vesselid
+        """
+        container = await self._get_container("analyses")
+        q_string = "SELECT d.id, d.metadata.vessel_id FROM d WHERE  d.metadata.vessel_id =@vessel_id"
+        q_results = container.query_items(
+            query=q_string,
+            parameters=[{"name": "@vessel_id", "value": vessel_id}],
+        )
+        return [c async for c in q_results]
+
+    async def read_change_feed(self, collection_name: str, continuation: str = None):
+        """Reads the documents created or replaced since the continuation token.
+        See database_service.read_change_feed
+        """
+        container = await self._get_container(collection_name)
+        last_response = change_feed_response_hook()
+        changes = container.query_items_change_feed(
+            **_get_change_feed_options(continuation),
+            response_hook=last_response,
+        )
+        documents = [{"id": c["id"], "_ts": c.get("_ts")} async for c in changes]
+        return documents, last_response.get_continuation()
+
+
+class threadpool_database_service(object):
+    """Gives a synchronous database service (e.g. database_service) the method
+    surface of async_database_service.  Every method call is forwarded unchanged to
+    the wrapped service and run in the starlette threadpool, so the event loop is
+    not blocked while waiting for the database.  Methods named iter_* return
+    iterators, and are consumed in the threadpool as async iterators.
+
+    Parameters
+    ----------
+    db_serv : document_store
+        The synchronous database service to wrap
+    """
+
+    def __init__(self, db_serv: document_store):
+        self.db_serv = db_serv
+
+    async def open(self):
+        """Opens the wrapped service (e.g. creates the CosmosClient of a
+        database_service), if it has an open method
+        """
+        if hasattr(self.db_serv, "open"):
+            await run_in_threadpool(self.db_serv.open)
+
+    async def close(self):
+        """Closes the wrapped service (e.g. the connection of a
+        sqlite_database_service), if it has a close method
+        """
+        if hasattr(self.db_serv, "close"):
+            await run_in_threadpool(self.db_serv.close)
+
+    def __getattr__(self, name):
+        attribute = getattr(self.db_serv, name)
+        if not callable(attribute):
+            return attribute
+
+        if name.startswith("iter_"):
+
+            def threadpool_iterate(*args, **kwargs):
+                return iterate_in_threadpool(attribute(*args, **kwargs))
+
+            return threadpool_iterate
+
+        async def threadpool_call(*args, **kwargs):
+            return await run_in_threadpool(attribute, *args, **kwargs)
+
+        return threadpool_call
+
+
+def as_async_database_service(db_serv):
+    """Returns db_serv if it already has the async method surface (an instance
+    of async_database_service or threadpool_database_service), otherwise db_serv
+    wrapped in a threadpool_database_service
+
+    Parameters
+    ----------
+    db_serv : document_store | async_database_service
+        A database service, either synchronous or asynchronous
+
+    Returns
+    -------
+    object
+        A database service where all methods are coroutines
+
+    Raises
+    ------
+    TypeError
+        If db_serv is neither asynchronous nor a document_store
+    """
+    if isinstance(db_serv, (async_database_service, threadpool_database_service)):
+        return db_serv
+    if not isinstance(db_serv, document_store):
+        raise TypeError(
+            f"{type(db_serv).__name__} does not implement document_store"
+        )
+    return threadpool_database_service(db_serv)
@@ -0,0 +1,110 @@
+import asyncio
+import json
+from pydantic import ValidationError
+from azure.cosmos.exceptions import CosmosHttpResponseError
+
+
+async def iter_ndjson_lines(chunks):
+    """Yields the non-empty lines of a newline delimited json byte stream as
+    soon as each line has been received
+
+    Parameters
+    ----------
+    chunks : AsyncIterator[bytes]
+        The byte stream, e.g. Request.stream()
+    """
+    buffer = bytearray()
+    async for chunk in chunks:
+        buffer.extend(chunk)
+        end = buffer.rfind(b"\n")
+        if end < 0:
+            continue
+        lines = bytes(buffer[:end]).split(b"\n")
+        del buffer[: end + 1]
+        for line in lines:
+            if line.strip():
+                yield line
+    if bytes(buffer).strip():
+        yield bytes(buffer)
+
+
+def validate_document_json(validation_object, body) -> dict:
+    """Validates the raw json of one document and returns the document to be
+    stored.  Models with a validate_document_json classmethod (e.g.
+    analysis_result_document) validate in document mode; other models are
+    validated with model_validate_json and dumped.  Raises
+    pydantic.ValidationError if the document is invalid
+    """
+    if hasattr(validation_object, "validate_document_json"):
+        return validation_object.validate_document_json(body)
+    return validation_object.model_validate_json(body).model_dump()
+
+
+async def bulk_insert(lines, validation_object, post_document, max_concurrency=16):
+    """Validates and writes documents from a stream of json lines.
+
+    Each line is validated with validate_document_json as soon as it is
+    received, and valid documents are written with post_document while
+    the following lines are read.  At most max_concurrency writes are running
+    at the same time; reading pauses until a write has finished, so the memory
+    use does not depend on the size of the upload.
+
+    Parameters
+    ----------
+    lines : AsyncIterator[bytes]
+        The json documents, e.g. from iter_ndjson_lines
+    validation_object : pydantic.BaseModel
+        The model each document is validated against
+    post_document : coroutine function
+        Called with the validated document (as a dict), returns the written
+        document
+    max_concurrency : int
+        The maximum number of concurrent writes
+
+    Returns
+    -------
+    list
+        One status dict per line, in the order of the lines:
+            {"line": 1, "status": 201, "id": "..."}
+            {"line": 2, "status": 422, "errors": [...]}
+            {"line": 3, "status": 409, "error": "error response from database"}
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+    results = []
+
+    async def write(line_number, document):
+        try:
+            written = await post_document(document)
+            return {"line": line_number, "status": 201, "id": written["id"]}
+        except CosmosHttpResponseError:
+            return {
+                "line": line_number,
+                "status": 409,
+                "error": "error response from database",
+            }
+        except Exception as e:
+            return {"line": line_number, "status": 500, "error": str(e)}
+        finally:
+            semaphore.release()
+
+    line_number = 0
+    async for line in lines:
+        line_number += 1
+        try:
+            document = validate_document_json(validation_object, line)
+        except ValidationError as e:
+            results.append(
+                {
+                    "line": line_number,
+                    "status": 422,
+                    "errors": json.loads(e.json(include_url=False)),
+                }
+            )
+            continue
+        await semaphore.acquire()
+        results.append(asyncio.create_task(write(line_number, document)))
+
+    for position, result in enumerate(results):
+        if isinstance(result, asyncio.Task):
+            results[position] = await result
+    return results
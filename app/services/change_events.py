@@ -0,0 +1,21 @@
+class document_change_hub(object):
+    """Distributes notifications about changed documents to in-process
+    subscribers (caches and views that must be invalidated or updated when a
+    document is written).
+
+    Subscribers are callables with the signature
+    subscriber(collection_name: str, document_id: str | None).  document_id is
+    None when the id of the changed document is not known (e.g. for a post).
+    Subscribers are called synchronously and must not block; slow work should be
+    scheduled as a task by the subscriber.
+    """
+
+    def __init__(self):
+        self.subscribers = []
+
+    def subscribe(self, subscriber):
+        self.subscribers.append(subscriber)
+
+    def publish(self, collection_name: str, document_id: str = None):
+        for subscriber in self.subscribers:
+            subscriber(collection_name, document_id)
@@ -0,0 +1,158 @@
+import asyncio
+import os
+import time
+from .request_metrics import get_labels
+
+# The collections cached in process, whose changes must reach every worker
+CHANGE_FEED_COLLECTIONS = ["analyses", "vessels", "soil", "analysis_input"]
+
+
+class change_feed_consumer(object):
+    """Reads the change feed of the cached collections in the background and
+    publishes every changed document to a document_change_hub, so that the
+    in-process caches and views of this worker see the writes done by the other
+    workers and instances.
+
+    Every worker runs its own consumer and keeps its own checkpoint (the change
+    feed continuation token) per collection, since every worker must see every
+    change.  The checkpoint is only advanced after the changes have been
+    published.  It is kept in memory: after a restart the caches are empty, so
+    the feed is read from the time the consumer starts.
+
+    Deleted documents are not in the change feed.  Deletes done by other workers
+    are therefore only seen when the cache entries expire or the caches are
+    refreshed.
+
+    Parameters
+    ----------
+    db_serv : async_database_service
+        The database service to read the change feed from
+    change_hub : document_change_hub
+        The hub the changes are published to
+    collection_names : list, optional
+        The collections to follow.  Defaults to CHANGE_FEED_COLLECTIONS
+    poll_interval_seconds : float, optional
+        Seconds between reads of the change feed.  Defaults to the environment
+        variable CHANGE_FEED_POLL_SECONDS, or 5
+    """
+
+    def __init__(
+        self,
+        db_serv,
+        change_hub,
+        collection_names: list = None,
+        poll_interval_seconds: float = None,
+    ):
+        if collection_names is None:
+            collection_names = CHANGE_FEED_COLLECTIONS
+        if poll_interval_seconds is None:
+            poll_interval_seconds = float(os.getenv("CHANGE_FEED_POLL_SECONDS", "5"))
+        self.db_serv = db_serv
+        self.change_hub = change_hub
+        self.poll_interval_seconds = poll_interval_seconds
+        self.checkpoints = {c: None for c in collection_names}
+        self.stats = {
+            c: {
+                "changes": 0,
+                "errors": 0,
+                "checkpointed_at": None,
+                "lag_seconds": 0.0,
+            }
+            for c in collection_names
+        }
+        self.poll_task = None
+
+    async def poll(self, collection_name: str):
+        """Reads the changes since the checkpoint of the collection, publishes
+        them and advances the checkpoint.  Returns the number of changes
+        """
+        documents, continuation = await self.db_serv.read_change_feed(
+            collection_name, self.checkpoints[collection_name]
+        )
+        for document in documents:
+            self.change_hub.publish(collection_name, document["id"])
+        self.checkpoints[collection_name] = continuation
+        stats = self.stats[collection_name]
+        now = time.time()
+        stats["changes"] += len(documents)
+        stats["checkpointed_at"] = now
+        timestamps = [c["_ts"] for c in documents if c.get("_ts") is not None]
+        stats["lag_seconds"] = max(0.0, now - min(timestamps)) if timestamps else 0.0
+        return len(documents)
+
+    async def poll_all(self):
+        """Polls all collections.  A failing collection does not stop the others"""
+        for collection_name in self.checkpoints:
+            try:
+                await self.poll(collection_name)
+            except Exception:
+                self.stats[collection_name]["errors"] += 1
+
+    async def _poll_loop(self):
+        while True:
+            await self.poll_all()
+            await asyncio.sleep(self.poll_interval_seconds)
+
+    def start(self):
+        """Starts following the change feeds in the background"""
+        if self.poll_task is None:
+            self.poll_task = asyncio.get_running_loop().create_task(self._poll_loop())
+
+    async def stop(self):
+        if self.poll_task is not None:
+            self.poll_task.cancel()
+            try:
+                await self.poll_task
+            except asyncio.CancelledError:
+                pass
+            self.poll_task = None
+
+    def get_checkpoint_age_seconds(self, collection_name: str):
+        """Returns the seconds since the collection was last read to the end of
+        its change feed, the bound on how stale the caches can be, or None if it
+        has not been read yet
+        """
+        checkpointed_at = self.stats[collection_name]["checkpointed_at"]
+        if checkpointed_at is None:
+            return None
+        return time.time() - checkpointed_at
+
+    def render_metrics(self, prefix: str):
+        """Returns the lag metrics as lines in the Prometheus text format.  Can be
+        added to a metrics_registry
+        """
+        lines = []
+        for metric, metric_type, help_text, get_value in [
+            (
+                "change_feed_changes_total",
+                "counter",
+                "Changed documents read from the change feed",
+                lambda c: self.stats[c]["changes"],
+            ),
+            (
+                "change_feed_errors_total",
+                "counter",
+                "Failed reads of the change feed",
+                lambda c: self.stats[c]["errors"],
+            ),
+            (
+                "change_feed_lag_seconds",
+                "gauge",
+                "Age of the oldest change in the last read of the change feed",
+                lambda c: self.stats[c]["lag_seconds"],
+            ),
+            (
+                "change_feed_checkpoint_age_seconds",
+                "gauge",
+                "Seconds since the change feed was last read to the end",
+                self.get_checkpoint_age_seconds,
+            ),
+        ]:
+            name = f"{prefix}_{metric}"
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"]
+            for collection_name in self.checkpoints:
+                value = get_value(collection_name)
+                if value is not None:
+                    labels = get_labels(collection=collection_name)
+                    lines.append(f"{name}{{{labels}}} {value}")
+        return lines
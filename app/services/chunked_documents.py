@@ -0,0 +1,530 @@
+import asyncio
+import json
+import os
+import uuid
+from azure.cosmos.exceptions import (
+    CosmosAccessConditionFailedError,
+    CosmosResourceNotFoundError,
+)
+from .document_patch import MAX_PATCH_ATTEMPTS, apply_patch
+from .query_builder import project_document
+
+# The key of the documents of each collection that is split into child documents
+# in the chunked layout
+CHUNKED_KEYS = {"analyses": "all_seastate_results"}
+# The key of a header document describing its child documents
+LAYOUT_KEY = "chunked_layout"
+# The number of times a chunked document is read again when a child document has
+# been replaced by a concurrent write between reading the header and the children
+MAX_CHUNKED_READ_ATTEMPTS = 3
+
+
+def get_chunk_collection_name(collection_name: str):
+    """Returns the collection holding the child documents of the collection.  In
+    cosmos, the container must be partitioned by /parent_id, so that all
+    children of a document are in one partition
+    """
+    return f"{collection_name}_chunks"
+
+
+def split_document(document: dict, split_key: str):
+    """Splits the document into a header document and one child document per item
+    in document[split_key].
+
+    The header is the document without split_key, plus a LAYOUT_KEY entry listing
+    the ids and the "meta" of the children, in order.  Each child document holds
+    one item, with the id of the document as "parent_id".  The child ids contain
+    a new random version, so a rewrite never overwrites the children of the
+    current header.
+
+    Returns
+    -------
+    tuple
+        (header, list of child documents)
+    """
+    version = uuid.uuid4().hex[:12]
+    chunks = [
+        {
+            "id": f"{document['id']}.{version}.{i}",
+            "parent_id": document["id"],
+            "meta": item.get("meta", {}) if isinstance(item, dict) else {},
+            "item": item,
+        }
+        for i, item in enumerate(document[split_key])
+    ]
+    header = {k: v for k, v in document.items() if k != split_key}
+    header[LAYOUT_KEY] = {
+        "key": split_key,
+        "position": list(document).index(split_key),
+        "chunks": [{"id": c["id"], "meta": c["meta"]} for c in chunks],
+    }
+    return header, chunks
+
+
+def is_chunked(document):
+    return isinstance(document, dict) and LAYOUT_KEY in document
+
+
+def matches_meta(item_meta: dict, meta_filter: dict = None):
+    """Returns True if the meta dict has all the key-value pairs of meta_filter"""
+    return all(item_meta.get(k) == v for k, v in (meta_filter or {}).items())
+
+
+def filter_items(items: list, meta_filter: dict = None):
+    """Returns the items (e.g. result scatters) whose "meta" matches meta_filter"""
+    if not meta_filter:
+        return items
+    return [c for c in items if matches_meta(c.get("meta", {}), meta_filter)]
+
+
+def assemble_document(header: dict, chunks: dict):
+    """Returns the document stored as the header and its child documents (a dict
+    id -> child document), with the keys in their original order, or None if a
+    child document is missing
+    """
+    layout = header[LAYOUT_KEY]
+    if any(c["id"] not in chunks for c in layout["chunks"]):
+        return None
+    items = list((k, v) for k, v in header.items() if k != LAYOUT_KEY)
+    items.insert(
+        layout["position"],
+        (layout["key"], [chunks[c["id"]]["item"] for c in layout["chunks"]]),
+    )
+    return dict(items)
+
+
+def get_chunk_threshold_bytes():
+    """Reads the environment variable ANALYSES_STORE_CHUNK_THRESHOLD_BYTES.  None
+    (the default) disables the chunked layout for writes
+    """
+    threshold = os.getenv("ANALYSES_STORE_CHUNK_THRESHOLD_BYTES")
+    return None if threshold in [None, ""] else int(threshold)
+
+
+class chunked_database_service(object):
+    """Stores the large documents of the collections in CHUNKED_KEYS in a chunked
+    layout, around an async database service.
+
+    A document whose json is larger than chunk_threshold_bytes is written as a
+    header document in the collection (the document without e.g.
+    all_seastate_results) and one child document per item (per result scatter,
+    i.e. per location and result_type) in get_chunk_collection_name(collection).
+    This keeps documents below the cosmos size limit, and lets reads that need
+    only the metadata, or only some of the scatters, transfer and pay for a
+    fraction of the document.
+
+    The layout is transparent: get_one_document_by_id, get_one_document_with_etag,
+    get_one_document_with_version, get_many_documents_by_id and the listing
+    methods return assembled documents, reading only the headers when the
+    selected keys do not include the split key.
+    get_split_items_with_etag reads only the children matching a meta filter.
+    The etag of a chunked document is the etag of its header, which is rewritten
+    on every write.
+
+    Writes are split when chunk_threshold_bytes is set.  Documents below the
+    threshold, and all documents when it is None, are stored as before.  Whether
+    a stored document is chunked is decided from its header, so chunked
+    documents are still read, patched, replaced (unsplit) and deleted with their
+    children when the threshold is unset.  The collection of the child documents
+    is created, partitioned by /parent_id, before the first chunked write.
+
+    Parameters
+    ----------
+    db_serv : async_database_service
+        The database service to wrap
+    chunk_threshold_bytes : int, optional
+        The size above which documents are split.  Defaults to
+        get_chunk_threshold_bytes()
+    """
+
+    def __init__(self, db_serv, chunk_threshold_bytes: int = None):
+        self.db_serv = db_serv
+        if chunk_threshold_bytes is None:
+            chunk_threshold_bytes = get_chunk_threshold_bytes()
+        self.chunk_threshold_bytes = chunk_threshold_bytes
+        self.created_chunk_collections = set()
+
+    def __getattr__(self, name):
+        return getattr(self.db_serv, name)
+
+    def _writes_chunks(self, collection_name: str):
+        return self.chunk_threshold_bytes is not None and collection_name in CHUNKED_KEYS
+
+    async def _get_layout(self, collection_name: str, document_id: str):
+        """Returns the id and the chunked layout (if any) of the stored document,
+        without reading the document, or None if it does not exist
+        """
+        documents = await self.db_serv.get_many_documents_by_id(
+            collection_name, [document_id], ["id", LAYOUT_KEY]
+        )
+        return documents[0]
+
+    def _should_split(self, collection_name: str, document: dict):
+        split_key = CHUNKED_KEYS.get(collection_name)
+        return (
+            self._writes_chunks(collection_name)
+            and isinstance(document.get(split_key), list)
+            and len(json.dumps(document, default=str)) > self.chunk_threshold_bytes
+        )
+
+    async def _read_chunks(self, collection_name: str, parent_ids: list, chunk_ids=None):
+        """Returns a dict id -> child document of the children of the given
+        documents, only of the given child ids if chunk_ids is given
+        """
+        if len(parent_ids) == 1:
+            filters = [("parent_id", "=", parent_ids[0])]
+        else:
+            filters = [("parent_id", "in", parent_ids)]
+        if chunk_ids is not None:
+            filters.append(("id", "in", chunk_ids))
+        chunks = await self.db_serv.get_all_documents_short(
+            get_chunk_collection_name(collection_name), None, filters
+        )
+        return {c["id"]: c for c in chunks}
+
+    async def _assemble_documents(self, collection_name: str, documents: list):
+        """Assembles the chunked documents in the list (of documents or None),
+        reading the children of all of them at once
+        """
+        headers = [c for c in documents if is_chunked(c)]
+        if len(headers) == 0:
+            return documents
+        chunks = await self._read_chunks(collection_name, [c["id"] for c in headers])
+        assembled = []
+        for document in documents:
+            if is_chunked(document):
+                full_document = assemble_document(document, chunks)
+                if full_document is None:
+                    full_document, _ = await self.get_one_document_with_etag(
+                        collection_name, document["id"]
+                    )
+                document = full_document
+            assembled.append(document)
+        return assembled
+
+    def _get_read_keys(self, collection_name: str, selected_keys: list = None):
+        """Returns the keys to read from the wrapped service and whether the
+        documents must be assembled, for the keys selected by the caller
+        """
+        split_key = CHUNKED_KEYS.get(collection_name)
+        if split_key is None:
+            return selected_keys, False
+        if selected_keys is None:
+            return None, True
+        if any(c == split_key or c.startswith(split_key + ".") for c in selected_keys):
+            return selected_keys + ["id", LAYOUT_KEY], True
+        return selected_keys, False
+
+    async def _get_selected_documents(
+        self, collection_name: str, documents: list, selected_keys: list = None
+    ):
+        documents = await self._assemble_documents(collection_name, documents)
+        if selected_keys is None:
+            return documents
+        return [
+            None if c is None else project_document(c, selected_keys) for c in documents
+        ]
+
+    async def get_one_document_with_etag(
+        self, collection_name: str, document_id: str, etag: str = None
+    ):
+        """Gets one document with its etag.  See
+        database_service.get_one_document_with_etag
+        """
+        document, etag, _ = await self.get_one_document_with_version(
+            collection_name, document_id, etag
+        )
+        return document, etag
+
+    async def get_one_document_with_version(
+        self, collection_name: str, document_id: str, etag: str = None
+    ):
+        """Gets one document with its etag and modification time.  The etag and
+        modification time are those of the header, which is rewritten whenever
+        the document is.  See database_service.get_one_document_with_version
+        """
+        for _ in range(MAX_CHUNKED_READ_ATTEMPTS):
+            if etag is None:
+                (
+                    header,
+                    new_etag,
+                    last_modified,
+                ) = await self.db_serv.get_one_document_with_version(
+                    collection_name, document_id
+                )
+            else:
+                (
+                    header,
+                    new_etag,
+                    last_modified,
+                ) = await self.db_serv.get_one_document_with_version(
+                    collection_name, document_id, etag
+                )
+            if not is_chunked(header):
+                return header, new_etag, last_modified
+            chunks = await self._read_chunks(collection_name, [document_id])
+            document = assemble_document(header, chunks)
+            if document is not None:
+                return document, new_etag, last_modified
+            etag = None
+        raise CosmosResourceNotFoundError()
+
+    async def get_one_document_by_id(self, collection_name: str, document_id: str):
+        header = await self.db_serv.get_one_document_by_id(collection_name, document_id)
+        if not is_chunked(header):
+            return header
+        chunks = await self._read_chunks(collection_name, [document_id])
+        document = assemble_document(header, chunks)
+        if document is None:
+            # the document was rewritten between reading the header and children
+            document, _ = await self.get_one_document_with_etag(
+                collection_name, document_id
+            )
+        return document
+
+    async def get_split_items_with_etag(
+        self, collection_name: str, document_id: str, meta_filter: dict = None
+    ):
+        """Returns the items of the split key of the document (e.g. the result
+        scatters of all_seastate_results) whose meta matches meta_filter (e.g.
+        {"location": "wh_datum"}), and the etag of the document.  Only the
+        matching child documents are read.  Returns (None, None) if the document
+        does not exist
+        """
+        split_key = CHUNKED_KEYS[collection_name]
+        for _ in range(MAX_CHUNKED_READ_ATTEMPTS):
+            header, etag = await self.db_serv.get_one_document_with_etag(
+                collection_name, document_id
+            )
+            if not header:
+                return None, None
+            if not is_chunked(header):
+                return filter_items(header.get(split_key, []), meta_filter), etag
+            chunk_ids = [
+                c["id"]
+                for c in header[LAYOUT_KEY]["chunks"]
+                if matches_meta(c["meta"], meta_filter)
+            ]
+            if len(chunk_ids) == 0:
+                return [], etag
+            chunks = await self._read_chunks(collection_name, [document_id], chunk_ids)
+            if all(c in chunks for c in chunk_ids):
+                return [chunks[c]["item"] for c in chunk_ids], etag
+        raise CosmosResourceNotFoundError()
+
+    async def get_many_documents_by_id(
+        self, collection_name: str, document_ids: list, selected_keys: list = None
+    ):
+        read_keys, assemble = self._get_read_keys(collection_name, selected_keys)
+        if not assemble:
+            return await self.db_serv.get_many_documents_by_id(
+                collection_name, document_ids, selected_keys
+            )
+        documents = await self.db_serv.get_many_documents_by_id(
+            collection_name, document_ids, read_keys
+        )
+        return await self._get_selected_documents(
+            collection_name, documents, _with_id(selected_keys)
+        )
+
+    async def iter_many_documents_by_id(
+        self,
+        collection_name: str,
+        document_ids: list,
+        selected_keys: list = None,
+        **kwargs,
+    ):
+        read_keys, assemble = self._get_read_keys(collection_name, selected_keys)
+        async for documents in self.db_serv.iter_many_documents_by_id(
+            collection_name, document_ids, read_keys, **kwargs
+        ):
+            if assemble:
+                documents = await self._get_selected_documents(
+                    collection_name, documents, _with_id(selected_keys)
+                )
+            yield documents
+
+    async def get_all_documents_short(
+        self, collection_name: str, selected_keys: list = None, filters: list = None
+    ):
+        read_keys, assemble = self._get_read_keys(collection_name, selected_keys)
+        documents = await self.db_serv.get_all_documents_short(
+            collection_name, read_keys, filters
+        )
+        if not assemble:
+            return documents
+        return await self._get_selected_documents(
+            collection_name, documents, selected_keys
+        )
+
+    async def get_documents_page(
+        self,
+        collection_name: str,
+        page_size: int,
+        continuation: str = None,
+        selected_keys: list = None,
+        filters: list = None,
+    ):
+        read_keys, assemble = self._get_read_keys(collection_name, selected_keys)
+        documents, next_continuation = await self.db_serv.get_documents_page(
+            collection_name,
+            page_size,
+            continuation,
+            selected_keys=read_keys,
+            filters=filters,
+        )
+        if assemble:
+            documents = await self._get_selected_documents(
+                collection_name, documents, selected_keys
+            )
+        return documents, next_continuation
+
+    async def iter_document_pages(
+        self,
+        collection_name: str,
+        page_size: int = None,
+        selected_keys: list = None,
+        filters: list = None,
+    ):
+        read_keys, assemble = self._get_read_keys(collection_name, selected_keys)
+        async for documents in self.db_serv.iter_document_pages(
+            collection_name, page_size, selected_keys=read_keys, filters=filters
+        ):
+            if assemble:
+                documents = await self._get_selected_documents(
+                    collection_name, documents, selected_keys
+                )
+            yield documents
+
+    async def get_all_documents(self, collection_name: str):
+        documents = await self.db_serv.get_all_documents(collection_name)
+        return await self._assemble_documents(collection_name, documents)
+
+    async def _write_chunks(self, collection_name: str, chunks: list):
+        chunk_collection = get_chunk_collection_name(collection_name)
+        if chunk_collection not in self.created_chunk_collections:
+            await self.db_serv.create_collection_if_not_exists(
+                chunk_collection, "/parent_id"
+            )
+            self.created_chunk_collections.add(chunk_collection)
+        await asyncio.gather(
+            *[self.db_serv.upsert_one_document(chunk_collection, c) for c in chunks]
+        )
+
+    async def _delete_chunk_ids(self, collection_name: str, chunk_ids):
+        chunk_collection = get_chunk_collection_name(collection_name)
+        await asyncio.gather(
+            *[
+                self.db_serv.delete_one_document_by_id(chunk_collection, c)
+                for c in chunk_ids
+            ]
+        )
+
+    async def _delete_chunks(self, collection_name: str, document_id: str, keep=()):
+        """Deletes the child documents of the document, except the ids in keep"""
+        chunks = await self.db_serv.get_all_documents_short(
+            get_chunk_collection_name(collection_name),
+            ["id"],
+            [("parent_id", "=", document_id)],
+        )
+        await self._delete_chunk_ids(
+            collection_name, [c["id"] for c in chunks if c["id"] not in keep]
+        )
+
+    async def post_one_document(self, collection_name: str, document: dict):
+        if not self._should_split(collection_name, document):
+            return await self.db_serv.post_one_document(collection_name, document)
+        document["id"] = str(uuid.uuid4())
+        header, chunks = split_document(document, CHUNKED_KEYS[collection_name])
+        await self._write_chunks(collection_name, chunks)
+        await self.db_serv.upsert_one_document(collection_name, header)
+        return document
+
+    async def replace_one_document(
+        self, collection_name: str, doc_id: str, replace_item: dict, etag: str = None
+    ):
+        """Replaces one document.  The new version is split if it is larger than
+        the threshold; the children of the previous version are deleted once the
+        header has been replaced
+        """
+        if collection_name not in CHUNKED_KEYS or (
+            not self._writes_chunks(collection_name)
+            and not is_chunked(await self._get_layout(collection_name, doc_id))
+        ):
+            if etag is None:
+                return await self.db_serv.replace_one_document(
+                    collection_name, doc_id, replace_item
+                )
+            return await self.db_serv.replace_one_document(
+                collection_name, doc_id, replace_item, etag
+            )
+        keep = set()
+        document = replace_item
+        if self._should_split(collection_name, replace_item):
+            document = {**replace_item, "id": doc_id}
+            replace_item, chunks = split_document(
+                document, CHUNKED_KEYS[collection_name]
+            )
+            keep = {c["id"] for c in chunks}
+            await self._write_chunks(collection_name, chunks)
+        try:
+            result = await self.db_serv.replace_one_document(
+                collection_name, doc_id, replace_item, etag
+            )
+        except Exception:
+            await self._delete_chunk_ids(collection_name, keep)
+            raise
+        await self._delete_chunks(collection_name, doc_id, keep)
+        return document if len(keep) > 0 else result
+
+    async def patch_one_document(
+        self, collection_name: str, document_id: str, updates: list[dict]
+    ):
+        """Patches one document.  Chunked documents are assembled, patched and
+        replaced, guarded by the etag of the header
+        """
+        if collection_name not in CHUNKED_KEYS:
+            return await self.db_serv.patch_one_document(
+                collection_name=collection_name,
+                document_id=document_id,
+                updates=updates,
+            )
+        header = await self._get_layout(collection_name, document_id)
+        if not header:
+            raise CosmosResourceNotFoundError()
+        if not is_chunked(header):
+            return await self.db_serv.patch_one_document(
+                collection_name=collection_name,
+                document_id=document_id,
+                updates=updates,
+            )
+        for attempt in range(MAX_PATCH_ATTEMPTS):
+            document, etag = await self.get_one_document_with_etag(
+                collection_name, document_id
+            )
+            document = apply_patch(document, updates)
+            try:
+                return await self.replace_one_document(
+                    collection_name, document_id, document, etag
+                )
+            except CosmosAccessConditionFailedError:
+                if attempt == MAX_PATCH_ATTEMPTS - 1:
+                    raise
+
+    async def delete_one_document_by_id(self, collection_name: str, document_id: str):
+        header = None
+        if collection_name in CHUNKED_KEYS:
+            header = await self._get_layout(collection_name, document_id)
+        result = await self.db_serv.delete_one_document_by_id(
+            collection_name, document_id
+        )
+        if is_chunked(header):
+            await self._delete_chunks(collection_name, document_id)
+        return result
+
+
+def _with_id(selected_keys):
+    """The keys returned by get_many_documents_by_id, which always include "id" """
+    if selected_keys is None:
+        return None
+    return ["id"] + [c for c in selected_keys if c != "id"]
@@ -0,0 +1,200 @@
+import os
+import zlib
+import anyio.to_thread
+import brotli
+from starlette.datastructures import Headers, MutableHeaders
+from .request_metrics import record_phase
+
+# Content types that are already compressed or must not be buffered
+EXCLUDED_CONTENT_TYPES = (
+    "application/gzip",
+    "application/zip",
+    "image/*",
+    "text/event-stream",
+    "video/*",
+)
+
+
+def get_accepted_encoding(accept_encoding: str, encodings: list):
+    """Returns the first of the encodings (in order of preference) accepted by
+    the Accept-Encoding header, or None.  Encodings with q=0 are not accepted
+    """
+    accepted = {}
+    for item in (accept_encoding or "").split(","):
+        name, _, parameters = item.partition(";")
+        quality = 1.0
+        for parameter in parameters.split(";"):
+            key, _, value = parameter.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[name.strip().lower()] = quality
+    for encoding in encodings:
+        if accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+
+def _is_excluded_content_type(content_type: str):
+    media_type = content_type.partition(";")[0].strip().lower()
+    return (
+        media_type in EXCLUDED_CONTENT_TYPES
+        or media_type.partition("/")[0] + "/*" in EXCLUDED_CONTENT_TYPES
+    )
+
+
+class _stream_compressor(object):
+    """Compresses a response body that may be sent in several messages"""
+
+    def __init__(self, encoding: str, gzip_level: int, brotli_quality: int):
+        if encoding == "br":
+            self.compressor = brotli.Compressor(quality=brotli_quality)
+        else:
+            self.compressor = zlib.compressobj(
+                gzip_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS
+            )
+        self.encoding = encoding
+
+    def compress(self, body: bytes, more_body: bool) -> bytes:
+        if self.encoding == "br":
+            if more_body:
+                return self.compressor.process(body) + self.compressor.flush()
+            return self.compressor.process(body) + self.compressor.finish()
+        if more_body:
+            return self.compressor.compress(body) + self.compressor.flush(
+                zlib.Z_SYNC_FLUSH
+            )
+        return self.compressor.compress(body) + self.compressor.flush()
+
+
+class _compression_responder(object):
+    """Compresses the response of one request with the negotiated encoding
+    (None sends the body as is).  The response start message is held back
+    until the first body message shows whether the body is compressed
+    """
+
+    def __init__(self, middleware, encoding: str, send):
+        self.middleware = middleware
+        self.encoding = encoding
+        self.send = send
+        self.start_message = None
+        self.passthrough = False
+        self.compressor = None
+
+    async def __call__(self, message):
+        if message["type"] == "http.response.start":
+            headers = Headers(raw=message["headers"])
+            self.passthrough = (
+                "content-encoding" in headers
+                or message["status"] == 206
+                or _is_excluded_content_type(headers.get("content-type", ""))
+            )
+            if self.passthrough:
+                await self.send(message)
+            else:
+                self.start_message = message
+        elif message["type"] != "http.response.body" or self.passthrough:
+            if self.start_message is not None:
+                await self.send(self.start_message)
+                self.start_message = None
+            await self.send(message)
+        elif self.start_message is not None:
+            await self._send_first_body(message)
+        else:
+            await self._send_body(message)
+
+    async def _send_first_body(self, message):
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        start_message, self.start_message = self.start_message, None
+        if len(body) < self.middleware.minimum_size and not more_body:
+            await self.send(start_message)
+            await self.send(message)
+            return
+        headers = MutableHeaders(raw=start_message["headers"])
+        headers.add_vary_header("Accept-Encoding")
+        if self.encoding is not None:
+            self.compressor = _stream_compressor(
+                self.encoding,
+                self.middleware.gzip_level,
+                self.middleware.brotli_quality,
+            )
+            message["body"] = await self._compress(body, more_body)
+            headers["Content-Encoding"] = self.encoding
+            if more_body:
+                del headers["Content-Length"]
+            else:
+                headers["Content-Length"] = str(len(message["body"]))
+            etag = headers.get("etag")
+            if etag is not None and not etag.startswith("W/"):
+                # a strong etag identifies the exact bytes of one representation
+                headers["ETag"] = "W/" + etag
+        await self.send(start_message)
+        await self.send(message)
+
+    async def _send_body(self, message):
+        if self.compressor is not None:
+            message["body"] = await self._compress(
+                message.get("body", b""), message.get("more_body", False)
+            )
+        await self.send(message)
+
+    async def _compress(self, body: bytes, more_body: bool) -> bytes:
+        with record_phase("compression"):
+            if len(body) >= self.middleware.thread_minimum_size:
+                # large bodies would block the event loop
+                return await anyio.to_thread.run_sync(
+                    self.compressor.compress, body, more_body
+                )
+            return self.compressor.compress(body, more_body)
+
+
+class compression_middleware(object):
+    """Compresses response bodies of at least minimum_size bytes with brotli or
+    gzip, as negotiated with the Accept-Encoding header (brotli is preferred).
+    Streamed responses are compressed as they are sent.  The time spent
+    compressing is recorded in the "compression" phase of the current request
+
+    Parameters
+    ----------
+    app : ASGIApp
+        The app to wrap
+    minimum_size : int, optional
+        Smaller bodies are sent uncompressed.  Defaults to the environment
+        variable COMPRESSION_MINIMUM_BYTES, or 1024
+    gzip_level : int, optional
+        The gzip compression level (1-9)
+    brotli_quality : int, optional
+        The brotli quality (0-11).  The default is a good tradeoff between
+        compression ratio and speed for multi-megabyte json
+    thread_minimum_size : int, optional
+        Body messages of at least this many bytes are compressed in a worker
+        thread
+    """
+
+    def __init__(
+        self,
+        app,
+        minimum_size: int = None,
+        gzip_level: int = 6,
+        brotli_quality: int = 4,
+        thread_minimum_size: int = 128 * 1024,
+    ):
+        if minimum_size is None:
+            minimum_size = int(os.getenv("COMPRESSION_MINIMUM_BYTES", "1024"))
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.thread_minimum_size = thread_minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = get_accepted_encoding(
+            Headers(scope=scope).get("Accept-Encoding"), ["br", "gzip"]
+        )
+        await self.app(scope, receive, _compression_responder(self, encoding, send))
@@ -0,0 +1,29 @@
+import os
+from .async_database_service import async_database_service
+from .local_database_service import memory_database_service, sqlite_database_service
+
+DATABASE_BACKENDS = {
+    "cosmos": async_database_service,
+    "sqlite": sqlite_database_service,
+    "memory": memory_database_service,
+}
+
+
+def get_database_service(backend: str = None):
+    """Creates the database service of the given backend
+
+    Parameters
+    ----------
+    backend : str, optional
+        One of "cosmos" (azure cosmos, the default), "sqlite" (a SQLite file, see
+        sqlite_database_service) or "memory".  Defaults to the environment
+        variable ANALYSES_STORE_BACKEND
+    """
+    if backend is None:
+        backend = os.getenv("ANALYSES_STORE_BACKEND", "cosmos")
+    if backend not in DATABASE_BACKENDS:
+        raise ValueError(
+            f"unknown database backend {backend!r}, "
+            f"must be one of {list(DATABASE_BACKENDS)}"
+        )
+    return DATABASE_BACKENDS[backend]()
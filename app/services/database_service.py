@@ -1,11 +1,26 @@
-from azure.cosmos import CosmosClient
+from azure.cosmos import CosmosClient, PartitionKey
+from azure.cosmos.exceptions import (
+    CosmosAccessConditionFailedError,
+    CosmosResourceNotFoundError,
+)
+from azure.core import MatchConditions
 import uuid
 import os
 from ..models.jsonpatch import json_patch_modify
-import jsonpatch
+from .query_builder import build_query
+from .request_metrics import record_cosmos_request, record_cosmos_response
+from .document_store import document_store
+from .document_patch import (
+    MAX_PATCH_ATTEMPTS,
+    apply_patch,
+    to_cosmos_patch_operations,
+)
 
+# The number of changed documents read per change feed response
+CHANGE_FEED_PAGE_SIZE = 100
 
-class database_service(object):
+
+class database_service(document_store):
     """Service object to handle data stored in the azure cosmos db document
     database
 
@@ -16,14 +31,92 @@ class database_service(object):
     """
 
     def __init__(self):
-        HOST = os.getenv("SQLAZURECONNSTR_AZURE_COSMOS_DB_HOST")
-        MASTER_KEY = os.getenv("SQLAZURECONNSTR_AZURE_COSMOS_DB_MASTER_KEY")
+        self.host = os.getenv("SQLAZURECONNSTR_AZURE_COSMOS_DB_HOST")
+        self.master_key = os.getenv("SQLAZURECONNSTR_AZURE_COSMOS_DB_MASTER_KEY")
+        self.client = None
+        self.data_base_proxy = None
+        self.containers = {}
+
+    def open(self):
+        """Creates the CosmosClient.  The client is not created by the
+        constructor, to keep it out of the import and startup of the app; open()
+        is called from the lifespan handler of the FastAPI app, or on first use.
+        Calling open() on an already open service does nothing
+        """
+        if self.data_base_proxy is None:
+            self.client = CosmosClient(
+                self.host,
+                self.master_key,
+                raw_request_hook=record_cosmos_request,
+                raw_response_hook=record_cosmos_response,
+            )
+            self.data_base_proxy = self.client.get_database_client("dynops-store-data")
+
+    def build_container_registry(self):
+        """Reads the properties of all containers in the database in one call and
+        registers the container client and partition key path of each of them, so
+        that no container metadata has to be read while serving requests
+        """
+        self.open()
+        for properties in self.data_base_proxy.list_containers():
+            self.containers[properties["id"]] = {
+                "client": self.data_base_proxy.get_container_client(properties["id"]),
+                "partition_key_path": _get_partition_key_path(properties),
+            }
 
-        self.client = CosmosClient(HOST, MASTER_KEY)
-        self.data_base_proxy = self.client.get_database_client("dynops-store-data")
+    def _get_container_entry(self, collection_name: str):
+        """Returns the registry entry for the given collection, registering the
+        collection on first use if it was not found by build_container_registry
+
+        Parameters
+        ----------
+        collection_name : str
+            The name of the container
+
+        Returns
+        -------
+        dict
+            A dict with the container client ("client") and the partition key path
+            ("partition_key_path") of the container
+        """
+        if collection_name not in self.containers:
+            self.open()
+            container = self.data_base_proxy.get_container_client(collection_name)
+            self.containers[collection_name] = {
+                "client": container,
+                "partition_key_path": _get_partition_key_path(container.read()),
+            }
+        return self.containers[collection_name]
+
+    def _get_container(self, collection_name: str):
+        return self._get_container_entry(collection_name)["client"]
+
+    def create_collection_if_not_exists(
+        self, collection_name: str, partition_key_path: str
+    ):
+        """Creates the container with the given partition key path (e.g.
+        "/parent_id") if it does not exist, and registers it
+
+        Parameters
+        ----------
+        collection_name : str
+            The name of the container
+        partition_key_path : str
+            The partition key path used if the container is created
+        """
+        self.open()
+        container = self.data_base_proxy.create_container_if_not_exists(
+            id=collection_name, partition_key=PartitionKey(path=partition_key_path)
+        )
+        self.containers[collection_name] = {
+            "client": container,
+            "partition_key_path": _get_partition_key_path(container.read()),
+        }
 
     def get_one_document_by_id(self, collection_name: str, document_id: str):
-        """Gets one document from the azure cosmos document database
+        """Gets one document from the azure cosmos document database.  The document
+        is fetched with a single partition point read when the partition key of the
+        container is the document id, otherwise with a cross partition query.
 
         Parameters
         ----------
@@ -38,9 +131,20 @@ class database_service(object):
         dict
             A dictionarry containing the document with the document id.  The key
             value pairs of internal azure database dict keys ("_rid", "_self",
-            "_etag", "_attachments", "_ts") are removed.
+            "_etag", "_attachments", "_ts") are removed.  An empty list is
+            returned if the document does not exist.
         """
-        container = self.data_base_proxy.get_container_client(collection_name)
+        container_entry = self._get_container_entry(collection_name)
+        container = container_entry["client"]
+        if container_entry["partition_key_path"] == "/id":
+            try:
+                document = container.read_item(
+                    item=document_id, partition_key=document_id
+                )
+            except CosmosResourceNotFoundError:
+                return []
+            return _remove_internal_dict_keys(document)
+
         q_string = "SELECT * FROM d WHERE  d.id =@id"
         q_results = container.query_items(
             query=q_string,
@@ -53,6 +157,114 @@ class database_service(object):
         else:
             return [_remove_internal_dict_keys(c) for c in list(q_results)][0]
 
+    def get_one_document_with_version(
+        self, collection_name: str, document_id: str, etag: str = None
+    ):
+        """Gets one document together with its etag and modification time (the
+        _ts of the document).  If an etag is given, the document is read
+        conditionally (If-None-Match), and the body is only transferred if the
+        document has changed since the etag was issued
+
+        Parameters
+        ----------
+        collection_name : str
+            The name of the container to extract documents from.  Can be one of the
+            following["analyses", "vessels", "settings"]
+        document_id : str
+            The id of the document to extract
+        etag : str, optional
+            The etag of a previously read version of the document
+
+        Returns
+        -------
+        tuple
+            A tuple (document, etag, last_modified), where last_modified is the
+            _ts of the document in seconds since the epoch.  The document has the
+            internal azure database dict keys removed.  document is None if the
+            document is unchanged since the given etag (last_modified is then
+            None), and an empty list if the document does not exist.
+        """
+        container_entry = self._get_container_entry(collection_name)
+        container = container_entry["client"]
+        if container_entry["partition_key_path"] != "/id":
+            q_results = list(
+                container.query_items(
+                    query="SELECT * FROM d WHERE  d.id =@id",
+                    parameters=[{"name": "@id", "value": document_id}],
+                    enable_cross_partition_query=True,
+                )
+            )
+            document = q_results[0] if len(q_results) > 0 else None
+        else:
+            conditional_kwargs = {}
+            if etag is not None:
+                conditional_kwargs = {
+                    "etag": etag,
+                    "match_condition": MatchConditions.IfModified,
+                }
+            try:
+                document = container.read_item(
+                    item=document_id, partition_key=document_id, **conditional_kwargs
+                )
+            except CosmosResourceNotFoundError:
+                document = None
+        return _get_document_version(document, etag)
+
+    def get_many_documents_by_id(
+        self, collection_name: str, document_ids: list, selected_keys: list = None
+    ):
+        """Gets several documents in one round trip.  The documents are fetched
+        with a batched point read (read_items) when the partition key of the
+        container is the document id and no projection is given, otherwise with
+        one ARRAY_CONTAINS query
+
+        Parameters
+        ----------
+        collection_name : str
+            The name of the container to extract documents from.  Can be one of the
+            following["analyses", "vessels", "settings"]
+        document_ids : list
+            The ids of the documents to extract
+        selected_keys : list, optional
+            If given, only these document keys (and "id") are returned
+
+        Returns
+        -------
+        list
+            One item per id in document_ids, in the same order: the document with
+            the internal azure database dict keys removed, or None if the document
+            does not exist
+        """
+        unique_ids = list(dict.fromkeys(document_ids))
+        if len(unique_ids) == 0:
+            return []
+        container_entry = self._get_container_entry(collection_name)
+        container = container_entry["client"]
+        if selected_keys is None and container_entry["partition_key_path"] == "/id":
+            documents = container.read_items(items=[(c, c) for c in unique_ids])
+        else:
+            documents = container.query_items(
+                query=_get_many_documents_query_string(selected_keys),
+                parameters=[{"name": "@ids", "value": unique_ids}],
+                enable_cross_partition_query=True,
+            )
+        return _get_documents_in_id_order(documents, document_ids)
+
+    def iter_many_documents_by_id(
+        self,
+        collection_name: str,
+        document_ids: list,
+        selected_keys: list = None,
+        chunk_size: int = 100,
+    ):
+        """Yields the result of get_many_documents_by_id for chunks of chunk_size
+        ids at a time, so that the first documents can be sent before all are read
+        """
+        for start in range(0, len(document_ids), chunk_size):
+            yield self.get_many_documents_by_id(
+                collection_name, document_ids[start : start + chunk_size], selected_keys
+            )
+
     def delete_one_document_by_id(self, collection_name: str, document_id: str):
         """Deletes one document
 
@@ -69,11 +281,23 @@ class database_service(object):
         _type_
             _description_
         """
-        container = self.data_base_proxy.get_container_client(collection_name)
-        ret_value = container.delete_item(item=document_id, partition_key=document_id)
+        container_entry = self._get_container_entry(collection_name)
+        partition_key = document_id
+        if container_entry["partition_key_path"] != "/id":
+            document = self.get_one_document_by_id(collection_name, document_id)
+            if not document:
+                raise CosmosResourceNotFoundError()
+            partition_key = _get_partition_key_value(
+                document, container_entry["partition_key_path"]
+            )
+        ret_value = container_entry["client"].delete_item(
+            item=document_id, partition_key=partition_key
+        )
         return ret_value
 
-    def get_all_documents_short(self, collection_name: str, selected_keys: list):
+    def get_all_documents_short(
+        self, collection_name: str, selected_keys: list = None, filters: list = None
+    ):
         """Gets all docuemtns from the given collection, returning only the document
         keys in the selected_keys list
 
@@ -82,6 +306,12 @@ class database_service(object):
         collection_name : str
             The name of the container to extract documents from.  Can be one of the
             following["analyses", "vessels", "settings"]
+        selected_keys : list, optional
+            Dotted paths of the document keys to return, e.g. ["id",
+            "metadata.well.name"].  All keys are returned if not given
+        filters : list, optional
+            Conditions (field_path, operator, value) the documents must fulfill,
+            e.g. [("metadata.water_depth", ">=", 100)].  See build_query
 
         Returns
         -------
@@ -89,24 +319,96 @@ class database_service(object):
             A list of dictionarry containing all the documents in the given collection
 
         """
-        container = self.data_base_proxy.get_container_client(collection_name)
-        q_string = "SELECT VALUE {"
-        firstiter = True
-        for selected_key in selected_keys:
-            if firstiter:
-                firstiter = False
-            else:
-                q_string += ","
-
-            q_string += f"{selected_key}: d.{selected_key}"
-        q_string += "} FROM d"
+        container = self._get_container(collection_name)
+        q_string, parameters = build_query(selected_keys, filters)
+        items = container.query_items(
+            query=q_string,
+            parameters=parameters,
+            enable_cross_partition_query=True,
+        )
+
+        return [_remove_internal_dict_keys(c) for c in items]
+
+    def get_documents_page(
+        self,
+        collection_name: str,
+        page_size: int,
+        continuation: str = None,
+        selected_keys: list = None,
+        filters: list = None,
+    ):
+        """Gets one page of documents from the given collection
+
+        Parameters
+        ----------
+        collection_name : str
+            The name of the container to extract documents from.  Can be one of the
+            following["analyses", "vessels", "settings"]
+        page_size : int
+            The maximum number of documents in the page
+        continuation : str, optional
+            The continuation token returned with the previous page.  The first page
+            is returned if not given
+        selected_keys : list, optional
+            If given, only these document keys are returned (as in
+            get_all_documents_short)
+        filters : list, optional
+            Conditions the documents must fulfill (as in get_all_documents_short)
+
+        Returns
+        -------
+        tuple
+            A tuple (documents, continuation) with the list of documents in the page
+            and the continuation token for the next page.  The continuation token
+            is None for the last page.
+        """
+        container = self._get_container(collection_name)
+        q_string, parameters = build_query(selected_keys, filters)
         items = container.query_items(
             query=q_string,
-            parameters=[],
+            parameters=parameters,
             enable_cross_partition_query=True,
+            max_item_count=page_size,
         )
+        pager = items.by_page(continuation)
+        page = next(pager, [])
+        documents = [_remove_internal_dict_keys(c) for c in page]
+        return documents, pager.continuation_token
+
+    def iter_document_pages(
+        self,
+        collection_name: str,
+        page_size: int = None,
+        selected_keys: list = None,
+        filters: list = None,
+    ):
+        """Yields all documents in the given collection, one page (list of
+        documents) at a time as the pages are received from the database, so that
+        only one page has to be held in memory
 
-        return list(items)
+        Parameters
+        ----------
+        collection_name : str
+            The name of the container to extract documents from.  Can be one of the
+            following["analyses", "vessels", "settings"]
+        page_size : int, optional
+            The maximum number of documents in each page
+        selected_keys : list, optional
+            If given, only these document keys are returned (as in
+            get_all_documents_short)
+        filters : list, optional
+            Conditions the documents must fulfill (as in get_all_documents_short)
+        """
+        container = self._get_container(collection_name)
+        q_string, parameters = build_query(selected_keys, filters)
+        items = container.query_items(
+            query=q_string,
+            parameters=parameters,
+            enable_cross_partition_query=True,
+            max_item_count=page_size,
+        )
+        for page in items.by_page():
+            yield [_remove_internal_dict_keys(c) for c in page]
 
     def get_all_documents(self, collection_name: str):
         """_summary_
@@ -124,11 +426,11 @@ class database_service(object):
             The key value pairs of internal azure database dict keys ("_rid", "_self",
             "_etag", "_attachments", "_ts") are removed.
         """
-        container = self.data_base_proxy.get_container_client(collection_name)
+        container = self._get_container(collection_name)
         return [_remove_internal_dict_keys(c) for c in container.read_all_items()]
 
     def replace_one_document(
-        self, collection_name: str, doc_id: str, replace_item: dict
+        self, collection_name: str, doc_id: str, replace_item: dict, etag: str = None
     ):
         """_summary_
 
@@ -143,6 +445,9 @@ class database_service(object):
             Dictionarry containing the elements to be replaced.  All dict keys in
             the replace_item dict will be replaced, dict keys in the database object
             not in the replace_item dict will be unchanged.
+        etag : str, optional
+            If given, the document is only replaced if it is unchanged since this
+            etag was read, otherwise CosmosAccessConditionFailedError is raised
 
         Returns
         -------
@@ -150,8 +455,15 @@ class database_service(object):
             Dictionarry containing the complete document after the given
             key-value pairs have been replaced
         """
-        container = self.data_base_proxy.get_container_client(collection_name)
-        return container.replace_item(item=doc_id, body=replace_item)
+        container = self._get_container(collection_name)
+        if etag is None:
+            return container.replace_item(item=doc_id, body=replace_item)
+        return container.replace_item(
+            item=doc_id,
+            body=replace_item,
+            etag=etag,
+            match_condition=MatchConditions.IfNotModified,
+        )
 
     def post_one_document(self, collection_name: str, document: dict):
         """Post a new documnet into the database.  A new document id will
@@ -172,11 +484,29 @@ class database_service(object):
             A dict containing the document inserted into the database
         """
         document["id"] = str(uuid.uuid4())
-        container = self.data_base_proxy.get_container_client(collection_name)
+        container = self._get_container(collection_name)
         ret_value = container.create_item(body=document)
         return_dict = _remove_internal_dict_keys(ret_value)
         return return_dict
 
+    def upsert_one_document(self, collection_name: str, document: dict):
+        """Inserts the document, or replaces the document with the same id
+
+        Parameters
+        ----------
+        collection_name : str
+            The name of the container
+        document : dict
+            The document to write, with its "id"
+
+        Returns
+        -------
+        dict
+            The document written to the database
+        """
+        container = self._get_container(collection_name)
+        return _remove_internal_dict_keys(container.upsert_item(body=document))
+
     def patch_one_document(
         self, collection_name: str, document_id: str, updates: list[dict]
     ):
@@ -205,18 +535,42 @@ class database_service(object):
         -------
         dict
             A dict containing the document inserted into the database
-        """
-        update_document = self.get_one_document_by_id(
-            collection_name=collection_name, document_id=document_id
-        )
 
-        update_document = jsonpatch.apply_patch(update_document, updates)
-
-        return self.replace_one_document(
-            collection_name=collection_name,
-            doc_id=document_id,
-            replace_item=update_document,
-        )
+        Notes
+        -----
+        When the partition key of the container is the document id and the
+        updates can be expressed as cosmos partial document updates (see
+        to_cosmos_patch_operations), they are sent with a single patch_item call,
+        so only the updates travel to the database.  Otherwise the document is
+        read, patched and written back with replace_item, guarded by the etag of
+        the read.  If the document was modified in between, the patch is applied
+        again to the new version, at most MAX_PATCH_ATTEMPTS times.
+        """
+        container_entry = self._get_container_entry(collection_name)
+        partition_key_path = container_entry["partition_key_path"]
+        operations = to_cosmos_patch_operations(updates, partition_key_path)
+        if operations is not None and partition_key_path == "/id":
+            return container_entry["client"].patch_item(
+                item=document_id, partition_key=document_id, patch_operations=operations
+            )
+
+        for attempt in range(MAX_PATCH_ATTEMPTS):
+            update_document, etag = self.get_one_document_with_etag(
+                collection_name=collection_name, document_id=document_id
+            )
+            if not update_document:
+                raise CosmosResourceNotFoundError()
+            update_document = apply_patch(update_document, updates)
+            try:
+                return self.replace_one_document(
+                    collection_name=collection_name,
+                    doc_id=document_id,
+                    replace_item=update_document,
+                    etag=etag,
+                )
+            except CosmosAccessConditionFailedError:
+                if attempt == MAX_PATCH_ATTEMPTS - 1:
+                    raise
 
     def get_analysis_id_by_vesselid(self, vessel_id):
         """Patch a documnet in the database using the RFC 6902 patch syntax
@@ -246,7 +600,7 @@ class database_service(object):
             A list of dicts containing the analysis id, one for each analysis with the 
             given vessel
         """
-        container = self.data_base_proxy.get_container_client("analyses")
+        container = self._get_container("analyses")
         q_string = "SELECT d.id, d.metadata.vessel_id FROM d WHERE  d.metadata.vessel_id =@vessel_id"
         q_results = container.query_items(
             query=q_string,
@@ -259,10 +613,115 @@ class database_service(object):
         else:
             return q_results
 
+    def read_change_feed(self, collection_name: str, continuation: str = None):
+        """Reads the change feed of the container: the documents created or
+        replaced since the continuation token.  Deleted documents are not in the
+        change feed (latest version mode)
+
+        Parameters
+        ----------
+        collection_name : str
+            The name of the container
+        continuation : str, optional
+            The continuation token returned by the previous call.  If not given,
+            the feed is read from now, so only the token is returned
+
+        Returns
+        -------
+        tuple
+            A list of dicts {"id": ..., "_ts": ...} with the id and modification
+            time (seconds since the epoch) of each changed document, in the order
+            of the changes, and the continuation token for the next call
+        """
+        container = self._get_container(collection_name)
+        last_response = change_feed_response_hook()
+        changes = container.query_items_change_feed(
+            **_get_change_feed_options(continuation),
+            response_hook=last_response,
+        )
+        documents = [{"id": c["id"], "_ts": c.get("_ts")} for c in changes]
+        return documents, last_response.get_continuation()
+
+
+class change_feed_response_hook(object):
+    """response_hook of one change feed query, keeping the headers of the last
+    response of that query.  The SDK sets the etag of these headers to the
+    continuation token of the query, so the token is read from the query's own
+    response rather than from the last_response_headers of the client, which
+    are replaced by every request on the shared client
+    """
+
+    def __init__(self):
+        self.headers = None
+
+    def __call__(self, headers, result):
+        self.headers = headers
+
+    def get_continuation(self):
+        return None if self.headers is None else self.headers.get("etag")
+
+
+def _get_change_feed_options(continuation: str = None):
+    """The change feed cannot be projected, so the changed documents are read in
+    pages of CHANGE_FEED_PAGE_SIZE and only their id and _ts are kept
+    """
+    options = {"max_item_count": CHANGE_FEED_PAGE_SIZE}
+    if continuation is None:
+        options["start_time"] = "Now"
+    else:
+        options["continuation"] = continuation
+    return options
+
+
+def _get_many_documents_query_string(selected_keys=None):
+    """Returns the query selecting the documents with the ids in the parameter
+    @ids.  The id is always selected, so that the documents can be matched to
+    the requested ids
+    """
+    if selected_keys is not None:
+        selected_keys = ["id"] + [c for c in selected_keys if c != "id"]
+    return build_query(selected_keys)[0] + " WHERE ARRAY_CONTAINS(@ids, d.id)"
+
+
+def _get_documents_in_id_order(documents, document_ids):
+    found = {c["id"]: _remove_internal_dict_keys(c) for c in documents}
+    return [found.get(c) for c in document_ids]
+
+
+def _get_partition_key_path(container_properties):
+    """Returns the partition key path (e.g. "/id") from the properties of a
+    container, as returned by ContainerProxy.read() or list_containers()
+    """
+    return container_properties["partitionKey"]["paths"][0]
+
+
+def _get_partition_key_value(document, partition_key_path):
+    value = document
+    for key in partition_key_path.strip("/").split("/"):
+        value = value[key]
+    return value
+
+
+def _get_document_version(document, etag):
+    """Builds the return value of get_one_document_with_version from the raw
+    document returned by the database (None if it does not exist) and the etag
+    sent with the request.  An empty body from a conditional read means "not
+    modified"
+    """
+    if document is None:
+        return [], None, None
+    if etag is not None and (len(document) == 0 or document.get("_etag") == etag):
+        return None, etag, None
+    return (
+        _remove_internal_dict_keys(document),
+        document.get("_etag"),
+        document.get("_ts"),
+    )
+
 
 def _remove_internal_dict_keys(inp_dict):
     return {
         k: v
         for k, v in inp_dict.items()
-        if k not in ["_rid", "_self", "_etag", "_attachments", "_ts"]
+        if k not in ["_rid", "_self", "_etag", "_attachments", "_ts", "_lsn"]
     }
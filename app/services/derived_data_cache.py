@@ -0,0 +1,36 @@
+from collections import OrderedDict
+
+
+class derived_data_cache(object):
+    """LRU cache of values derived from one version of a document (e.g. the
+    seastate matrices of an analysis), so that they are computed once per document
+    version instead of once per request.
+
+    Keys must contain the etag of the document version the value is derived from.
+    Values for documents without a known etag are computed but not cached.
+
+    Parameters
+    ----------
+    max_entries : int
+        The maximum number of cached values
+    """
+
+    def __init__(self, max_entries: int = 64):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+
+    def get(self, key: tuple, etag: str, factory):
+        """Returns the value cached for (key, etag), calling factory() to compute
+        it if it is not cached
+        """
+        if etag is None:
+            return factory()
+        cache_key = (key, etag)
+        if cache_key in self.entries:
+            self.entries.move_to_end(cache_key)
+            return self.entries[cache_key]
+        value = factory()
+        self.entries[cache_key] = value
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return value
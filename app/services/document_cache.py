@@ -0,0 +1,269 @@
+from collections import OrderedDict
+import os
+import time
+from .chunked_documents import CHUNKED_KEYS, filter_items
+
+
+class document_cache(object):
+    """In-process LRU cache of documents read from the database.
+
+    Single documents are stored together with their etag.  An entry younger than
+    ttl_seconds is returned directly, an older entry is revalidated against the
+    database with a conditional read before it is returned.  Whole collections
+    (get_all_documents) are stored without etag and expire after ttl_seconds.
+
+    Parameters
+    ----------
+    max_entries : int
+        The maximum number of single documents kept in the cache.  The least
+        recently used document is evicted when the limit is exceeded
+    ttl_seconds : float
+        The number of seconds a cached value is used without revalidation
+    """
+
+    def __init__(self, max_entries: int = 256, ttl_seconds: float = 5.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.documents = OrderedDict()
+        self.collections = {}
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "revalidations": 0,
+            "not_modified": 0,
+            "evictions": 0,
+            "invalidations": 0,
+        }
+
+    def get_document_entry(self, collection_name: str, document_id: str):
+        """Returns the cache entry for the document, or None if it is not cached.
+        The entry is a dict with the keys "document", "etag", "last_modified" and
+        "validated_at"
+        """
+        key = (collection_name, document_id)
+        entry = self.documents.get(key)
+        if entry is not None:
+            self.documents.move_to_end(key)
+        return entry
+
+    def is_fresh(self, entry):
+        return time.monotonic() - entry["validated_at"] < self.ttl_seconds
+
+    def set_document(
+        self,
+        collection_name: str,
+        document_id: str,
+        document,
+        etag,
+        last_modified: int = None,
+    ):
+        key = (collection_name, document_id)
+        self.documents[key] = {
+            "document": document,
+            "etag": etag,
+            "last_modified": last_modified,
+            "validated_at": time.monotonic(),
+        }
+        self.documents.move_to_end(key)
+        while len(self.documents) > self.max_entries:
+            self.documents.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def get_collection(self, collection_name: str):
+        """Returns the cached list of all documents in the collection, or None if
+        it is not cached or has expired
+        """
+        entry = self.collections.get(collection_name)
+        if entry is None or not self.is_fresh(entry):
+            return None
+        return entry["documents"]
+
+    def set_collection(self, collection_name: str, documents: list):
+        self.collections[collection_name] = {
+            "documents": documents,
+            "validated_at": time.monotonic(),
+        }
+
+    def invalidate(self, collection_name: str, document_id: str = None):
+        """Removes the document (if given) and the cached document list of the
+        collection from the cache
+        """
+        if document_id is not None:
+            self.documents.pop((collection_name, document_id), None)
+        self.collections.pop(collection_name, None)
+        self.stats["invalidations"] += 1
+
+    def get_stats(self):
+        return {**self.stats, "entries": len(self.documents)}
+
+
+class cached_database_service(object):
+    """Read-through cache around an async database service.
+
+    get_one_document_by_id, get_one_document_with_etag,
+    get_one_document_with_version and get_all_documents are served from a
+    document_cache.  post, patch, replace and delete are forwarded
+    to the wrapped service and invalidate the affected cache entries.  All other
+    methods are forwarded unchanged.
+
+    Cached documents are shared between requests and must not be modified by the
+    caller.
+
+    Parameters
+    ----------
+    db_serv : async_database_service
+        The database service to wrap
+    cache : document_cache, optional
+        The cache to use.  If not given, a cache is created with the settings
+        from get_document_cache_settings()
+    """
+
+    def __init__(self, db_serv, cache: document_cache = None):
+        self.db_serv = db_serv
+        if cache is None:
+            cache = document_cache(**get_document_cache_settings())
+        self.cache = cache
+
+    def __getattr__(self, name):
+        return getattr(self.db_serv, name)
+
+    async def get_one_document_with_etag(
+        self, collection_name: str, document_id: str, etag: str = None
+    ):
+        document, etag, _ = await self.get_one_document_with_version(
+            collection_name, document_id, etag
+        )
+        return document, etag
+
+    async def get_one_document_with_version(
+        self, collection_name: str, document_id: str, etag: str = None
+    ):
+        entry = self.cache.get_document_entry(collection_name, document_id)
+        if entry is not None and self.cache.is_fresh(entry):
+            self.cache.stats["hits"] += 1
+            return _get_cached_document_version(entry, etag)
+
+        if entry is None:
+            self.cache.stats["misses"] += 1
+            (
+                document,
+                new_etag,
+                last_modified,
+            ) = await self.db_serv.get_one_document_with_version(
+                collection_name, document_id
+            )
+        else:
+            self.cache.stats["revalidations"] += 1
+            (
+                document,
+                new_etag,
+                last_modified,
+            ) = await self.db_serv.get_one_document_with_version(
+                collection_name, document_id, entry["etag"]
+            )
+            if document is None:
+                self.cache.stats["not_modified"] += 1
+                document = entry["document"]
+                last_modified = entry["last_modified"]
+
+        if new_etag is None:
+            self.cache.invalidate(collection_name, document_id)
+            return document, None, None
+        self.cache.set_document(
+            collection_name, document_id, document, new_etag, last_modified
+        )
+        if etag is not None and etag == new_etag:
+            return None, new_etag, None
+        return document, new_etag, last_modified
+
+    async def get_split_items_with_etag(
+        self, collection_name: str, document_id: str, meta_filter: dict = None
+    ):
+        """Served from the cached document if it is fresh, otherwise forwarded
+        without caching (see chunked_database_service.get_split_items_with_etag)
+        """
+        entry = self.cache.get_document_entry(collection_name, document_id)
+        if entry is not None and self.cache.is_fresh(entry):
+            self.cache.stats["hits"] += 1
+            split_key = CHUNKED_KEYS[collection_name]
+            items = entry["document"].get(split_key, [])
+            return filter_items(items, meta_filter), entry["etag"]
+        return await self.db_serv.get_split_items_with_etag(
+            collection_name, document_id, meta_filter
+        )
+
+    async def get_one_document_by_id(self, collection_name: str, document_id: str):
+        document, _ = await self.get_one_document_with_etag(
+            collection_name, document_id
+        )
+        return document
+
+    async def get_all_documents(self, collection_name: str):
+        documents = self.cache.get_collection(collection_name)
+        if documents is not None:
+            self.cache.stats["hits"] += 1
+            return documents
+        self.cache.stats["misses"] += 1
+        documents = await self.db_serv.get_all_documents(collection_name)
+        self.cache.set_collection(collection_name, documents)
+        return documents
+
+    async def post_one_document(self, collection_name: str, document: dict):
+        ret_value = await self.db_serv.post_one_document(collection_name, document)
+        self.cache.invalidate(collection_name)
+        return ret_value
+
+    async def replace_one_document(
+        self, collection_name: str, doc_id: str, replace_item: dict, etag: str = None
+    ):
+        try:
+            return await self.db_serv.replace_one_document(
+                collection_name, doc_id, replace_item, etag
+            )
+        finally:
+            self.cache.invalidate(collection_name, doc_id)
+
+    async def upsert_one_document(self, collection_name: str, document: dict):
+        try:
+            return await self.db_serv.upsert_one_document(collection_name, document)
+        finally:
+            self.cache.invalidate(collection_name, document["id"])
+
+    async def patch_one_document(
+        self, collection_name: str, document_id: str, updates: list[dict]
+    ):
+        try:
+            return await self.db_serv.patch_one_document(
+                collection_name=collection_name,
+                document_id=document_id,
+                updates=updates,
+            )
+        finally:
+            self.cache.invalidate(collection_name, document_id)
+
+    async def delete_one_document_by_id(self, collection_name: str, document_id: str):
+        try:
+            return await self.db_serv.delete_one_document_by_id(
+                collection_name, document_id
+            )
+        finally:
+            self.cache.invalidate(collection_name, document_id)
+
+    def get_cache_stats(self):
+        return self.cache.get_stats()
+
+
+def _get_cached_document_version(entry, etag):
+    if etag is not None and etag == entry["etag"]:
+        return None, entry["etag"], None
+    return entry["document"], entry["etag"], entry["last_modified"]
+
+
+def get_document_cache_settings():
+    """Reads the document cache settings from the environment variables
+    DOCUMENT_CACHE_MAX_ENTRIES and DOCUMENT_CACHE_TTL_SECONDS
+    """
+    return {
+        "max_entries": int(os.getenv("DOCUMENT_CACHE_MAX_ENTRIES", "256")),
+        "ttl_seconds": float(os.getenv("DOCUMENT_CACHE_TTL_SECONDS", "5")),
+    }
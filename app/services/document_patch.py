@@ -0,0 +1,74 @@
+import jsonpatch
+import jsonpointer
+
+# RFC 6902 operations (and the cosmos specific "set") that have an equivalent
+# cosmos partial document update operation
+COSMOS_PATCH_OPERATIONS = ["add", "replace", "remove", "set"]
+# The maximum number of operations cosmos accepts in one patch_item call
+MAX_COSMOS_PATCH_OPERATIONS = 10
+# The number of read-modify-replace attempts before a patch gives up because the
+# document keeps being modified concurrently
+MAX_PATCH_ATTEMPTS = 5
+
+
+def to_cosmos_patch_operations(updates: list[dict], partition_key_path: str):
+    """Translates RFC 6902 updates into cosmos patch_item operations.
+
+    Parameters
+    ----------
+    updates : list[dict]
+        The updates, as given to patch_one_document
+    partition_key_path : str
+        The partition key path of the container
+
+    Returns
+    -------
+    list or None
+        The operations for patch_item, or None if the updates cannot be done with
+        patch_item: operations cosmos does not have (move, copy, test), more than
+        MAX_COSMOS_PATCH_OPERATIONS operations, paths with escaped characters (~0,
+        ~1) or on the whole document, or updates of the id or the partition key
+        (or an object containing it).  These updates must be applied to the
+        whole document instead
+    """
+    if len(updates) == 0 or len(updates) > MAX_COSMOS_PATCH_OPERATIONS:
+        return None
+    protected_paths = {"/id", partition_key_path}
+    operations = []
+    for update in updates:
+        path = update.get("path", "")
+        if update.get("op") not in COSMOS_PATCH_OPERATIONS:
+            return None
+        if not path.startswith("/") or len(path) < 2 or "~" in path:
+            return None
+        if any(
+            path == c or path.startswith(c + "/") or c.startswith(path + "/")
+            for c in protected_paths
+        ):
+            return None
+        if update["op"] == "remove":
+            operations.append({"op": "remove", "path": path})
+        elif "value" not in update:
+            return None
+        else:
+            operations.append(
+                {"op": update["op"], "path": path, "value": update["value"]}
+            )
+    return operations
+
+
+def apply_patch(document: dict, updates: list[dict]):
+    """Applies RFC 6902 updates to the document, modifying it in place, and
+    returns it.  In addition to the RFC 6902 operations, "set" is applied as in
+    cosmos: the value at the path is replaced if it exists, otherwise it is added
+    """
+    for update in updates:
+        if update.get("op") == "set":
+            exists = True
+            try:
+                jsonpointer.resolve_pointer(document, update["path"])
+            except jsonpointer.JsonPointerException:
+                exists = False
+            update = {**update, "op": "replace" if exists else "add"}
+        document = jsonpatch.apply_patch(document, [update], in_place=True)
+    return document
@@ -0,0 +1,134 @@
+from abc import ABC, abstractmethod
+
+
+class document_store(ABC):
+    """Method contract of the synchronous database services: database_service
+    (azure cosmos) and the local_database_service backends.  The routes use any
+    document_store through as_async_database_service.
+
+    The methods are documented on database_service.  A backend that misses one of
+    the abstract methods cannot be instantiated
+    """
+
+    def open(self):
+        """Connects to the database.  Does nothing by default"""
+
+    def close(self):
+        """Releases the connection to the database.  Does nothing by default"""
+
+    def build_container_registry(self):
+        """Reads the metadata of all collections up front.  Does nothing by
+        default
+        """
+
+    @abstractmethod
+    def create_collection_if_not_exists(
+        self, collection_name: str, partition_key_path: str
+    ):
+        pass
+
+    @abstractmethod
+    def get_one_document_by_id(self, collection_name: str, document_id: str):
+        pass
+
+    def get_one_document_with_etag(
+        self, collection_name: str, document_id: str, etag: str = None
+    ):
+        """Gets one document together with its etag.  See
+        get_one_document_with_version
+
+        Returns
+        -------
+        tuple
+            A tuple (document, etag), as returned by get_one_document_with_version
+            without the modification time
+        """
+        document, etag, _ = self.get_one_document_with_version(
+            collection_name, document_id, etag
+        )
+        return document, etag
+
+    @abstractmethod
+    def get_one_document_with_version(
+        self, collection_name: str, document_id: str, etag: str = None
+    ):
+        pass
+
+    @abstractmethod
+    def get_many_documents_by_id(
+        self, collection_name: str, document_ids: list, selected_keys: list = None
+    ):
+        pass
+
+    @abstractmethod
+    def iter_many_documents_by_id(
+        self,
+        collection_name: str,
+        document_ids: list,
+        selected_keys: list = None,
+        chunk_size: int = 100,
+    ):
+        pass
+
+    @abstractmethod
+    def delete_one_document_by_id(self, collection_name: str, document_id: str):
+        pass
+
+    @abstractmethod
+    def get_all_documents_short(
+        self, collection_name: str, selected_keys: list = None, filters: list = None
+    ):
+        pass
+
+    @abstractmethod
+    def get_documents_page(
+        self,
+        collection_name: str,
+        page_size: int,
+        continuation: str = None,
+        selected_keys: list = None,
+        filters: list = None,
+    ):
+        pass
+
+    @abstractmethod
+    def iter_document_pages(
+        self,
+        collection_name: str,
+        page_size: int = None,
+        selected_keys: list = None,
+        filters: list = None,
+    ):
+        pass
+
+    @abstractmethod
+    def get_all_documents(self, collection_name: str):
+        pass
+
+    @abstractmethod
+    def replace_one_document(
+        self, collection_name: str, doc_id: str, replace_item: dict, etag: str = None
+    ):
+        pass
+
+    @abstractmethod
+    def post_one_document(self, collection_name: str, document: dict):
+        pass
+
+    @abstractmethod
+    def upsert_one_document(self, collection_name: str, document: dict):
+        pass
+
+    @abstractmethod
+    def patch_one_document(
+        self, collection_name: str, document_id: str, updates: list[dict]
+    ):
+        pass
+
+    @abstractmethod
+    def get_analysis_id_by_vesselid(self, vessel_id):
+        pass
+
+    @abstractmethod
+    def read_change_feed(self, collection_name: str, continuation: str = None):
+        pass
@@ -0,0 +1,268 @@
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from datetime import timezone
+from email.utils import formatdate, parsedate_to_datetime
+import orjson
+from starlette.responses import JSONResponse, Response
+from .request_metrics import record_phase
+
+# Dict keys that are not strings (e.g. int) are converted to strings as by the
+# json module, and numpy arrays and scalars are serialized as lists and numbers
+ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+
+def dumps(content) -> bytes:
+    """Serializes content to compact utf-8 json with orjson.  NaN and infinite
+    floats are written as null
+    """
+    return orjson.dumps(content, option=ORJSON_OPTIONS)
+
+
+def get_content_etag(body: bytes) -> str:
+    """Returns a strong etag derived from the content of a response body, for
+    responses that are not one database document (e.g. lists), so that equal
+    bodies have equal etags in every worker
+    """
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def parse_if_none_match(if_none_match: str = None):
+    """Returns the entity tags in an If-None-Match header, without the weak
+    prefix W/ (If-None-Match uses the weak comparison)
+    """
+    if if_none_match is None:
+        return []
+    tags = []
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if len(tag) > 0:
+            tags.append(tag)
+    return tags
+
+
+def etag_matches(if_none_match: str, etag: str):
+    """Returns True if the If-None-Match header matches the etag, so that the
+    response is 304 Not Modified
+    """
+    if etag is None:
+        return False
+    tags = parse_if_none_match(if_none_match)
+    return "*" in tags or etag in tags
+
+
+def format_http_date(timestamp) -> str:
+    """Formats seconds since the epoch (e.g. the _ts of a document) as an HTTP
+    date, as used in Last-Modified
+    """
+    return formatdate(timestamp, usegmt=True)
+
+
+def parse_http_date(value: str = None):
+    """Returns the seconds since the epoch of an HTTP date (e.g. an
+    If-Modified-Since header), or None if it is missing or invalid
+    """
+    if value is None:
+        return None
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return date.timestamp()
+
+
+def is_not_modified(
+    etag: str,
+    if_none_match: str = None,
+    last_modified: int = None,
+    if_modified_since: str = None,
+):
+    """Returns True if the response is 304 Not Modified.  If-Modified-Since is
+    only evaluated if there is no If-None-Match header, as in RFC 9110
+    """
+    if if_none_match is not None:
+        return etag_matches(if_none_match, etag)
+    since = parse_http_date(if_modified_since)
+    return since is not None and last_modified is not None and last_modified <= since
+
+
+def _get_validator_headers(etag: str, last_modified: int = None):
+    headers = {}
+    if etag is not None:
+        headers["ETag"] = etag
+    if last_modified is not None:
+        headers["Last-Modified"] = format_http_date(last_modified)
+    return headers
+
+
+def get_not_modified_response(etag: str, last_modified: int = None):
+    return Response(
+        status_code=304, headers=_get_validator_headers(etag, last_modified)
+    )
+
+
+def get_conditional_response(
+    body: bytes,
+    etag: str,
+    if_none_match: str = None,
+    last_modified: int = None,
+    if_modified_since: str = None,
+):
+    """Returns 304 Not Modified if the If-None-Match header matches the etag (or,
+    without If-None-Match, if the body is not modified since If-Modified-Since),
+    otherwise a json response with the body, the etag and the modification time
+    """
+    if is_not_modified(etag, if_none_match, last_modified, if_modified_since):
+        return get_not_modified_response(etag, last_modified)
+    return Response(
+        content=body,
+        media_type="application/json",
+        headers=_get_validator_headers(etag, last_modified),
+    )
+
+
+def get_json_response(
+    content,
+    if_none_match: str = None,
+    modification_times=None,
+    if_modified_since: str = None,
+):
+    """Serializes json-safe content (e.g. a list of documents) and returns it as
+    a conditional response with an etag derived from the body.  If a
+    content_modification_times is given, the response also has a Last-Modified
+    header and If-Modified-Since is evaluated
+    """
+    with record_phase("serialization"):
+        body = dumps(content)
+        etag = get_content_etag(body)
+    last_modified = None
+    if modification_times is not None:
+        last_modified = modification_times.get(etag)
+    return get_conditional_response(
+        body, etag, if_none_match, last_modified, if_modified_since
+    )
+
+
+class content_modification_times(object):
+    """Modification times of responses that are not one database document (e.g.
+    lists), for their Last-Modified header.
+
+    The _ts of the newest document in a list does not change when a document is
+    deleted, so the modification time of a list is instead the time its content
+    etag was first served by this process.  One time is kept per etag, for the
+    max_entries most recently served etags.  A change within the second the
+    previous version was served is not visible to If-Modified-Since, as for the
+    _ts of single documents
+
+    Parameters
+    ----------
+    max_entries : int, optional
+        The maximum number of etags kept
+    """
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self.times = OrderedDict()
+
+    def get(self, etag: str) -> int:
+        """Returns the modification time of the content with the etag, in
+        seconds since the epoch
+        """
+        if etag in self.times:
+            self.times.move_to_end(etag)
+            return self.times[etag]
+        self.times[etag] = int(time.time())
+        while len(self.times) > self.max_entries:
+            self.times.popitem(last=False)
+        return self.times[etag]
+
+
+class orjson_response(JSONResponse):
+    """JSONResponse rendering the body with orjson, and recording the time spent
+    rendering it in the "serialization" phase of the current request.
+
+    Used as the default response class of the app.  Routes returning documents
+    read from the database, which are already json-safe, return an
+    orjson_response directly, so that FastAPI does not run the content through
+    jsonable_encoder first
+    """
+
+    def render(self, content):
+        with record_phase("serialization"):
+            return dumps(content)
+
+
+class serialized_document_cache(object):
+    """LRU cache of the serialized json of documents, so that an unchanged
+    document is serialized once instead of on every request.
+
+    One version of each document is kept, identified by its etag; a new etag
+    replaces the bytes of the old version.  When the document itself comes from
+    the document_cache (revalidated with a conditional read, which does not
+    transfer the document if it is unchanged), a request for an unchanged
+    document neither decodes nor encodes it.
+
+    Parameters
+    ----------
+    max_bytes : int, optional
+        The maximum total size of the cached bytes.  Defaults to the environment
+        variable SERIALIZED_DOCUMENT_CACHE_MAX_BYTES, or 32 MB
+    """
+
+    def __init__(self, max_bytes: int = None):
+        if max_bytes is None:
+            max_bytes = int(
+                os.getenv("SERIALIZED_DOCUMENT_CACHE_MAX_BYTES", str(32 * 1024 * 1024))
+            )
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+
+    def get(self, collection_name: str, document_id: str, document, etag: str):
+        """Returns the serialized document, serializing it if the version with the
+        etag is not cached.  Documents without an etag are not cached
+        """
+        if etag is None:
+            return dumps(document)
+        key = (collection_name, document_id)
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] == etag:
+            self.entries.move_to_end(key)
+            return entry[1]
+        body = dumps(document)
+        if entry is not None:
+            self.total_bytes -= len(entry[1])
+            del self.entries[key]
+        if len(body) <= self.max_bytes:
+            self.entries[key] = (etag, body)
+            self.total_bytes += len(body)
+            while self.total_bytes > self.max_bytes:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.total_bytes -= len(evicted)
+        return body
+
+    def get_response(
+        self,
+        collection_name: str,
+        document_id: str,
+        document,
+        etag: str,
+        if_none_match: str = None,
+        last_modified: int = None,
+        if_modified_since: str = None,
+    ):
+        """Returns a response with the serialized document as body and the etag
+        and modification time (the _ts) of the document, or 304 Not Modified if
+        the If-None-Match header matches the etag or, without If-None-Match, the
+        document is not modified since If-Modified-Since
+        """
+        if is_not_modified(etag, if_none_match, last_modified, if_modified_since):
+            return get_not_modified_response(etag, last_modified)
+        with record_phase("serialization"):
+            body = self.get(collection_name, document_id, document, etag)
+        return get_conditional_response(body, etag, last_modified=last_modified)
@@ -0,0 +1,456 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from abc import abstractmethod
+from collections import OrderedDict
+from azure.cosmos.exceptions import (
+    CosmosAccessConditionFailedError,
+    CosmosResourceNotFoundError,
+)
+from .database_service import _remove_internal_dict_keys
+from .query_builder import (
+    OPERATORS,
+    document_matches,
+    project_document,
+    validate_field_path,
+)
+from .document_patch import MAX_PATCH_ATTEMPTS, apply_patch
+from .document_store import document_store
+
+
+class local_database_service(document_store):
+    """Base class of the database services that store documents locally instead
+    of in azure cosmos.  Implements the document_store contract with the same
+    semantics as database_service (point reads, etags, projections, filters,
+    paging and patches), so it can be used wherever database_service is used,
+    e.g. for offline development, tests and benchmarks.
+
+    Subclasses store the documents by implementing the abstract primitives
+    _read_document, _write_document, _write_document_if, _delete_document and
+    _query_documents; a subclass missing one of them cannot be instantiated.
+    Stored documents carry the internal keys "_etag" (new for every write) and
+    "_ts", as in cosmos.
+    """
+
+    def create_collection_if_not_exists(
+        self, collection_name: str, partition_key_path: str
+    ):
+        """Collections are created on first write; see
+        database_service.create_collection_if_not_exists
+        """
+
+    @abstractmethod
+    def _read_document(self, collection_name: str, document_id: str):
+        """Returns the stored document, or None if it does not exist"""
+
+    @abstractmethod
+    def _write_document(self, collection_name: str, document: dict):
+        """Inserts or replaces the document with the id document["id"]"""
+
+    @abstractmethod
+    def _write_document_if(
+        self, collection_name: str, document: dict, expected_etag: str = None
+    ):
+        """Replaces the stored document with the id document["id"] if it exists
+        and, if expected_etag is given, still has that etag.  The comparison and
+        the write are atomic.  Returns the etag of the stored document before the
+        write, or None if it does not exist
+        """
+
+    @abstractmethod
+    def _delete_document(self, collection_name: str, document_id: str):
+        """Deletes the document and returns True, or False if it does not exist"""
+
+    @abstractmethod
+    def _query_documents(
+        self, collection_name: str, filters: list = None, offset: int = 0, limit=None
+    ):
+        """Returns the stored documents fulfilling the filters, in insertion
+        order, skipping the first offset documents and returning at most limit
+        """
+
+    def _store(self, collection_name: str, document: dict):
+        stored = _get_stored_document(document)
+        self._write_document(collection_name, stored)
+        return _remove_internal_dict_keys(stored)
+
+    def upsert_documents(self, collection_name: str, documents: list):
+        """Inserts or replaces the given documents, keeping their ids.  Used to
+        load test data
+        """
+        for document in documents:
+            self._store(collection_name, document)
+
+    def get_one_document_by_id(self, collection_name: str, document_id: str):
+        """Gets one document.  See database_service.get_one_document_by_id"""
+        document = self._read_document(collection_name, document_id)
+        if document is None:
+            return []
+        return _remove_internal_dict_keys(document)
+
+    def get_one_document_with_version(
+        self, collection_name: str, document_id: str, etag: str = None
+    ):
+        """Gets one document together with its etag and modification time.  See
+        database_service.get_one_document_with_version
+        """
+        document = self._read_document(collection_name, document_id)
+        if document is None:
+            return [], None, None
+        if etag is not None and document["_etag"] == etag:
+            return None, etag, None
+        return _remove_internal_dict_keys(document), document["_etag"], document["_ts"]
+
+    def get_many_documents_by_id(
+        self, collection_name: str, document_ids: list, selected_keys: list = None
+    ):
+        """Gets several documents.  See database_service.get_many_documents_by_id"""
+        if selected_keys is not None:
+            selected_keys = ["id"] + [c for c in selected_keys if c != "id"]
+        documents = []
+        for document_id in document_ids:
+            document = self._read_document(collection_name, document_id)
+            if document is not None:
+                document = project_document(
+                    _remove_internal_dict_keys(document), selected_keys
+                )
+            documents.append(document)
+        return documents
+
+    def iter_many_documents_by_id(
+        self,
+        collection_name: str,
+        document_ids: list,
+        selected_keys: list = None,
+        chunk_size: int = 100,
+    ):
+        """See database_service.iter_many_documents_by_id"""
+        for start in range(0, len(document_ids), chunk_size):
+            yield self.get_many_documents_by_id(
+                collection_name, document_ids[start : start + chunk_size], selected_keys
+            )
+
+    def delete_one_document_by_id(self, collection_name: str, document_id: str):
+        """Deletes one document.  Raises CosmosResourceNotFoundError if it does not
+        exist
+        """
+        if not self._delete_document(collection_name, document_id):
+            raise CosmosResourceNotFoundError()
+
+    def get_all_documents_short(
+        self, collection_name: str, selected_keys: list = None, filters: list = None
+    ):
+        """See database_service.get_all_documents_short"""
+        return [
+            project_document(_remove_internal_dict_keys(c), selected_keys)
+            for c in self._query_documents(collection_name, filters)
+        ]
+
+    def get_documents_page(
+        self,
+        collection_name: str,
+        page_size: int,
+        continuation: str = None,
+        selected_keys: list = None,
+        filters: list = None,
+    ):
+        """See database_service.get_documents_page.  The continuation token is the
+        position of the first document of the next page
+        """
+        offset = 0 if continuation is None else int(continuation)
+        documents = self._query_documents(collection_name, filters, offset, page_size + 1)
+        next_continuation = None
+        if len(documents) > page_size:
+            documents = documents[:page_size]
+            next_continuation = str(offset + page_size)
+        return (
+            [
+                project_document(_remove_internal_dict_keys(c), selected_keys)
+                for c in documents
+            ],
+            next_continuation,
+        )
+
+    def iter_document_pages(
+        self,
+        collection_name: str,
+        page_size: int = None,
+        selected_keys: list = None,
+        filters: list = None,
+    ):
+        """See database_service.iter_document_pages"""
+        if page_size is None:
+            page_size = 100
+        continuation = "0"
+        while continuation is not None:
+            documents, continuation = self.get_documents_page(
+                collection_name, page_size, continuation, selected_keys, filters
+            )
+            if len(documents) > 0:
+                yield documents
+
+    def get_all_documents(self, collection_name: str):
+        """See database_service.get_all_documents"""
+        return self.get_all_documents_short(collection_name)
+
+    def replace_one_document(
+        self, collection_name: str, doc_id: str, replace_item: dict, etag: str = None
+    ):
+        """Replaces one document.  Raises CosmosResourceNotFoundError if it does
+        not exist, and CosmosAccessConditionFailedError if etag is given and the
+        document has changed since
+        """
+        stored = _get_stored_document({**replace_item, "id": doc_id})
+        current_etag = self._write_document_if(collection_name, stored, etag)
+        if current_etag is None:
+            raise CosmosResourceNotFoundError()
+        if etag is not None and current_etag != etag:
+            raise CosmosAccessConditionFailedError()
+        return _remove_internal_dict_keys(stored)
+
+    def post_one_document(self, collection_name: str, document: dict):
+        """See database_service.post_one_document"""
+        document["id"] = str(uuid.uuid4())
+        return self._store(collection_name, document)
+
+    def upsert_one_document(self, collection_name: str, document: dict):
+        """See database_service.upsert_one_document"""
+        return self._store(collection_name, document)
+
+    def patch_one_document(
+        self, collection_name: str, document_id: str, updates: list[dict]
+    ):
+        """See database_service.patch_one_document.  The updates are always
+        applied to the whole document, with the etag guarded replace
+        """
+        for attempt in range(MAX_PATCH_ATTEMPTS):
+            document, etag = self.get_one_document_with_etag(collection_name, document_id)
+            if not document:
+                raise CosmosResourceNotFoundError()
+            document = apply_patch(document, updates)
+            try:
+                return self.replace_one_document(
+                    collection_name, document_id, document, etag
+                )
+            except CosmosAccessConditionFailedError:
+                if attempt == MAX_PATCH_ATTEMPTS - 1:
+                    raise
+
+    def read_change_feed(self, collection_name: str, continuation: str = None):
+        """See database_service.read_change_feed.  The continuation token is the
+        "_lsn" (a nanosecond timestamp, increasing with every write) of the last
+        change read
+        """
+        if continuation is None:
+            return [], str(_get_next_lsn())
+        documents = sorted(
+            (
+                c
+                for c in self._query_documents(collection_name)
+                if c.get("_lsn", 0) > int(continuation)
+            ),
+            key=lambda c: c["_lsn"],
+        )
+        if len(documents) > 0:
+            continuation = str(documents[-1]["_lsn"])
+        return [{"id": c["id"], "_ts": c["_ts"]} for c in documents], continuation
+
+    def get_analysis_id_by_vesselid(self, vessel_id):
+        """See database_service.get_analysis_id_by_vesselid"""
+        return self.get_all_documents_short(
+            "analyses",
+            ["id", "metadata.vessel_id"],
+            [("metadata.vessel_id", "=", vessel_id)],
+        )
+
+
+class memory_database_service(local_database_service):
+    """local_database_service keeping the documents as json strings in dicts in
+    memory.  Documents are serialized on every write and parsed on every read,
+    as with a real database, so callers never share objects with the store
+    """
+
+    def __init__(self):
+        self.collections = {}
+        self.lock = threading.Lock()
+
+    def _read_document(self, collection_name: str, document_id: str):
+        with self.lock:
+            document = self.collections.get(collection_name, {}).get(document_id)
+        return None if document is None else json.loads(document)
+
+    def _write_document(self, collection_name: str, document: dict):
+        serialized = json.dumps(document)
+        with self.lock:
+            collection = self.collections.setdefault(collection_name, OrderedDict())
+            collection[document["id"]] = serialized
+
+    def _write_document_if(
+        self, collection_name: str, document: dict, expected_etag: str = None
+    ):
+        serialized = json.dumps(document)
+        with self.lock:
+            collection = self.collections.get(collection_name, {})
+            current = collection.get(document["id"])
+            if current is None:
+                return None
+            current_etag = json.loads(current)["_etag"]
+            if expected_etag is None or current_etag == expected_etag:
+                collection[document["id"]] = serialized
+            return current_etag
+
+    def _delete_document(self, collection_name: str, document_id: str):
+        with self.lock:
+            return self.collections.get(collection_name, {}).pop(document_id, None) is not None
+
+    def _query_documents(
+        self, collection_name: str, filters: list = None, offset: int = 0, limit=None
+    ):
+        with self.lock:
+            serialized = list(self.collections.get(collection_name, {}).values())
+        documents = [
+            c for c in map(json.loads, serialized) if document_matches(c, filters)
+        ]
+        end = None if limit is None else offset + limit
+        return documents[offset:end]
+
+
+class sqlite_database_service(local_database_service):
+    """local_database_service storing the documents as json in a SQLite database.
+    Filters are evaluated by SQLite with the JSON1 functions
+
+    Parameters
+    ----------
+    path : str, optional
+        The database file.  Defaults to the environment variable
+        ANALYSES_STORE_SQLITE_PATH, or ":memory:"
+    """
+
+    def __init__(self, path: str = None):
+        if path is None:
+            path = os.getenv("ANALYSES_STORE_SQLITE_PATH", ":memory:")
+        self.path = path
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS documents ("
+                "seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "collection TEXT NOT NULL, "
+                "id TEXT NOT NULL, "
+                "body TEXT NOT NULL, "
+                "UNIQUE (collection, id))"
+            )
+
+    def _read_document(self, collection_name: str, document_id: str):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT body FROM documents WHERE collection = ? AND id = ?",
+                (collection_name, document_id),
+            ).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def _write_document(self, collection_name: str, document: dict):
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT INTO documents (collection, id, body) VALUES (?, ?, ?) "
+                "ON CONFLICT (collection, id) DO UPDATE SET body = excluded.body",
+                (collection_name, document["id"], json.dumps(document)),
+            )
+
+    def _write_document_if(
+        self, collection_name: str, document: dict, expected_etag: str = None
+    ):
+        key = (collection_name, document["id"])
+        with self.lock, self.connection:
+            if expected_etag is not None:
+                cursor = self.connection.execute(
+                    "UPDATE documents SET body = ? WHERE collection = ? AND id = ? "
+                    "AND json_extract(body, '$._etag') = ?",
+                    (json.dumps(document), *key, expected_etag),
+                )
+                if cursor.rowcount > 0:
+                    return expected_etag
+            row = self.connection.execute(
+                "SELECT json_extract(body, '$._etag') FROM documents "
+                "WHERE collection = ? AND id = ?",
+                key,
+            ).fetchone()
+            if row is not None and expected_etag is None:
+                self.connection.execute(
+                    "UPDATE documents SET body = ? WHERE collection = ? AND id = ?",
+                    (json.dumps(document), *key),
+                )
+        return None if row is None else row[0]
+
+    def _delete_document(self, collection_name: str, document_id: str):
+        with self.lock, self.connection:
+            cursor = self.connection.execute(
+                "DELETE FROM documents WHERE collection = ? AND id = ?",
+                (collection_name, document_id),
+            )
+        return cursor.rowcount > 0
+
+    def _query_documents(
+        self, collection_name: str, filters: list = None, offset: int = 0, limit=None
+    ):
+        where, parameters = _get_sqlite_where_clause(filters)
+        query = (
+            "SELECT body FROM documents WHERE collection = ?"
+            + where
+            + " ORDER BY seq LIMIT ? OFFSET ?"
+        )
+        parameters = [collection_name] + parameters
+        parameters += [-1 if limit is None else limit, offset]
+        with self.lock:
+            rows = self.connection.execute(query, parameters).fetchall()
+        return [json.loads(c[0]) for c in rows]
+
+    def close(self):
+        self.connection.close()
+
+
+def _get_sqlite_where_clause(filters):
+    conditions = []
+    parameters = []
+    for field_path, operator, value in filters or []:
+        json_path = "$." + validate_field_path(field_path)
+        if operator not in OPERATORS:
+            raise ValueError(f"invalid operator: {operator!r}")
+        if operator == "in":
+            conditions.append(
+                "json_extract(body, ?) IN (SELECT value FROM json_each(?))"
+            )
+            parameters += [json_path, json.dumps(value)]
+        else:
+            conditions.append(f"json_extract(body, ?) {operator} ?")
+            parameters += [json_path, value]
+    where = "".join(f" AND {c}" for c in conditions)
+    return where, parameters
+
+
+def _get_stored_document(document: dict):
+    """Returns the document with the internal keys of a new write"""
+    return {
+        **document,
+        "_etag": f'"{uuid.uuid4()}"',
+        "_ts": int(time.time()),
+        "_lsn": _get_next_lsn(),
+    }
+
+
+_lsn_lock = threading.Lock()
+_last_lsn = 0
+
+
+def _get_next_lsn():
+    """Returns the current time in nanoseconds, but always more than the value
+    returned by the previous call
+    """
+    global _last_lsn
+    with _lsn_lock:
+        _last_lsn = max(time.time_ns(), _last_lsn + 1)
+        return _last_lsn
@@ -0,0 +1,146 @@
+import re
+
+FIELD_PATH_PATTERN = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*(\.[A-Za-z_][A-Za-z0-9_]*)*$")
+OPERATORS = ["=", "!=", "<", "<=", ">", ">=", "in"]
+
+
+def validate_field_path(field_path: str):
+    """Returns the field path (e.g. "metadata.well.name") if it is a valid dotted
+    path of property names, otherwise raises ValueError.  Only validated paths
+    are ever written into a query string; all values are passed as parameters
+    """
+    if not isinstance(field_path, str) or FIELD_PATH_PATTERN.match(field_path) is None:
+        raise ValueError(f"invalid field path: {field_path!r}")
+    return field_path
+
+
+def build_query(selected_keys: list = None, filters: list = None):
+    """Builds a parameterized cosmos sql query selecting documents from a container
+
+    Parameters
+    ----------
+    selected_keys : list, optional
+        Dotted paths of the keys to return, e.g. ["id", "metadata.well.name"].
+        Nested keys are returned in their nested position
+        ({"id": ..., "metadata": {"well": {"name": ...}}}).  All keys are returned
+        if not given
+    filters : list, optional
+        Conditions (field_path, operator, value) that all must hold for a document
+        to be selected, e.g. [("metadata.water_depth", ">=", 100)].  The operator
+        is one of OPERATORS.  "in" selects documents where the field is one of
+        the values in the list value
+
+    Returns
+    -------
+    tuple
+        A tuple (query, parameters) to be passed to query_items
+    """
+    query = f"SELECT {_get_projection(selected_keys)} FROM d"
+    parameters = []
+    conditions = []
+    for field_path, operator, value in filters or []:
+        validate_field_path(field_path)
+        if operator not in OPERATORS:
+            raise ValueError(f"invalid operator: {operator!r}")
+        name = f"@p{len(parameters)}"
+        parameters.append({"name": name, "value": value})
+        if operator == "in":
+            conditions.append(f"ARRAY_CONTAINS({name}, d.{field_path})")
+        else:
+            conditions.append(f"d.{field_path} {operator} {name}")
+    if len(conditions) > 0:
+        query += " WHERE " + " AND ".join(conditions)
+    return query, parameters
+
+
+def _get_projection(selected_keys):
+    if selected_keys is None:
+        return "*"
+    tree = {}
+    for field_path in selected_keys:
+        keys = validate_field_path(field_path).split(".")
+        node = tree
+        for key in keys[:-1]:
+            node = node.setdefault(key, {})
+            if node is True:
+                break
+        else:
+            node[keys[-1]] = True
+    return "VALUE " + _get_object_literal(tree, "d")
+
+
+def _get_object_literal(tree, prefix):
+    return (
+        "{"
+        + ",".join(
+            f"{key}: {prefix}.{key}"
+            if node is True
+            else f"{key}: {_get_object_literal(node, f'{prefix}.{key}')}"
+            for key, node in tree.items()
+        )
+        + "}"
+    )
+
+
+def document_matches(document: dict, filters: list = None):
+    """Returns True if the document fulfills all (field_path, operator, value)
+    filters, evaluated as by build_query.  Conditions on missing fields and on
+    values of a different type are false
+    """
+    for field_path, operator, value in filters or []:
+        if operator not in OPERATORS:
+            raise ValueError(f"invalid operator: {operator!r}")
+        exists, field_value = _get_field(document, validate_field_path(field_path))
+        if not exists:
+            return False
+        if operator == "in":
+            if field_value not in value:
+                return False
+            continue
+        if operator in ["=", "!="]:
+            if (field_value == value) != (operator == "="):
+                return False
+            continue
+        try:
+            if not {
+                "<": field_value < value,
+                "<=": field_value <= value,
+                ">": field_value > value,
+                ">=": field_value >= value,
+            }[operator]:
+                return False
+        except TypeError:
+            return False
+    return True
+
+
+def project_document(document: dict, selected_keys: list = None):
+    """Returns the keys of the document at the dotted paths in selected_keys, in
+    their nested position, as SELECT VALUE {...} from build_query.  Missing keys
+    are left out
+    """
+    if selected_keys is None:
+        return document
+    projected = {}
+    for field_path in selected_keys:
+        exists, value = _get_field(document, validate_field_path(field_path))
+        if not exists:
+            continue
+        keys = field_path.split(".")
+        node = projected
+        for key in keys[:-1]:
+            node = node.setdefault(key, {})
+        node[keys[-1]] = value
+    return projected
+
+
+def _get_field(document, field_path):
+    """Returns (True, value) for the value at the dotted field path, or
+    (False, None) if the path does not exist in the document
+    """
+    value = document
+    for key in field_path.split("."):
+        if not isinstance(value, dict) or key not in value:
+            return False, None
+        value = value[key]
+    return True, value
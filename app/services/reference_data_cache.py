@@ -0,0 +1,133 @@
+import asyncio
+import os
+
+REFERENCE_COLLECTIONS = ["vessels", "soil", "analysis_input"]
+
+
+class reference_data_cache(object):
+    """In-memory copy of small, rarely changing lookup collections (vessels, soil,
+    analysis_input).
+
+    Each collection is read completely with get_all_documents and kept with a
+    version number that is incremented on every reload.  Lookup dicts derived
+    from a collection (e.g. vessel id -> vessel name) are memoized per version.
+    The collections are reloaded in the background every refresh_interval_seconds
+    and whenever invalidate() is called for the collection, so readers normally
+    never wait for the database.
+
+    Parameters
+    ----------
+    db_serv : async_database_service
+        The database service to read the collections from
+    collection_names : list, optional
+        The collections to keep in memory.  Defaults to REFERENCE_COLLECTIONS
+    refresh_interval_seconds : float, optional
+        Seconds between background reloads.  Defaults to the environment variable
+        REFERENCE_DATA_REFRESH_SECONDS, or 300
+    """
+
+    def __init__(
+        self, db_serv, collection_names=None, refresh_interval_seconds=None
+    ):
+        if collection_names is None:
+            collection_names = REFERENCE_COLLECTIONS
+        if refresh_interval_seconds is None:
+            refresh_interval_seconds = float(
+                os.getenv("REFERENCE_DATA_REFRESH_SECONDS", "300")
+            )
+        self.db_serv = db_serv
+        self.refresh_interval_seconds = refresh_interval_seconds
+        self.entries = {
+            c: {"version": 0, "documents": None, "stale": True, "lookups": {}}
+            for c in collection_names
+        }
+        self.locks = {c: asyncio.Lock() for c in collection_names}
+        self.refresh_task = None
+
+    def is_reference_collection(self, collection_name: str):
+        return collection_name in self.entries
+
+    async def refresh(self, collection_name: str):
+        """Reloads the collection from the database and increments its version"""
+        async with self.locks[collection_name]:
+            entry = self.entries[collection_name]
+            entry["stale"] = False
+            try:
+                documents = await self.db_serv.get_all_documents(collection_name)
+            except Exception:
+                entry["stale"] = True
+                raise
+            self.entries[collection_name] = {
+                "version": entry["version"] + 1,
+                "documents": documents,
+                "stale": entry["stale"],
+                "lookups": {},
+            }
+
+    async def get_documents(self, collection_name: str):
+        """Returns all documents in the collection.  The database is only read if
+        the collection has not been loaded yet or has been invalidated since the
+        last reload
+        """
+        entry = self.entries[collection_name]
+        if entry["documents"] is None or entry["stale"]:
+            await self.refresh(collection_name)
+        return self.entries[collection_name]["documents"]
+
+    async def get_version(self, collection_name: str):
+        await self.get_documents(collection_name)
+        return self.entries[collection_name]["version"]
+
+    async def get_lookup(self, collection_name: str, key_field: str, value_field: str):
+        """Returns a dict mapping key_field to value_field for all documents in the
+        collection, e.g. get_lookup("vessels", "id", "name").  The dict is built
+        once per version of the collection and must not be modified by the caller
+        """
+        documents = await self.get_documents(collection_name)
+        lookups = self.entries[collection_name]["lookups"]
+        if (key_field, value_field) not in lookups:
+            lookups[(key_field, value_field)] = {
+                c[key_field]: c[value_field] for c in documents
+            }
+        return lookups[(key_field, value_field)]
+
+    def invalidate(self, collection_name: str, document_id: str = None):
+        """Marks the collection as changed and schedules a background reload.  Can
+        be subscribed to a document_change_hub
+        """
+        if collection_name not in self.entries:
+            return
+        self.entries[collection_name]["stale"] = True
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        loop.create_task(self._refresh_quietly(collection_name))
+
+    async def _refresh_quietly(self, collection_name: str):
+        try:
+            await self.refresh(collection_name)
+        except Exception:
+            pass
+
+    async def _refresh_loop(self):
+        while True:
+            for collection_name in self.entries:
+                await self._refresh_quietly(collection_name)
+            await asyncio.sleep(self.refresh_interval_seconds)
+
+    def start(self):
+        """Starts reloading all collections in the background"""
+        if self.refresh_task is None:
+            self.refresh_task = asyncio.get_running_loop().create_task(
+                self._refresh_loop()
+            )
+
+    async def stop(self):
+        if self.refresh_task is not None:
+            self.refresh_task.cancel()
+            try:
+                await self.refresh_task
+            except asyncio.CancelledError:
+                pass
+            self.refresh_task = None
@@ -0,0 +1,263 @@
+import inspect
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from starlette.datastructures import MutableHeaders
+
+DURATION_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+current_request_stats = ContextVar("current_request_stats", default=None)
+
+
+class request_stats(object):
+    """Statistics of one HTTP request, collected while the request is served.
+
+    The stats of the request being served are available from the context
+    variable current_request_stats, which is also visible in the threadpool.
+
+    phase_seconds holds the time spent in each named phase (e.g. "database",
+    "cosmos", "serialization").  Concurrent work within one request is summed,
+    so the phases can add up to more than the total.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.total_seconds = None
+        self.cosmos_calls = 0
+        self.request_charge = 0.0
+        self.phase_seconds = {}
+
+    def add_phase(self, phase: str, seconds: float):
+        self.phase_seconds[phase] = self.phase_seconds.get(phase, 0.0) + seconds
+
+    def add_cosmos_call(self, request_charge: float, seconds: float):
+        self.cosmos_calls += 1
+        self.request_charge += request_charge
+        self.add_phase("cosmos", seconds)
+
+    def get_server_timing(self):
+        """Returns the value of the Server-Timing header for the request"""
+        elapsed = (time.perf_counter() - self.start) * 1000
+        entries = [f"total;dur={elapsed:.1f}"]
+        entries += [
+            f"{phase};dur={seconds * 1000:.1f}"
+            for phase, seconds in self.phase_seconds.items()
+        ]
+        if self.cosmos_calls > 0:
+            entries.append(
+                f'cosmos_ru;desc="{self.cosmos_calls} calls, '
+                f'{self.request_charge:.2f} RU"'
+            )
+        return ", ".join(entries)
+
+
+@contextmanager
+def record_phase(phase: str):
+    """Adds the time spent in the with block to the given phase of the current
+    request.  Does nothing outside of a request
+    """
+    stats = current_request_stats.get()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if stats is not None:
+            stats.add_phase(phase, time.perf_counter() - start)
+
+
+def record_cosmos_request(request):
+    """raw_request_hook for the cosmos client, see record_cosmos_response"""
+    request.context["metrics_start"] = time.perf_counter()
+
+
+def record_cosmos_response(response):
+    """raw_response_hook for the cosmos client.  Adds every HTTP call made to
+    cosmos, its duration and its request charge (x-ms-request-charge header) to
+    the stats of the current request
+    """
+    stats = current_request_stats.get()
+    if stats is None:
+        return
+    start = response.context.get("metrics_start")
+    seconds = 0.0 if start is None else time.perf_counter() - start
+    request_charge = response.http_response.headers.get("x-ms-request-charge")
+    stats.add_cosmos_call(float(request_charge or 0.0), seconds)
+
+
+class metrics_registry(object):
+    """Aggregates request_stats per method and route template, and renders
+    them in the Prometheus text exposition format
+    """
+
+    def __init__(self, prefix: str = "analyses_store"):
+        self.prefix = prefix
+        self.requests = {}
+        self.cosmos = {}
+        self.phases = {}
+        self.collectors = []
+
+    def add_collector(self, collector):
+        """Adds an object with a method render_metrics(prefix) returning further
+        metrics as lines in the Prometheus text format
+        """
+        self.collectors.append(collector)
+
+    def observe(self, method: str, route: str, status_code: int, stats: request_stats):
+        key = (method, route, str(status_code))
+        if key not in self.requests:
+            self.requests[key] = {
+                "count": 0,
+                "sum": 0.0,
+                "buckets": [0] * len(DURATION_BUCKETS),
+            }
+        entry = self.requests[key]
+        entry["count"] += 1
+        entry["sum"] += stats.total_seconds
+        for i, upper_bound in enumerate(DURATION_BUCKETS):
+            if stats.total_seconds <= upper_bound:
+                entry["buckets"][i] += 1
+        cosmos = self.cosmos.setdefault((method, route), {"calls": 0, "charge": 0.0})
+        cosmos["calls"] += stats.cosmos_calls
+        cosmos["charge"] += stats.request_charge
+        for phase, seconds in stats.phase_seconds.items():
+            phase_key = (method, route, phase)
+            self.phases[phase_key] = self.phases.get(phase_key, 0.0) + seconds
+
+    def render(self):
+        """Returns all metrics in the Prometheus text format"""
+        name = f"{self.prefix}_request_duration_seconds"
+        lines = [
+            f"# HELP {name} Time from receiving a request until the response is sent",
+            f"# TYPE {name} histogram",
+        ]
+        for (method, route, status), entry in self.requests.items():
+            labels = get_labels(method=method, route=route, status=status)
+            for upper_bound, count in zip(DURATION_BUCKETS, entry["buckets"]):
+                lines.append(f'{name}_bucket{{{labels},le="{upper_bound}"}} {count}')
+            lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {entry["count"]}')
+            lines.append(f"{name}_sum{{{labels}}} {entry['sum']}")
+            lines.append(f"{name}_count{{{labels}}} {entry['count']}")
+
+        for metric, field, help_text in [
+            ("cosmos_calls_total", "calls", "HTTP calls made to cosmos"),
+            ("cosmos_request_charge_total", "charge", "Request units charged by cosmos"),
+        ]:
+            name = f"{self.prefix}_{metric}"
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+            for (method, route), entry in self.cosmos.items():
+                labels = get_labels(method=method, route=route)
+                lines.append(f"{name}{{{labels}}} {entry[field]}")
+
+        name = f"{self.prefix}_phase_seconds_total"
+        lines += [
+            f"# HELP {name} Time spent in each phase of serving requests",
+            f"# TYPE {name} counter",
+        ]
+        for (method, route, phase), seconds in self.phases.items():
+            labels = get_labels(method=method, route=route, phase=phase)
+            lines.append(f"{name}{{{labels}}} {seconds}")
+        for collector in self.collectors:
+            lines += collector.render_metrics(self.prefix)
+        return "\n".join(lines) + "\n"
+
+
+def _escape_label_value(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def get_labels(**labels):
+    """Formats keyword arguments as the escaped labels of a prometheus sample,
+    e.g. get_labels(method="GET") gives 'method="GET"'
+    """
+    return ",".join(f'{k}="{_escape_label_value(v)}"' for k, v in labels.items())
+
+
+def _get_route_template(scope):
+    """Returns the path template of the matched route.  scope["route"] is the
+    route as declared in its own router, without the prefixes of the routers
+    it is included in, so the full template is taken from the route context
+    set by FastAPI when it is available
+    """
+    route_context = scope.get("fastapi", {}).get("effective_route_context")
+    if getattr(route_context, "path", None) is not None:
+        return route_context.path
+    route = scope.get("route")
+    if route is None or not hasattr(route, "path"):
+        return "unmatched"
+    return scope.get("root_path", "") + route.path
+
+
+class metrics_middleware(object):
+    """ASGI middleware collecting the request_stats of every HTTP request into
+    a metrics_registry, labelled with the route template (e.g.
+    "/api/analyses/{id}") rather than the path, so that ids do not create new
+    series.  If server_timing is True, the stats are also sent to the client
+    in a Server-Timing response header.
+    """
+
+    def __init__(self, app, registry: metrics_registry, server_timing: bool = False):
+        self.app = app
+        self.registry = registry
+        self.server_timing = server_timing
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        stats = request_stats()
+        token = current_request_stats.set(stats)
+        status = {"code": 500}
+
+        async def send_with_metrics(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                if self.server_timing:
+                    headers = MutableHeaders(scope=message)
+                    headers.append("Server-Timing", stats.get_server_timing())
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            stats.total_seconds = time.perf_counter() - stats.start
+            self.registry.observe(
+                scope["method"], _get_route_template(scope), status["code"], stats
+            )
+            current_request_stats.reset(token)
+
+
+class metered_database_service(object):
+    """Wraps an async database service (see as_async_database_service) and
+    records the time spent in every call in the "database" phase of the
+    current request
+    """
+
+    def __init__(self, db_serv):
+        self.db_serv = db_serv
+
+    def __getattr__(self, name):
+        attribute = getattr(self.db_serv, name)
+        if name.startswith("iter_"):
+
+            def metered_iterate(*args, **kwargs):
+                return _metered_iterator(attribute(*args, **kwargs))
+
+            return metered_iterate
+        if not inspect.iscoroutinefunction(attribute):
+            return attribute
+
+        async def metered_call(*args, **kwargs):
+            with record_phase("database"):
+                return await attribute(*args, **kwargs)
+
+        return metered_call
+
+
+async def _metered_iterator(iterator):
+    while True:
+        with record_phase("database"):
+            try:
+                item = await iterator.__anext__()
+            except StopAsyncIteration:
+                return
+        yield item
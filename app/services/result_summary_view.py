@@ -0,0 +1,285 @@
+import asyncio
+import os
+from .query_builder import document_matches
+
+# The keys of an analysis the summary rows are computed from
+SUMMARY_KEYS = ["id", "metadata", "general_results"]
+SUMMARY_TYPES = ["simple", "detailed", "full"]
+# The summary types with the vessel name, which must be recomputed when the
+# vessels change
+VESSEL_SUMMARY_TYPES = ["simple", "detailed"]
+
+
+class result_summary_view(object):
+    """Materialized view with the result summary row of every analysis, so that
+    GET /api/analyses/summary/result_summary is a read from memory instead of a
+    query and a recomputation of every row.
+
+    The view is built from the database on first use.  After that it is updated
+    incrementally: invalidate() (subscribed to the document_change_hub) records
+    the analyses that have been written, and only these are read again, before
+    the next read of the view or in the background.  The rows of a summary type
+    are computed the first time the type is read, and recomputed when the
+    vessels in the reference_data_cache change.  The view is rebuilt from
+    scratch every refresh_interval_seconds, to pick up writes done by other
+    instances of the app, and by rebuild().
+
+    Parameters
+    ----------
+    db_serv : async_database_service
+        The database service to read the analyses from
+    reference_cache : reference_data_cache
+        The cache to read the vessel names from
+    refresh_interval_seconds : float, optional
+        Seconds between background rebuilds.  Defaults to the environment
+        variable RESULT_SUMMARY_REFRESH_SECONDS, or 300
+    """
+
+    def __init__(self, db_serv, reference_cache, refresh_interval_seconds=None):
+        if refresh_interval_seconds is None:
+            refresh_interval_seconds = float(
+                os.getenv("RESULT_SUMMARY_REFRESH_SECONDS", "300")
+            )
+        self.db_serv = db_serv
+        self.reference_cache = reference_cache
+        self.refresh_interval_seconds = refresh_interval_seconds
+        self.documents = None
+        self.rows = {}
+        self.vessel_version = None
+        self.pending_ids = set()
+        self.rebuild_needed = True
+        self.lock = asyncio.Lock()
+        self.refresh_task = None
+
+    async def rebuild(self):
+        """Reads all analyses and recomputes the view.  Returns the number of
+        analyses in the view
+        """
+        async with self.lock:
+            await self._rebuild()
+            return len(self.documents)
+
+    async def _rebuild(self):
+        # writes published while the analyses are read are applied afterwards
+        self.rebuild_needed = False
+        self.pending_ids = set()
+        try:
+            documents = await self.db_serv.get_all_documents_short(
+                "analyses", SUMMARY_KEYS
+            )
+        except Exception:
+            self.rebuild_needed = True
+            raise
+        self.documents = {c["id"]: c for c in documents}
+        self.rows = {}
+
+    async def _apply_pending(self):
+        ids = list(self.pending_ids)
+        self.pending_ids = set()
+        try:
+            documents = await self.db_serv.get_many_documents_by_id(
+                "analyses", ids, SUMMARY_KEYS
+            )
+        except Exception:
+            self.pending_ids.update(ids)
+            raise
+        vessel_dict = await self._get_vessel_dict() if len(self.rows) > 0 else None
+        for id, document in zip(ids, documents):
+            if document is None:
+                self.documents.pop(id, None)
+                for rows in self.rows.values():
+                    rows.pop(id, None)
+                continue
+            self.documents[id] = document
+            for result_type, rows in list(self.rows.items()):
+                try:
+                    rows[id] = _get_summary_row(document, result_type, vessel_dict)
+                except Exception:
+                    # recomputed (and the error raised) when the type is read
+                    self.rows.pop(result_type)
+
+    async def _get_vessel_dict(self):
+        return await self.reference_cache.get_lookup("vessels", "id", "name")
+
+    async def update(self):
+        """Brings the view up to date with the writes published so far"""
+        async with self.lock:
+            if self.rebuild_needed or self.documents is None:
+                await self._rebuild()
+            if len(self.pending_ids) > 0:
+                await self._apply_pending()
+            vessel_version = await self.reference_cache.get_version("vessels")
+            if vessel_version != self.vessel_version:
+                for result_type in VESSEL_SUMMARY_TYPES:
+                    self.rows.pop(result_type, None)
+                self.vessel_version = vessel_version
+
+    async def get_rows(
+        self,
+        result_type: str,
+        filters: list = None,
+        offset: int = 0,
+        limit: int = None,
+    ):
+        """Returns the summary rows of the analyses fulfilling the filters, in
+        the order the analyses were added to the view
+
+        Parameters
+        ----------
+        result_type : str
+            One of SUMMARY_TYPES
+        filters : list, optional
+            Conditions (field_path, operator, value) on the analyses, as for
+            get_all_documents_short
+        offset : int, optional
+            The number of rows to skip
+        limit : int, optional
+            The maximum number of rows to return
+
+        Returns
+        -------
+        tuple
+            The rows, and the position after the last row returned, or None if
+            there are no more rows
+        """
+        await self.update()
+        async with self.lock:
+            if result_type not in self.rows:
+                vessel_dict = await self._get_vessel_dict()
+                self.rows[result_type] = {
+                    id: _get_summary_row(c, result_type, vessel_dict)
+                    for id, c in self.documents.items()
+                }
+            rows = self.rows[result_type]
+            ids = [
+                id
+                for id, c in self.documents.items()
+                if filters is None or document_matches(c, filters)
+            ]
+        end = len(ids) if limit is None else min(offset + limit, len(ids))
+        next_offset = end if end < len(ids) else None
+        return [rows[id] for id in ids[offset:end]], next_offset
+
+    async def iter_row_pages(
+        self, result_type: str, page_size: int = None, filters: list = None
+    ):
+        """Yields the rows of get_rows in pages of page_size, by default 100"""
+        if page_size is None:
+            page_size = 100
+        rows, _ = await self.get_rows(result_type, filters)
+        for start in range(0, len(rows), page_size):
+            yield rows[start : start + page_size]
+
+    def invalidate(self, collection_name: str, document_id: str = None):
+        """Records that an analysis has been written and schedules a background
+        update.  A write with an unknown id (document_id None) makes the next
+        update a rebuild.  Can be subscribed to a document_change_hub
+        """
+        if collection_name != "analyses":
+            return
+        if document_id is None:
+            self.rebuild_needed = True
+        else:
+            self.pending_ids.add(str(document_id))
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        loop.create_task(self._update_quietly())
+
+    async def _update_quietly(self):
+        try:
+            await self.update()
+        except Exception:
+            pass
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval_seconds)
+            self.rebuild_needed = True
+            await self._update_quietly()
+
+    def start(self):
+        """Starts rebuilding the view in the background"""
+        if self.refresh_task is None:
+            self.refresh_task = asyncio.get_running_loop().create_task(
+                self._refresh_loop()
+            )
+
+    async def stop(self):
+        if self.refresh_task is not None:
+            self.refresh_task.cancel()
+            try:
+                await self.refresh_task
+            except asyncio.CancelledError:
+                pass
+            self.refresh_task = None
+
+
+def _get_summary_row(d, result_type, vessel_dict):
+    if result_type == "simple":
+        if d["metadata"]["xt"]:
+            xt_string = "Yes"
+        else:
+            xt_string = "No"
+        if "m_eq_dominant_direction" in d["general_results"]:
+            m_eq = d["general_results"]["m_eq_dominant_direction"]
+        else:
+            m_eq = None
+        return {
+            "id": d["id"],
+            "analysis_type": d["metadata"]["analysis_type"],
+            "water_depth": d["metadata"]["water_depth"],
+            "vessel": vessel_dict[d["metadata"]["vessel_id"]],
+            "project_id": d["metadata"]["project_id"],
+            "well_name": d["metadata"]["well"]["name"],
+            "version": d["metadata"]["version"],
+            "wave_direction_relative_to_rig": float(
+                abs(d["metadata"]["wave_direction"] - d["metadata"]["vessel_heading"])
+            ),
+            "current": d["metadata"]["current"],
+            "xt": xt_string,
+            "overpull": d["metadata"]["overpull"],
+            "well_data": _get_well_summary(d["metadata"]["well"]),
+            "comment": d["metadata"]["comment"],
+            "client": d["metadata"]["client"],
+            "m_eq_dominant_direction": m_eq,
+        }
+    elif result_type == "detailed":
+        return {
+            "id": d["id"],
+            "analysis_type": d["metadata"]["analysis_type"],
+            "water_depth": d["metadata"]["water_depth"],
+            "vessel": vessel_dict[d["metadata"]["vessel_id"]],
+            "project_id": d["metadata"]["project_id"],
+            "well_name": d["metadata"]["well"]["name"],
+            "wave_direction": d["metadata"]["wave_direction"],
+            "vessel_heading": d["metadata"]["vessel_heading"],
+            "current": d["metadata"]["current"],
+            "xt": d["metadata"]["xt"],
+            "overpull": d["metadata"]["overpull"],
+            "drillpipe_tension": d["metadata"]["drillpipe_tension"],
+            "comment": d["metadata"]["comment"],
+            "offset_percent_of_wd": d["metadata"]["offset_percent_of_wd"],
+            "client": d["metadata"]["client"],
+            "well_boundary_type": d["metadata"]["well"]["well_boundary_type"],
+            **d["general_results"],
+        }
+    else:
+        return {"id": d["id"], **d["metadata"], **d["general_results"]}
+
+
+def _get_well_summary(well):
+    ret_str = f"name: {well['name']}\n"
+    ret_str += f"boundary-type: {well['well_boundary_type']}\n"
+    ret_str += f"well-design-type: {well['design_type']}\n"
+    ret_str += f"well-stiffness: {well['stiffness']}\n"
+    ret_str += f"support-feature: {well['feature']}\n"
+    ret_str += f"support-feature: {well['feature']}\n"
+    if type(well["soil"]) is dict:
+        ret_str += f"soil-type: {well['soil']['soil_type']}\n"
+        ret_str += f"soil-version: {well['soil']['soil_version']}\n"
+        ret_str += f"soil-sensitivity: {well['soil']['soil_sensitivity']}\n"
+    else:
+        ret_str += "soil-type: None\n"
+    return ret_str
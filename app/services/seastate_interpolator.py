@@ -0,0 +1,112 @@
+import numpy as np
+from scipy.interpolate import LinearNDInterpolator, RegularGridInterpolator
+from scipy.spatial import QhullError
+
+
+class seastate_interpolator(object):
+    """Linear interpolation of one summary value (e.g. the std of the bending
+    moment at wh_datum) over the Hs/Tp scatter of an analysis.
+
+    The interpolator is set up once and can then be evaluated for any number of
+    (hs, tp) points.  Seastates given more than once are averaged.  Depending on
+    the seastates, one of these is used:
+
+    - full Hs x Tp grid: scipy RegularGridInterpolator
+    - one Hs or one Tp: linear interpolation along the other axis
+    - scattered seastates: scipy LinearNDInterpolator (Delaunay triangulation)
+    - too few or collinear seastates: only the given seastates are returned
+
+    Points outside the scatter (outside the grid or the convex hull of the
+    seastates) get the value NaN.
+
+    Parameters
+    ----------
+    hs, tp, values : np.ndarray
+        Hs, Tp and summary value of each seastate
+    """
+
+    def __init__(self, hs, tp, values):
+        points, inverse = np.unique(
+            np.column_stack([hs, tp]).astype(float), axis=0, return_inverse=True
+        )
+        inverse = inverse.reshape(-1)
+        counts = np.bincount(inverse, minlength=len(points))
+        self.hs = points[:, 0]
+        self.tp = points[:, 1]
+        self.values = np.bincount(inverse, weights=values, minlength=len(points)) / counts
+        self._interpolate = self._get_interpolate_function()
+
+    @property
+    def num_points(self):
+        return len(self.values)
+
+    def _get_interpolate_function(self):
+        unique_hs = np.unique(self.hs)
+        unique_tp = np.unique(self.tp)
+        if len(unique_hs) == 1 or len(unique_tp) == 1:
+            return self._interpolate_along_line
+        if len(unique_hs) * len(unique_tp) == self.num_points:
+            grid = np.empty((len(unique_hs), len(unique_tp)))
+            grid[
+                np.searchsorted(unique_hs, self.hs), np.searchsorted(unique_tp, self.tp)
+            ] = self.values
+            interpolator = RegularGridInterpolator(
+                (unique_hs, unique_tp), grid, bounds_error=False, fill_value=np.nan
+            )
+            return lambda hs, tp: interpolator(np.column_stack([hs, tp]))
+        try:
+            interpolator = LinearNDInterpolator(
+                np.column_stack([self.hs, self.tp]), self.values, fill_value=np.nan
+            )
+        except (QhullError, ValueError):
+            return self._get_exact_values
+        return interpolator
+
+    def _interpolate_along_line(self, hs, tp):
+        if np.all(self.hs == self.hs[0]):
+            on_line, known, along = hs == self.hs[0], self.tp, tp
+        else:
+            on_line, known, along = tp == self.tp[0], self.hs, hs
+        result = np.full(len(hs), np.nan)
+        sort_index = np.argsort(known)
+        result[on_line] = np.interp(
+            along[on_line],
+            known[sort_index],
+            self.values[sort_index],
+            left=np.nan,
+            right=np.nan,
+        )
+        return result
+
+    def _get_exact_values(self, hs, tp):
+        lookup = dict(zip(zip(self.hs.tolist(), self.tp.tolist()), self.values.tolist()))
+        return np.array(
+            [lookup.get(c, np.nan) for c in zip(hs.tolist(), tp.tolist())], dtype=float
+        )
+
+    def __call__(self, hs, tp):
+        """Returns the interpolated values at the points (hs[i], tp[i])"""
+        hs = np.asarray(hs, dtype=float).reshape(-1)
+        tp = np.asarray(tp, dtype=float).reshape(-1)
+        if len(hs) == 0:
+            return np.array([])
+        return np.asarray(self._interpolate(hs, tp), dtype=float).reshape(-1)
+
+
+def from_seastate_matrices(matrices, location: str, result_type: str, method: str):
+    """Returns a seastate_interpolator for the values of the method in all
+    scatters with the given location and result_type, or None if there are none
+    """
+    all_hs, all_tp, all_values = [], [], []
+    for one_matrix in matrices:
+        if one_matrix.location != location or one_matrix.result_type != result_type:
+            continue
+        hs, tp, values = one_matrix.get_method_values(method)
+        all_hs.append(hs)
+        all_tp.append(tp)
+        all_values.append(values)
+    if sum(len(c) for c in all_values) == 0:
+        return None
+    return seastate_interpolator(
+        np.concatenate(all_hs), np.concatenate(all_tp), np.concatenate(all_values)
+    )
@@ -0,0 +1,371 @@
+import sys
+import numpy as np
+
+
+class seastate_matrix(object):
+    """Array backed form of one result_scatter (one location and result_type) of
+    an analysis_result document.
+
+    The seastates (points) of the scatter are stored along the first axis and the
+    summary value methods along the second axis:
+
+    hs, tp : np.ndarray, shape (n_points,)
+        Significant wave height and peak period of each seastate
+    methods : list
+        The summary value methods (e.g. "std", "max"), one per column
+    values : np.ndarray, shape (n_points, n_methods)
+        The summary values.  Undefined where a seastate has no value for a method
+    order : np.ndarray, shape (n_points, n_methods)
+        The position of each value in the summary_values list of its seastate, or
+        -1 where the seastate has no value for the method
+    time_series_id : list
+        The time series id of each seastate (None if not set)
+    has_time_series_id : np.ndarray, shape (n_points,)
+        False for seastates without a time_series_id key
+
+    integer_columns : dict
+        For each of "hs", "tp" and "value", True if all the values in the json
+        form were integers.  Such columns are converted back to integers
+
+    The meta values and methods are interned, so that the matrices of all cached
+    analyses share one str object per distinct location, result_type, unit and
+    method.
+
+    Seastates with the same method more than once in summary_values cannot be
+    stored in the matrix.  Their summary_values are kept as given in
+    irregular_summary_values (point index -> list) and their matrix rows are empty.
+
+    from_result_scatter and to_result_scatter convert losslessly from and to the
+    json form: scatters, seastates and summary values come back in the same order
+    and compare equal to the original.
+    """
+
+    def __init__(
+        self,
+        meta,
+        hs,
+        tp,
+        methods,
+        values,
+        order,
+        time_series_id,
+        has_time_series_id,
+        irregular_summary_values=None,
+        integer_columns=None,
+    ):
+        self.meta = meta
+        self.hs = hs
+        self.tp = tp
+        self.methods = methods
+        self.method_index = {c: i for i, c in enumerate(methods)}
+        self.values = values
+        self.order = order
+        self.time_series_id = time_series_id
+        self.has_time_series_id = has_time_series_id
+        if irregular_summary_values is None:
+            irregular_summary_values = {}
+        self.irregular_summary_values = irregular_summary_values
+        if integer_columns is None:
+            integer_columns = {"hs": False, "tp": False, "value": False}
+        self.integer_columns = integer_columns
+
+    @property
+    def location(self):
+        return self.meta["location"]
+
+    @property
+    def result_type(self):
+        return self.meta["result_type"]
+
+    @property
+    def num_points(self):
+        return len(self.hs)
+
+    @classmethod
+    def from_result_scatter(cls, result_scatter):
+        """Creates a seastate_matrix from one item of all_seastate_results"""
+        data = result_scatter["data"]
+        methods = []
+        method_index = {}
+        points = []
+        columns = []
+        positions = []
+        value_list = []
+        for point, one_seastate in enumerate(data):
+            for position, summary_value in enumerate(
+                one_seastate["result"]["summary_values"]
+            ):
+                column = method_index.get(summary_value["method"])
+                if column is None:
+                    column = method_index[summary_value["method"]] = len(methods)
+                    methods.append(sys.intern(summary_value["method"]))
+                points.append(point)
+                columns.append(column)
+                positions.append(position)
+                value_list.append(summary_value["value"])
+
+        num_points = len(data)
+        values = np.full((num_points, len(methods)), np.nan)
+        order = np.full((num_points, len(methods)), -1, dtype=np.int32)
+        points = np.array(points, dtype=np.intp)
+        columns = np.array(columns, dtype=np.intp)
+        values[points, columns] = value_list
+        order[points, columns] = positions
+
+        irregular_summary_values = {}
+        defined_per_point = (order >= 0).sum(axis=1)
+        values_per_point = np.bincount(points, minlength=num_points)
+        for point in np.nonzero(defined_per_point != values_per_point)[0].tolist():
+            irregular_summary_values[point] = [
+                dict(c) for c in data[point]["result"]["summary_values"]
+            ]
+        order[list(irregular_summary_values), :] = -1
+        hs = [c["hs"] for c in data]
+        tp = [c["tp"] for c in data]
+
+        return cls(
+            meta={k: _intern(v) for k, v in result_scatter["meta"].items()},
+            hs=np.array(hs, dtype=float),
+            tp=np.array(tp, dtype=float),
+            methods=methods,
+            values=values,
+            order=order,
+            time_series_id=[c["result"].get("time_series_id") for c in data],
+            has_time_series_id=np.array(
+                [("time_series_id" in c["result"]) for c in data], dtype=bool
+            ),
+            irregular_summary_values=irregular_summary_values,
+            integer_columns={
+                "hs": _all_integers(hs),
+                "tp": _all_integers(tp),
+                "value": _all_integers(value_list),
+            },
+        )
+
+    def _to_list(self, array, column):
+        """Converts a column array to a list of python numbers, as integers if all
+        the values of the column were integers in the json form
+        """
+        if self.integer_columns[column]:
+            return array.astype(np.int64).tolist()
+        return array.tolist()
+
+    def to_result_scatter(self):
+        """Returns the scatter in the json form used in all_seastate_results"""
+        summary_values = self.get_summary_value_lists()
+        hs = self._to_list(self.hs, "hs")
+        tp = self._to_list(self.tp, "tp")
+        data = []
+        for point in range(self.num_points):
+            result = {"summary_values": summary_values[point]}
+            if self.has_time_series_id[point]:
+                result["time_series_id"] = self.time_series_id[point]
+            data.append({"hs": hs[point], "tp": tp[point], "result": result})
+        return {"meta": dict(self.meta), "data": data}
+
+    def _get_ordered_entries(self):
+        """Returns the point index, method index and value of all defined values,
+        ordered by seastate and by the position in summary_values
+        """
+        points, columns = np.nonzero(self.order >= 0)
+        sort_index = np.lexsort((self.order[points, columns], points))
+        points = points[sort_index]
+        columns = columns[sort_index]
+        return points, columns, self.values[points, columns]
+
+    def get_summary_value_lists(self):
+        """Returns the summary_values list of every seastate"""
+        summary_values = [[] for _ in range(self.num_points)]
+        points, columns, values = self._get_ordered_entries()
+        for point, column, value in zip(
+            points.tolist(), columns.tolist(), self._to_list(values, "value")
+        ):
+            summary_values[point].append({"method": self.methods[column], "value": value})
+        for point, irregular_values in self.irregular_summary_values.items():
+            summary_values[point] = [dict(c) for c in irregular_values]
+        return summary_values
+
+    def get_summary_rows(self):
+        """Returns one dict per summary value with the keys hs, tp, the scatter
+        meta keys, method and value, ordered by seastate and by the position in
+        summary_values (as extract_all_summary_results)
+        """
+        if len(self.irregular_summary_values) > 0:
+            hs = self._to_list(self.hs, "hs")
+            tp = self._to_list(self.tp, "tp")
+            return [
+                {"hs": hs[point], "tp": tp[point], **self.meta, **summary_value}
+                for point, one_list in enumerate(self.get_summary_value_lists())
+                for summary_value in one_list
+            ]
+        points, columns, values = self._get_ordered_entries()
+        hs = self._to_list(self.hs[points], "hs")
+        tp = self._to_list(self.tp[points], "tp")
+        methods = [self.methods[c] for c in columns.tolist()]
+        return [
+            {"hs": h, "tp": t, **self.meta, "method": m, "value": v}
+            for h, t, m, v in zip(hs, tp, methods, self._to_list(values, "value"))
+        ]
+
+    def get_method_values(self, method: str):
+        """Returns the arrays hs, tp and value of all seastates with a value for
+        the given method, in seastate order
+        """
+        if len(self.irregular_summary_values) > 0:
+            rows = [c for c in self.get_summary_rows() if c["method"] == method]
+            return (
+                np.array([c["hs"] for c in rows], dtype=float),
+                np.array([c["tp"] for c in rows], dtype=float),
+                np.array([c["value"] for c in rows], dtype=float),
+            )
+        if method not in self.method_index:
+            return np.array([]), np.array([]), np.array([])
+        column = self.method_index[method]
+        points = np.nonzero(self.order[:, column] >= 0)[0]
+        return self.hs[points], self.tp[points], self.values[points, column]
+
+
+def _intern(value):
+    return sys.intern(value) if type(value) is str else value
+
+
+def _all_integers(values):
+    return len(values) > 0 and all(type(c) is int for c in values)
+
+
+def from_document(document):
+    """Returns one seastate_matrix per item in all_seastate_results"""
+    return [
+        seastate_matrix.from_result_scatter(c) for c in document["all_seastate_results"]
+    ]
+
+
+def get_summary_columns(matrices):
+    """Returns the summary values of the matrices in the columnar form of the
+    seastate_results route: one list per key of the rows of get_summary_rows, in
+    the same order.  The scatter meta keys (location, result_type, unit) and the
+    method are given as codes, the index of the value in the list of distinct
+    values of the key in dictionaries:
+
+        {
+            "dictionaries": {"location": ["wh_datum"], ..., "method": ["std", "max"]},
+            "columns": {
+                "hs": [1.0, 1.0, ...],
+                "tp": [4.0, 4.0, ...],
+                "location": [0, 0, ...],
+                ...
+                "method": [0, 1, ...],
+                "value": [0.1, 0.3, ...],
+            },
+        }
+
+    Row i is {"hs": columns["hs"][i], ..., "location":
+    dictionaries["location"][columns["location"][i]], ...}.  All scatters must
+    have the same meta keys (as in analysis_result)
+    """
+    meta_codes = {}
+    method_codes = {}
+    code_parts = {}
+    columns = {"hs": [], "tp": [], "value": []}
+
+    def get_codes(codes, values):
+        return np.array(
+            [codes.setdefault(c, len(codes)) for c in values], dtype=np.int64
+        )
+
+    for one_matrix in matrices:
+        if len(one_matrix.irregular_summary_values) > 0:
+            rows = one_matrix.get_summary_rows()
+            hs = [c["hs"] for c in rows]
+            tp = [c["tp"] for c in rows]
+            values = [c["value"] for c in rows]
+            methods = get_codes(method_codes, [c["method"] for c in rows])
+        else:
+            points, method_columns, values = one_matrix._get_ordered_entries()
+            hs = one_matrix._to_list(one_matrix.hs[points], "hs")
+            tp = one_matrix._to_list(one_matrix.tp[points], "tp")
+            values = one_matrix._to_list(values, "value")
+            methods = get_codes(method_codes, one_matrix.methods)[method_columns]
+        for key, value in one_matrix.meta.items():
+            codes = meta_codes.setdefault(key, {})
+            code = codes.setdefault(value, len(codes))
+            code_parts.setdefault(key, []).append(
+                np.full(len(values), code, dtype=np.int64)
+            )
+        code_parts.setdefault("method", []).append(methods)
+        columns["hs"].extend(hs)
+        columns["tp"].extend(tp)
+        columns["value"].extend(values)
+
+    dictionaries = {key: list(codes) for key, codes in meta_codes.items()}
+    dictionaries["method"] = list(method_codes)
+    return {
+        "dictionaries": dictionaries,
+        "columns": {
+            "hs": columns["hs"],
+            "tp": columns["tp"],
+            **{
+                key: np.concatenate(code_parts[key]).tolist() if key in code_parts else []
+                for key in dictionaries
+            },
+            "value": columns["value"],
+        },
+    }
+
+
+def extract_dynamic_interpolator(matrices):
+    """Returns the summary values grouped per location, result_type and method, in
+    the form used by the dynamic_interpolator route:
+
+        [
+            {
+                "meta": {"location": ..., "result_type": ..., "method": ...},
+                "scatters": [{"meta": {}, "data": [{"Hs": ..., "Tp": ..., "z": ...}]}],
+            }
+        ]
+
+    The groups are sorted by "location__result_type__method", and the seastates
+    of a group are in document order.  A column (Hs, Tp or z) is given as integers
+    if it only held integers in the whole document.
+    """
+    integer_columns = {
+        column: len(matrices) > 0 and all(c.integer_columns[column] for c in matrices)
+        for column in ["hs", "tp", "value"]
+    }
+    groups = {}
+    for one_matrix in matrices:
+        for method in one_matrix.methods:
+            hs, tp, values = one_matrix.get_method_values(method)
+            if len(hs) == 0:
+                continue
+            res_id = f"{one_matrix.location}__{one_matrix.result_type}__{method}"
+            if res_id not in groups:
+                groups[res_id] = {
+                    "meta": {
+                        "location": one_matrix.location,
+                        "result_type": one_matrix.result_type,
+                        "method": method,
+                    },
+                    "data": [],
+                }
+            groups[res_id]["data"].extend(
+                {"Hs": h, "Tp": t, "z": z}
+                for h, t, z in zip(
+                    _to_python_list(hs, integer_columns["hs"]),
+                    _to_python_list(tp, integer_columns["tp"]),
+                    _to_python_list(values, integer_columns["value"]),
+                )
+            )
+    return [
+        {
+            "meta": groups[res_id]["meta"],
+            "scatters": [{"meta": {}, "data": groups[res_id]["data"]}],
+        }
+        for res_id in sorted(groups)
+    ]
+
+
+def _to_python_list(array, is_integer):
+    if is_integer:
+        return array.astype(np.int64).tolist()
+    return array.tolist()
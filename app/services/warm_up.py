@@ -0,0 +1,48 @@
+import asyncio
+import importlib
+import os
+from starlette.concurrency import run_in_threadpool
+
+# Modules that are slow to import (numpy and scipy) and are therefore not imported
+# with the app, but on first use or by warm_up
+DEFERRED_MODULES = [
+    "app.services.seastate_matrix",
+    "app.services.seastate_interpolator",
+]
+
+
+def import_deferred_modules(module_names: list = None):
+    """Imports the given modules, by default DEFERRED_MODULES"""
+    if module_names is None:
+        module_names = DEFERRED_MODULES
+    for module_name in module_names:
+        importlib.import_module(module_name)
+
+
+class warm_up(object):
+    """Imports the deferred modules in the threadpool after the app has started,
+    so that the app can serve requests at once and the first request using numpy
+    does not pay for the import.  Disabled by setting the environment variable
+    WARM_UP to "false"
+    """
+
+    def __init__(self, enabled: bool = None):
+        if enabled is None:
+            enabled = os.getenv("WARM_UP", "true").lower() in ["1", "true"]
+        self.enabled = enabled
+        self.task = None
+
+    async def _import_quietly(self):
+        try:
+            await run_in_threadpool(import_deferred_modules)
+        except Exception:
+            pass
+
+    def start(self):
+        if self.enabled and self.task is None:
+            self.task = asyncio.get_running_loop().create_task(self._import_quietly())
+
+    async def stop(self):
+        if self.task is not None:
+            await self.task
+            self.task = None
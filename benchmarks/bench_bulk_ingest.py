@@ -0,0 +1,65 @@
+"""Compares posting analyses one at a time with POST /api/analyses/bulk.
+
+The database is simulated by a write that sleeps for --latency-ms, so the
+benchmark measures validation cost and how well the write latency is
+overlapped.  Run from the repository root:
+
+    python -m benchmarks.bench_bulk_ingest
+"""
+import argparse
+import asyncio
+import json
+import time
+from app.models.analyses import analysis_result
+from app.services.bulk_ingest import bulk_insert
+from .synthetic_analysis import get_synthetic_analysis
+
+
+async def _iterate(items):
+    for c in items:
+        yield c
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-documents", type=int, default=200)
+    parser.add_argument("--num-scatters", type=int, default=3)
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    parser.add_argument("--max-concurrency", type=int, default=16)
+    args = parser.parse_args()
+
+    lines = [
+        json.dumps(get_synthetic_analysis(num_scatters=args.num_scatters, seed=i)).encode()
+        for i in range(args.num_documents)
+    ]
+
+    async def post_document(document):
+        await asyncio.sleep(args.latency_ms / 1000)
+        return {"id": "id"}
+
+    async def one_at_a_time():
+        for line in lines:
+            await post_document(analysis_result(**json.loads(line)).model_dump())
+
+    start = time.perf_counter()
+    asyncio.run(one_at_a_time())
+    sequential = time.perf_counter() - start
+
+    start = time.perf_counter()
+    asyncio.run(
+        bulk_insert(
+            _iterate(lines), analysis_result, post_document, args.max_concurrency
+        )
+    )
+    bulk = time.perf_counter() - start
+
+    print(
+        f"{args.num_documents} documents of {len(lines[0]) / 1e6:.2f} MB, "
+        f"{args.latency_ms} ms write latency"
+    )
+    print(f"{'one at a time':>20}: {sequential:8.2f} s")
+    print(f"{'bulk':>20}: {bulk:8.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""Compares the pandas implementation of /api/analyses/{id}/dynamic_interpolator
+with the seastate_matrix implementation.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_dynamic_interpolator
+"""
+import argparse
+import timeit
+from app.services.seastate_matrix import from_document, extract_dynamic_interpolator
+from .legacy_implementations import get_dynamic_interpolator
+from .synthetic_analysis import get_synthetic_analysis
+
+
+def _time(function, repeat):
+    return min(timeit.repeat(function, number=1, repeat=repeat))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-scatters", type=int, default=20)
+    parser.add_argument("--num-hs", type=int, default=20)
+    parser.add_argument("--num-tp", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    document = get_synthetic_analysis(args.num_scatters, args.num_hs, args.num_tp)
+    matrices = from_document(document)
+    assert extract_dynamic_interpolator(matrices) == get_dynamic_interpolator(document)
+
+    results = {
+        "pandas": _time(lambda: get_dynamic_interpolator(document), args.repeat),
+        "seastate_matrix (cold)": _time(
+            lambda: extract_dynamic_interpolator(from_document(document)), args.repeat
+        ),
+        "seastate_matrix (cached matrices)": _time(
+            lambda: extract_dynamic_interpolator(matrices), args.repeat
+        ),
+    }
+    num_values = args.num_scatters * args.num_hs * args.num_tp * 4
+    print(f"{args.num_scatters} scatters, {num_values} summary values")
+    for name, seconds in results.items():
+        print(f"{name:>36}: {seconds * 1000:9.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
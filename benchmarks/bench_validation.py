@@ -0,0 +1,59 @@
+"""Compares the validation of POST /api/analyses in document mode
+(analysis_result_document) with validation into analysis_result models followed
+by model_dump, in time and peak memory.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_validation
+"""
+import argparse
+import timeit
+import tracemalloc
+from app.models.analyses import analysis_result_document
+from app.services.json_responses import dumps
+from .legacy_implementations import validate_analysis_result
+from .synthetic_analysis import get_synthetic_analysis
+
+
+def _time(function, repeat):
+    return min(timeit.repeat(function, number=1, repeat=repeat))
+
+
+def _peak_memory(function):
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-scatters", type=int, default=20)
+    parser.add_argument("--num-hs", type=int, default=20)
+    parser.add_argument("--num-tp", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    document = get_synthetic_analysis(args.num_scatters, args.num_hs, args.num_tp)
+    body = dumps(document)
+    assert analysis_result_document.validate_document_json(
+        body
+    ) == validate_analysis_result(body)
+
+    functions = {
+        "models + model_dump": lambda: validate_analysis_result(body),
+        "document mode": lambda: analysis_result_document.validate_document_json(
+            body
+        ),
+    }
+    print(f"{args.num_scatters} scatters, {len(body) / 1e6:.1f} MB of json")
+    for name, function in functions.items():
+        seconds = _time(function, args.repeat)
+        peak = _peak_memory(function)
+        print(f"{name:>24}: {seconds * 1000:9.2f} ms {peak / 1e6:9.1f} MB peak")
+
+
+if __name__ == "__main__":
+    main()
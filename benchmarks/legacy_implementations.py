@@ -0,0 +1,50 @@
+"""The original pandas implementations of routes that have been rewritten.  Kept
+as a reference for regression tests and benchmarks.
+"""
+import json
+import pandas as pd
+from app.models.analyses import analysis_result
+from app.services.analysis_dict_manipulator import extract_all_summary_results
+
+
+def get_dynamic_interpolator(doc):
+    summary_res = pd.DataFrame(extract_all_summary_results(doc))
+    summary_res["res_id"] = summary_res["location"].str.cat(
+        summary_res["result_type"].str.cat(summary_res["method"], sep="__"),
+        sep="__",
+    )
+    return_documents = []
+
+    for res_id, one_res_id_data in summary_res.groupby("res_id"):
+        return_document = {
+            "meta": {
+                "location": one_res_id_data["location"].unique()[0],
+                "result_type": one_res_id_data["result_type"].unique()[0],
+                "method": one_res_id_data["method"].unique()[0],
+            },
+            "scatters": [],
+        }
+        one_scatter = {
+            "meta": {},
+            "data": [],
+        }
+        for _, one_seastate in one_res_id_data.iterrows():
+            one_scatter["data"].append(
+                {
+                    "Hs": one_seastate["hs"],
+                    "Tp": one_seastate["tp"],
+                    "z": one_seastate["value"],
+                }
+            )
+
+        return_document["scatters"].append(one_scatter)
+        return_documents.append(return_document)
+
+    return return_documents
+
+
+def validate_analysis_result(body):
+    """POST /api/analyses before document mode: FastAPI decodes the body, the
+    dict is validated into analysis_result models and dumped back into a dict
+    """
+    return analysis_result.model_validate(json.loads(body)).model_dump()
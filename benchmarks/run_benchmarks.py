@@ -0,0 +1,357 @@
+"""Benchmark suite for the dict manipulation hot paths and the HTTP API.
+
+The routes are called in process through the FastAPI TestClient, with the
+documents in a memory_database_service, so no database is needed.  Importing
+the app requires the same environment variables as the tests
+(B2C_DISCOVERY_KEYS_URL and ALLOWED_TOKEN_AUD); ENVIRONMENT is set to
+"development" to skip token validation.
+
+Run from the repository root:
+
+    python -m benchmarks.run_benchmarks --output results.json
+    python -m benchmarks.run_benchmarks --output new.json --compare results.json
+
+With --compare, the median of every benchmark is compared to the baseline
+file, and the exit code is 1 if any benchmark is slower than the baseline by
+more than --threshold.
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from copy import deepcopy
+from datetime import datetime, timezone
+from .synthetic_analysis import get_synthetic_analysis
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """Registers a benchmark.  The decorated function is called with the
+    benchmark config and an ExitStack, and returns the function to be timed
+    """
+
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+
+    return register
+
+
+def _get_updates(document, num_updates, seed=0):
+    rng = random.Random(seed)
+    updates = []
+    for _ in range(num_updates):
+        one_scatter = rng.choice(document["all_seastate_results"])
+        one_seastate = rng.choice(one_scatter["data"])
+        updates.append(
+            {
+                "hs": one_seastate["hs"],
+                "tp": one_seastate["tp"],
+                "location": one_scatter["meta"]["location"],
+                "result_type": one_scatter["meta"]["result_type"],
+                "method": rng.choice(["std", "max", "m_eq"]),
+                "value": rng.uniform(0, 1000),
+            }
+        )
+    return updates
+
+
+def _get_document(config):
+    return get_synthetic_analysis(
+        config["num_scatters"], config["num_hs"], config["num_tp"]
+    )
+
+
+@benchmark("extract_all_summary_results")
+def setup_extract_all_summary_results(config, stack):
+    from app.services.analysis_dict_manipulator import extract_all_summary_results
+
+    document = _get_document(config)
+    return lambda: extract_all_summary_results(document)
+
+
+@benchmark("extract_summary_result_types")
+def setup_extract_summary_result_types(config, stack):
+    from app.services.analysis_dict_manipulator import extract_summary_result_types
+
+    document = _get_document(config)
+    return lambda: extract_summary_result_types(document)
+
+
+@benchmark("update_seastate_summary_results")
+def setup_update_seastate_summary_results(config, stack):
+    from app.services.analysis_dict_manipulator import update_seastate_summary_results
+
+    document = _get_document(config)
+    updates = _get_updates(document, config["num_updates"])
+    return lambda: update_seastate_summary_results(document, updates)
+
+
+def _get_client(config, stack):
+    """Returns a TestClient of an app serving config["num_analyses"] synthetic
+    analyses from a memory_database_service, and the id of the large analysis
+    """
+    os.environ.setdefault("ENVIRONMENT", "development")
+    from fastapi.testclient import TestClient
+    from app.fast_api_app import get_app
+    from app.services.local_database_service import memory_database_service
+
+    db_serv = memory_database_service()
+    document = _get_document(config)
+    vessel_id = document["metadata"]["vessel_id"]
+    db_serv.upsert_documents("vessels", [{"id": vessel_id, "name": "benchmark rig"}])
+    db_serv.upsert_documents("analyses", [document])
+    db_serv.upsert_documents(
+        "analyses",
+        [
+            get_synthetic_analysis(num_scatters=1, num_hs=2, num_tp=2, seed=i + 1)
+            for i in range(config["num_analyses"] - 1)
+        ],
+    )
+    client = stack.enter_context(TestClient(get_app(db_serv=db_serv)))
+    return client, document
+
+
+def _get_checked(client, method, url, **kwargs):
+    def call():
+        response = client.request(method, url, **kwargs)
+        assert response.status_code == 200, response.text
+        return response
+
+    return call
+
+
+@benchmark("route_dynamic_interpolator")
+def setup_route_dynamic_interpolator(config, stack):
+    client, document = _get_client(config, stack)
+    url = f"/api/analyses/{document['id']}/dynamic_interpolator"
+    return _get_checked(client, "GET", url)
+
+
+@benchmark("route_drio_time_series_ids")
+def setup_route_drio_time_series_ids(config, stack):
+    client, document = _get_client(config, stack)
+    url = f"/api/analyses/{document['id']}/drio_time_series_ids"
+    return _get_checked(client, "GET", url)
+
+
+@benchmark("route_result_summary")
+def setup_route_result_summary(config, stack):
+    client, _ = _get_client(config, stack)
+    return _get_checked(client, "GET", "/api/analyses/summary/result_summary")
+
+
+@benchmark("route_seastate_results")
+def setup_route_seastate_results(config, stack):
+    client, document = _get_client(config, stack)
+    url = f"/api/analyses/{document['id']}/seastate_results"
+    return _get_checked(client, "GET", url)
+
+
+@benchmark("route_seastate_results_columnar")
+def setup_route_seastate_results_columnar(config, stack):
+    client, document = _get_client(config, stack)
+    url = f"/api/analyses/{document['id']}/seastate_results"
+    return _get_checked(client, "GET", url, params={"format": "columnar"})
+
+
+@benchmark("route_get_analysis")
+def setup_route_get_analysis(config, stack):
+    client, document = _get_client(config, stack)
+    return _get_checked(client, "GET", f"/api/analyses/{document['id']}")
+
+
+@benchmark("route_get_all_analyses")
+def setup_route_get_all_analyses(config, stack):
+    client, _ = _get_client(config, stack)
+    return _get_checked(client, "GET", "/api/analyses")
+
+
+@benchmark("serialize_analysis")
+def setup_serialize_analysis(config, stack):
+    from app.services.json_responses import dumps
+
+    document = _get_document(config)
+    return lambda: dumps(document)
+
+
+@benchmark("validate_analysis")
+def setup_validate_analysis(config, stack):
+    from app.models.analyses import analysis_result_document
+    from app.services.json_responses import dumps
+
+    body = dumps(_get_document(config))
+    return lambda: analysis_result_document.validate_document_json(body)
+
+
+@benchmark("route_post_analysis")
+def setup_route_post_analysis(config, stack):
+    from app.services.json_responses import dumps
+
+    client, document = _get_client(config, stack)
+    document = dict(document)
+    del document["id"]
+    return _get_checked(
+        client,
+        "POST",
+        "/api/analyses",
+        content=dumps(document),
+        headers={"Content-Type": "application/json"},
+    )
+
+
+@benchmark("route_seastate_summary_update")
+def setup_route_seastate_summary_update(config, stack):
+    client, document = _get_client(config, stack)
+    updates = _get_updates(document, config["num_updates"])
+    return _get_checked(
+        client,
+        "PUT",
+        "/api/analyses/update/seastate_summary_update",
+        json={"id": document["id"], "updates": updates},
+    )
+
+
+@benchmark("route_patch_many_operations")
+def setup_route_patch_many_operations(config, stack):
+    client, document = _get_client(config, stack)
+    num_seastates = len(document["all_seastate_results"][0]["data"])
+    patches = [
+        {
+            "op": "replace",
+            "path": f"/all_seastate_results/0/data/{i % num_seastates}/result/time_series_id",
+            "value": f"time_series_{i}",
+        }
+        for i in range(config["num_updates"])
+    ]
+    return _get_checked(
+        client, "PATCH", f"/api/analyses/{document['id']}", json=patches
+    )
+
+
+@benchmark("cold_start_import")
+def setup_cold_start_import(config, stack):
+    """Imports the app and builds it in a new interpreter, as a worker does on
+    a cold start.  Includes the interpreter startup
+    """
+    env = {**os.environ, "ANALYSES_STORE_BACKEND": "cosmos"}
+    command = [
+        sys.executable,
+        "-c",
+        "from app.fast_api_app import get_app; get_app()",
+    ]
+    return lambda: subprocess.run(command, env=env, check=True)
+
+
+def run_benchmark(setup, config):
+    """Times the benchmark and returns its statistics in milliseconds"""
+    with contextlib.ExitStack() as stack:
+        function = setup(deepcopy(config), stack)
+        function()
+        times = []
+        for _ in range(config["repeat"]):
+            start = time.perf_counter()
+            function()
+            times.append((time.perf_counter() - start) * 1000)
+    return {
+        "unit": "ms",
+        "repeat": len(times),
+        "min": min(times),
+        "median": statistics.median(times),
+        "mean": statistics.mean(times),
+        "stdev": statistics.stdev(times) if len(times) > 1 else 0.0,
+    }
+
+
+def _get_git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold, min_difference_ms=0.05):
+    """Prints the change of every benchmark median relative to the baseline and
+    returns the names of the benchmarks that are slower by more than threshold
+    (a fraction, e.g. 0.2 for 20%) and by more than min_difference_ms
+    """
+    regressions = []
+    print(f"{'benchmark':<36}{'baseline ms':>14}{'current ms':>14}{'change':>10}")
+    for name, result in results["results"].items():
+        if name not in baseline["results"]:
+            print(f"{name:<36}{'-':>14}{result['median']:>14.3f}{'new':>10}")
+            continue
+        old = baseline["results"][name]["median"]
+        change = result["median"] / old - 1
+        flag = ""
+        if change > threshold and result["median"] - old > min_difference_ms:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:<36}{old:>14.3f}{result['median']:>14.3f}{change:>+10.1%}{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--output", help="file to write the results to (json)")
+    parser.add_argument("--compare", help="results file to compare with")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    parser.add_argument("--filter", default="", help="only run benchmarks containing this")
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--num-scatters", type=int, default=20)
+    parser.add_argument("--num-hs", type=int, default=20)
+    parser.add_argument("--num-tp", type=int, default=20)
+    parser.add_argument("--num-updates", type=int, default=200)
+    parser.add_argument("--num-analyses", type=int, default=200)
+    args = parser.parse_args(argv)
+
+    config = {
+        "repeat": args.repeat,
+        "num_scatters": args.num_scatters,
+        "num_hs": args.num_hs,
+        "num_tp": args.num_tp,
+        "num_updates": args.num_updates,
+        "num_analyses": args.num_analyses,
+    }
+    results = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "git_commit": _get_git_commit(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "config": config,
+        },
+        "results": {},
+    }
+    for name, setup in BENCHMARKS.items():
+        if args.filter not in name:
+            continue
+        result = run_benchmark(setup, config)
+        results["results"][name] = result
+        print(f"{name:<36}{result['median']:>10.3f} ms (min {result['min']:.3f})")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline["meta"]["config"] != config:
+            print("warning: the baseline was run with a different config")
+        print()
+        if len(compare(results, baseline, args.threshold)) > 0:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
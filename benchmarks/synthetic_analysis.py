@@ -0,0 +1,76 @@
+import copy
+import json
+import random
+import uuid
+
+TEMPLATE_FILE = "tests/testfiles/models/analyses/analysis_1.json"
+LOCATIONS = [
+    "wh_datum",
+    "lfj_below",
+    "lfj_above",
+    "ufj_above",
+    "ufj_below",
+    "rig_center",
+    "rig_rkb",
+]
+RESULT_TYPES = [
+    "bending moment local x",
+    "bending moment local y",
+    "angle rx",
+    "angle ry",
+    "effective tension",
+]
+METHODS = ["std", "max", "min", "mean"]
+
+
+def get_synthetic_analysis(
+    num_scatters: int = 20,
+    num_hs: int = 20,
+    num_tp: int = 20,
+    methods=None,
+    seed: int = 0,
+    locations=None,
+    result_types=None,
+):
+    """Returns an analysis_result document with num_scatters result scatters of
+    num_hs x num_tp seastates, each with one summary value per method.  The
+    scatters cycle through all combinations of locations and result_types.  The
+    metadata is copied from the first test analysis, and the document is valid
+    against the analysis_result model.
+    """
+    if methods is None:
+        methods = METHODS
+    if locations is None:
+        locations = LOCATIONS
+    if result_types is None:
+        result_types = RESULT_TYPES
+    rng = random.Random(seed)
+    with open(TEMPLATE_FILE) as f:
+        document = json.load(f)
+    document = copy.deepcopy(document)
+    document["id"] = str(uuid.UUID(int=rng.getrandbits(128)))
+    document["all_seastate_results"] = [
+        {
+            "meta": {
+                "location": locations[i % len(locations)],
+                "result_type": result_types[(i // len(locations)) % len(result_types)],
+                "unit": "kNm",
+            },
+            "data": [
+                {
+                    "hs": 0.5 * (hs_index + 1),
+                    "tp": 3.5 + tp_index,
+                    "result": {
+                        "summary_values": [
+                            {"method": c, "value": rng.uniform(0, 1000)} for c in methods
+                        ],
+                        "time_series_id": str(uuid.UUID(int=rng.getrandbits(128))),
+                    },
+                }
+                for hs_index in range(num_hs)
+                for tp_index in range(num_tp)
+            ],
+        }
+        for i in range(num_scatters)
+    ]
+    return document
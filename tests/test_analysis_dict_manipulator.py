@@ -1,5 +1,6 @@
 import pytest
 from unittest.mock import patch
+from copy import deepcopy
 
 from app.services.analysis_dict_manipulator import (
     extract_summary_result_types,
@@ -361,3 +362,53 @@ def test_update_one_seastate_sumamry_value(filter_dict_mock, update_summary_mock
             "two",
         ]
     }
+
+
+def _apply_updates_one_by_one(document, list_of_updates):
+    for update in list_of_updates:
+        document = update_one_seastate_sumamry_value(document=document, **update)
+    return document
+
+
+def test_update_seastate_summary_results_equals_one_by_one(test_dict):
+    hs_tp_values = [(0.5, 5.5), (1.5, 5.5), (0.5, 2.5), (2.5, 7.5)]
+    list_of_updates = [
+        {
+            "hs": hs,
+            "tp": tp,
+            "location": location,
+            "result_type": result_type,
+            "method": method,
+            "value": float(i),
+        }
+        for i, (location, result_type, (hs, tp), method) in enumerate(
+            (location, result_type, hs_tp, method)
+            for location in ["wh_datum", "lfj_below"]
+            for result_type in ["bending moment local x", "bending moment local y"]
+            for hs_tp in hs_tp_values
+            for method in ["std", "min", "std", "m_eq"]
+        )
+    ]
+    original = deepcopy(test_dict)
+    result = update_seastate_summary_results(test_dict, list_of_updates)
+    assert result == _apply_updates_one_by_one(test_dict, list_of_updates)
+    assert test_dict == original
+
+
+def test_update_seastate_summary_results_duplicated_seastates(test_dict):
+    data = test_dict["all_seastate_results"][0]["data"]
+    data.append(deepcopy(data[0]))
+    list_of_updates = [
+        {
+            "hs": 0.5,
+            "tp": 5.5,
+            "location": "wh_datum",
+            "result_type": "bending moment local x",
+            "method": "std",
+            "value": float(i),
+        }
+        for i in range(3)
+    ]
+    assert update_seastate_summary_results(
+        test_dict, list_of_updates
+    ) == _apply_updates_one_by_one(test_dict, list_of_updates)
@@ -0,0 +1,262 @@
+import asyncio
+import pytest
+from unittest.mock import patch, MagicMock, AsyncMock, create_autospec
+from app.services.async_database_service import (
+    async_database_service,
+    threadpool_database_service,
+    as_async_database_service,
+)
+from app.services.database_service import database_service
+from app.services.request_metrics import record_cosmos_request, record_cosmos_response
+from azure.cosmos.exceptions import (
+    CosmosAccessConditionFailedError,
+    CosmosResourceNotFoundError,
+)
+from azure.core import MatchConditions
+
+
+class _async_iterator:
+    def __init__(self, items):
+        self.items = list(items)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.items:
+            raise StopAsyncIteration
+        return self.items.pop(0)
+
+
+@pytest.fixture
+@patch("app.services.async_database_service.os")
+def mock_async_serv(os_mock: MagicMock):
+    os_mock.getenv.side_effect = ["os_val_1", "os_val_2"]
+    serv = async_database_service()
+    serv.client = MagicMock()
+    serv.data_base_proxy = MagicMock()
+    container = MagicMock(id="CosmosContainerClientMock")
+    container.read = AsyncMock(return_value={"partitionKey": {"paths": ["/id"]}})
+    serv.data_base_proxy.get_container_client.return_value = container
+    return serv, container
+
+
+@patch("app.services.async_database_service.CosmosClient")
+def test_async_database_service_open_close(cosmos_client_mock):
+    serv = async_database_service()
+    client = MagicMock()
+    client.close = AsyncMock()
+    client.get_database_client.return_value.list_containers.return_value = (
+        _async_iterator([{"id": "analyses", "partitionKey": {"paths": ["/id"]}}])
+    )
+    cosmos_client_mock.return_value = client
+    asyncio.run(serv.open())
+    asyncio.run(serv.open())
+    cosmos_client_mock.assert_called_once_with(
+        serv.host,
+        serv.master_key,
+        raw_request_hook=record_cosmos_request,
+        raw_response_hook=record_cosmos_response,
+    )
+    client.get_database_client.assert_called_once_with("dynops-store-data")
+    assert serv.containers["analyses"]["partition_key_path"] == "/id"
+    asyncio.run(serv.close())
+    client.close.assert_awaited_once()
+    assert serv.client is None
+
+
+def test_async_get_one_document_by_id(mock_async_serv):
+    serv, container = mock_async_serv
+    container.read_item = AsyncMock(
+        return_value={"id": "my_id_1", "_etag": "etag", "_ts": 1}
+    )
+    res = asyncio.run(serv.get_one_document_by_id("dummy_collection", "my_id_1"))
+    assert res == {"id": "my_id_1"}
+    container.read_item.assert_awaited_once_with(
+        item="my_id_1", partition_key="my_id_1"
+    )
+    container.query_items.assert_not_called()
+
+
+def test_async_get_one_document_by_id_not_found(mock_async_serv):
+    serv, container = mock_async_serv
+    container.read_item = AsyncMock(side_effect=CosmosResourceNotFoundError())
+    assert asyncio.run(serv.get_one_document_by_id("dummy_collection", "id")) == []
+
+
+def test_async_get_one_document_by_id_other_partition_key(mock_async_serv):
+    serv, container = mock_async_serv
+    container.read.return_value = {"partitionKey": {"paths": ["/project_id"]}}
+    container.query_items.return_value = _async_iterator(
+        [{"id": "my_id_1", "_etag": "etag", "_ts": 1}]
+    )
+    res = asyncio.run(serv.get_one_document_by_id("dummy_collection", "my_id_1"))
+    assert res == {"id": "my_id_1"}
+    container.query_items.assert_called_once_with(
+        query="SELECT * FROM d WHERE  d.id =@id",
+        parameters=[{"name": "@id", "value": "my_id_1"}],
+    )
+
+
+def test_async_get_all_documents(mock_async_serv):
+    serv, container = mock_async_serv
+    container.read_all_items.return_value = _async_iterator(
+        [{"id": "1", "_rid": "a"}, {"id": "2", "_self": "b"}]
+    )
+    res = asyncio.run(serv.get_all_documents("dummy_collection"))
+    assert res == [{"id": "1"}, {"id": "2"}]
+
+
+def test_async_get_many_documents_by_id(mock_async_serv):
+    serv, container = mock_async_serv
+    container.read_items = AsyncMock(return_value=[{"id": "b", "_ts": 1}])
+    res = asyncio.run(serv.get_many_documents_by_id("analyses", ["a", "b"]))
+    assert res == [None, {"id": "b"}]
+    container.read_items.assert_awaited_once_with(items=[("a", "a"), ("b", "b")])
+
+    container.query_items.return_value = _async_iterator([{"id": "a", "metadata": 1}])
+    res = asyncio.run(
+        serv.get_many_documents_by_id("analyses", ["a"], selected_keys=["metadata"])
+    )
+    assert res == [{"id": "a", "metadata": 1}]
+
+
+def test_async_delete_one_document_by_id(mock_async_serv):
+    serv, container = mock_async_serv
+    container.delete_item = AsyncMock(return_value=None)
+    asyncio.run(serv.delete_one_document_by_id("dummy_collection", "my_id_1"))
+    container.delete_item.assert_awaited_once_with(
+        item="my_id_1", partition_key="my_id_1"
+    )
+
+
+def test_async_post_one_document(mock_async_serv):
+    serv, container = mock_async_serv
+    container.create_item = AsyncMock(side_effect=lambda body: {**body, "_ts": 1})
+    res = asyncio.run(serv.post_one_document("dummy_collection", {"foo": "bar"}))
+    assert res["foo"] == "bar"
+    assert "_ts" not in res
+    assert len(res["id"]) == 36
+
+
+def test_async_patch_one_document(mock_async_serv):
+    serv, container = mock_async_serv
+    container.patch_item = AsyncMock(return_value={"id": "my_id_1", "a": 1})
+    updates = [{"op": "replace", "path": "/a", "value": 1}]
+    res = asyncio.run(serv.patch_one_document("dummy_collection", "my_id_1", updates))
+    assert res == {"id": "my_id_1", "a": 1}
+    container.patch_item.assert_awaited_once_with(
+        item="my_id_1", partition_key="my_id_1", patch_operations=updates
+    )
+
+
+def test_async_patch_one_document_retries_replace(mock_async_serv):
+    serv, container = mock_async_serv
+    container.read_item = AsyncMock(
+        return_value={"id": "my_id_1", "a": 1, "_etag": "etag_1"}
+    )
+    container.replace_item = AsyncMock(
+        side_effect=[CosmosAccessConditionFailedError(), {"id": "my_id_1", "b": 1}]
+    )
+    updates = [{"op": "move", "from": "/a", "path": "/b"}]
+    res = asyncio.run(serv.patch_one_document("dummy_collection", "my_id_1", updates))
+    assert res == {"id": "my_id_1", "b": 1}
+    assert container.replace_item.await_count == 2
+    container.replace_item.assert_awaited_with(
+        item="my_id_1",
+        body={"id": "my_id_1", "b": 1},
+        etag="etag_1",
+        match_condition=MatchConditions.IfNotModified,
+    )
+
+
+def test_threadpool_database_service_forwards_calls():
+    sync_serv = create_autospec(database_service)
+    sync_serv.get_one_document_by_id.return_value = {"foo": "bar"}
+    serv = as_async_database_service(sync_serv)
+    assert isinstance(serv, threadpool_database_service)
+    res = asyncio.run(serv.get_one_document_by_id("vessels", "my_id"))
+    assert res == {"foo": "bar"}
+    sync_serv.get_one_document_by_id.assert_called_once_with("vessels", "my_id")
+
+
+def test_threadpool_database_service_opens_and_closes_wrapped_service():
+    sync_serv = create_autospec(database_service)
+    serv = as_async_database_service(sync_serv)
+    asyncio.run(serv.open())
+    asyncio.run(serv.close())
+    sync_serv.open.assert_called_once_with()
+    sync_serv.close.assert_called_once_with()
+
+
+def test_as_async_database_service_keeps_async_service():
+    serv = create_autospec(async_database_service)
+    assert as_async_database_service(serv) is serv
+
+
+def test_as_async_database_service_requires_a_document_store():
+    class incomplete_database_service(object):
+        def get_one_document_by_id(self, collection_name, document_id):
+            return []
+
+    with pytest.raises(TypeError, match="document_store"):
+        as_async_database_service(incomplete_database_service())
+
+
+def test_routes_with_async_database_service():
+    import os
+    from fastapi.testclient import TestClient
+
+    os.environ["ENVIRONMENT"] = "development"
+    from app.fast_api_app import get_app
+
+    db_serv_mock = create_autospec(async_database_service)
+    db_serv_mock.get_one_document_with_version.return_value = (
+        {"foo": "bar"},
+        "etag",
+        1700000000,
+    )
+    with TestClient(get_app(db_serv=db_serv_mock)) as client:
+        response = client.get("/api/vessels/my_vessel_id")
+    assert response.status_code == 200
+    assert response.json() == {"foo": "bar"}
+    assert response.headers["last-modified"] == "Tue, 14 Nov 2023 22:13:20 GMT"
+    db_serv_mock.get_one_document_with_version.assert_awaited_once_with(
+        "vessels", "my_vessel_id"
+    )
+    db_serv_mock.open.assert_awaited_once()
+    db_serv_mock.close.assert_awaited_once()
+
+
+def test_async_read_change_feed(mock_async_serv):
+    serv, container = mock_async_serv
+    # the headers of the client belong to whichever request finished last
+    container.client_connection.last_response_headers = {"etag": "other_request"}
+    calls = []
+
+    def query_items_change_feed(items, token):
+        def query(**kwargs):
+            calls.append({k: v for k, v in kwargs.items() if k != "response_hook"})
+
+            async def pages():
+                kwargs["response_hook"]({"etag": token}, {})
+                for item in items:
+                    yield item
+
+            return pages()
+
+        return query
+
+    container.query_items_change_feed.side_effect = query_items_change_feed(
+        [], "token_1"
+    )
+    assert asyncio.run(serv.read_change_feed("analyses")) == ([], "token_1")
+    assert calls[-1] == {"start_time": "Now", "max_item_count": 100}
+
+    container.query_items_change_feed.side_effect = query_items_change_feed(
+        [{"id": "a", "_ts": 1, "_etag": "e"}, {"id": "b", "_ts": 2}], "token_2"
+    )
+    documents, continuation = asyncio.run(serv.read_change_feed("analyses", "token_1"))
+    assert documents == [{"id": "a", "_ts": 1}, {"id": "b", "_ts": 2}]
+    assert continuation == "token_2"
+    assert calls[-1] == {"continuation": "token_1", "max_item_count": 100}
@@ -0,0 +1,127 @@
+import asyncio
+import base64
+import os
+import time
+import pytest
+from unittest.mock import patch
+from fastapi import HTTPException
+from fastapi.security import HTTPAuthorizationCredentials
+from jose import jwt
+
+# ENVIRONMENT is read when the module is imported, and the other tests rely on
+# token validation being disabled
+os.environ["ENVIRONMENT"] = "development"
+from app.auth import authorization
+from app.auth.authorization import (
+    get_user,
+    jwks_key_store,
+    verified_token_cache,
+)
+
+SECRETS = {"key_1": "first secret", "key_2": "second secret"}
+
+
+def _get_jwks(kids):
+    return {
+        "keys": [
+            {
+                "kty": "oct",
+                "kid": kid,
+                "alg": "HS256",
+                "k": base64.urlsafe_b64encode(SECRETS[kid].encode()).decode().rstrip("="),
+            }
+            for kid in kids
+        ]
+    }
+
+
+def _get_token(kid, exp=None):
+    claims = {
+        "name": "Jane Doe",
+        "email": "jane@doe.com",
+        "organizationId": "2c4ee562-6261-4018-a1b1-8837ab526944",
+        "aud": authorization.ALLOWED_TOKEN_AUD,
+        "exp": time.time() + 3600 if exp is None else exp,
+    }
+    return jwt.encode(claims, SECRETS[kid], algorithm="HS256", headers={"kid": kid})
+
+
+@pytest.fixture
+def key_store(monkeypatch):
+    store = jwks_key_store("https://issuer/keys", min_refresh_interval_seconds=0)
+    store.jwks_to_serve = _get_jwks(["key_1"])
+    store.fetch_count = 0
+
+    def fetch():
+        store.fetch_count += 1
+        return store.jwks_to_serve
+
+    monkeypatch.setattr(store, "fetch", fetch)
+    monkeypatch.setattr(authorization, "key_store", store)
+    monkeypatch.setattr(authorization, "token_cache", verified_token_cache())
+    monkeypatch.setattr(authorization, "ENVIRONMENT", "production")
+    return store
+
+
+def _get_user(token):
+    return asyncio.run(
+        get_user(HTTPAuthorizationCredentials(scheme="Bearer", credentials=token))
+    )
+
+
+def test_token_is_verified_once(key_store):
+    token = _get_token("key_1")
+    with patch.object(authorization.jwt, "decode", wraps=jwt.decode) as decode:
+        users = [_get_user(token) for _ in range(3)]
+    assert users[0].email == "jane@doe.com"
+    assert users == users[:1] * 3
+    assert decode.call_count == 1
+    assert key_store.fetch_count == 1
+
+
+def test_keys_are_reloaded_for_unknown_kid(key_store):
+    old_token = _get_token("key_1")
+    _get_user(old_token)
+    key_store.jwks_to_serve = _get_jwks(["key_2"])
+    assert _get_user(_get_token("key_2")).name == "Jane Doe"
+    assert key_store.fetch_count == 2
+    assert key_store.version == 2
+    with pytest.raises(HTTPException) as e:
+        _get_user(old_token)
+    assert e.value.status_code == 401
+
+
+def test_expired_and_invalid_tokens(key_store):
+    with pytest.raises(HTTPException) as e:
+        _get_user(_get_token("key_1", exp=time.time() - 10))
+    assert e.value.detail == "Token has expired"
+    with pytest.raises(HTTPException) as e:
+        _get_user(_get_token("key_2"))
+    assert e.value.detail == "Token is invalid"
+
+
+def test_unavailable_keys(key_store, monkeypatch):
+    def fetch():
+        raise ConnectionError()
+
+    monkeypatch.setattr(key_store, "fetch", fetch)
+    with pytest.raises(HTTPException) as e:
+        _get_user(_get_token("key_1"))
+    assert e.value.status_code == 503
+
+
+def test_token_cache_expiry_and_eviction():
+    cache = verified_token_cache(max_size=2)
+    cache.put("a", {"exp": time.time() - 1}, 1)
+    cache.put("b", {"exp": time.time() + 60}, 1)
+    cache.put("c", {"exp": time.time() + 60}, 1)
+    cache.put("d", {"name": "no exp"}, 1)
+    assert cache.get("a", 1) is None
+    assert cache.get("b", 1) is not None
+    cache.put("e", {"exp": time.time() + 60}, 1)
+    assert cache.get("c", 1) is None
+    assert cache.get("b", 2) is None
+    assert cache.get("d", 1) is None
+    assert cache.get("e", 1) is not None
+    assert len(cache.entries) == 1
+    assert "e" not in cache.entries
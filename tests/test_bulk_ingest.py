@@ -0,0 +1,87 @@
+import asyncio
+import json
+import os
+from unittest.mock import create_autospec
+from fastapi.testclient import TestClient
+from azure.cosmos.exceptions import CosmosHttpResponseError
+from app.models.analyses import analysis_result
+from app.services.database_service import database_service
+from app.services.bulk_ingest import bulk_insert, iter_ndjson_lines
+
+ANALYSIS_FILE = "tests/testfiles/models/analyses/analysis_1.json"
+
+
+def _get_lines(num_valid, invalid_positions=()):
+    with open(ANALYSIS_FILE) as f:
+        document = json.load(f)
+    lines = []
+    for i in range(num_valid + len(invalid_positions)):
+        if i in invalid_positions:
+            lines.append(json.dumps({**document, "metadata": {"project_id": 1}}))
+        else:
+            lines.append(json.dumps(document))
+    return lines
+
+
+async def _iterate(items):
+    for c in items:
+        yield c
+
+
+async def _collect(lines):
+    return [c async for c in lines]
+
+
+def test_iter_ndjson_lines_handles_split_lines():
+    chunks = [b'{"a":', b' 1}\n\n{"b"', b": 2}\n", b'{"c": 3}']
+    lines = asyncio.run(_collect(iter_ndjson_lines(_iterate(chunks))))
+    assert lines == [b'{"a": 1}', b'{"b": 2}', b'{"c": 3}']
+
+
+def test_bulk_insert_bounds_concurrency_and_keeps_order():
+    in_flight = {"now": 0, "max": 0}
+
+    async def post_document(document):
+        in_flight["now"] += 1
+        in_flight["max"] = max(in_flight["max"], in_flight["now"])
+        await asyncio.sleep(0.001)
+        in_flight["now"] -= 1
+        if in_flight["max"] == 3 and document["metadata"]["version"] == "fail":
+            raise CosmosHttpResponseError()
+        return {"id": "new_id"}
+
+    lines = [c.encode() for c in _get_lines(9, invalid_positions=(4,))]
+    document = json.loads(lines[0])
+    document["metadata"]["version"] = "fail"
+    lines.append(json.dumps(document).encode())
+    results = asyncio.run(
+        bulk_insert(_iterate(lines), analysis_result, post_document, max_concurrency=3)
+    )
+    assert in_flight["max"] == 3
+    assert [c["line"] for c in results] == list(range(1, 12))
+    assert [c["status"] for c in results] == [201] * 4 + [422] + [201] * 5 + [409]
+    assert results[0]["id"] == "new_id"
+    assert results[4]["errors"][0]["loc"][0] == "metadata"
+
+
+def test_bulk_route():
+    os.environ["ENVIRONMENT"] = "development"
+    from app.fast_api_app import get_app
+
+    db_serv_mock = create_autospec(database_service)
+    db_serv_mock.post_one_document.side_effect = lambda c, d: {**d, "id": "new_id"}
+    client = TestClient(get_app(db_serv=db_serv_mock))
+    body = "\n".join(_get_lines(2, invalid_positions=(1,))) + "\n"
+    response = client.post(
+        "/api/analyses/bulk",
+        content=body,
+        headers={"content-type": "application/x-ndjson"},
+        params={"max_concurrency": 2},
+    )
+    assert response.status_code == 200
+    result = response.json()
+    assert result["created"] == 2
+    assert result["failed"] == 1
+    assert [c["status"] for c in result["results"]] == [201, 422, 201]
+    assert db_serv_mock.post_one_document.call_count == 2
+    assert db_serv_mock.post_one_document.call_args[0][0] == "analyses"
@@ -0,0 +1,72 @@
+import asyncio
+from app.services.async_database_service import as_async_database_service
+from app.services.change_events import document_change_hub
+from app.services.change_feed import change_feed_consumer
+from app.services.document_cache import cached_database_service, document_cache
+from app.services.local_database_service import memory_database_service
+
+
+def test_local_change_feed():
+    memory_serv = memory_database_service()
+    memory_serv.upsert_documents("vessels", [{"id": "v0", "name": "before"}])
+    documents, continuation = memory_serv.read_change_feed("vessels")
+    assert documents == []
+    memory_serv.upsert_documents(
+        "vessels", [{"id": "v1", "name": "one"}, {"id": "v2", "name": "two"}]
+    )
+    memory_serv.upsert_documents("vessels", [{"id": "v1", "name": "one again"}])
+    documents, continuation = memory_serv.read_change_feed("vessels", continuation)
+    assert [c["id"] for c in documents] == ["v2", "v1"]
+    assert all(isinstance(c["_ts"], int) for c in documents)
+    assert memory_serv.read_change_feed("vessels", continuation) == ([], continuation)
+    assert "_lsn" not in memory_serv.get_one_document_by_id("vessels", "v1")
+
+
+def _get_worker(memory_serv):
+    db_serv = cached_database_service(
+        as_async_database_service(memory_serv), document_cache(ttl_seconds=3600)
+    )
+    hub = document_change_hub()
+    hub.subscribe(db_serv.cache.invalidate)
+    return db_serv, change_feed_consumer(db_serv, hub, ["vessels", "soil"])
+
+
+def test_writes_of_other_workers_reach_the_cache():
+    memory_serv = memory_database_service()
+    memory_serv.upsert_documents("vessels", [{"id": "v1", "name": "one"}])
+    writer, _ = _get_worker(memory_serv)
+    reader, consumer = _get_worker(memory_serv)
+
+    async def run():
+        await consumer.poll_all()
+        assert (await reader.get_one_document_by_id("vessels", "v1"))["name"] == "one"
+        await writer.replace_one_document("vessels", "v1", {"id": "v1", "name": "two"})
+        assert (await reader.get_one_document_by_id("vessels", "v1"))["name"] == "one"
+        assert await consumer.poll("vessels") == 1
+        assert (await reader.get_one_document_by_id("vessels", "v1"))["name"] == "two"
+        assert await consumer.poll("vessels") == 0
+
+    asyncio.run(run())
+    assert consumer.stats["vessels"]["changes"] == 1
+    assert consumer.get_checkpoint_age_seconds("vessels") >= 0
+    metrics = "\n".join(consumer.render_metrics("analyses_store"))
+    assert 'analyses_store_change_feed_changes_total{collection="vessels"} 1' in metrics
+    assert 'analyses_store_change_feed_lag_seconds{collection="soil"} 0.0' in metrics
+    assert "analyses_store_change_feed_checkpoint_age_seconds" in metrics
+
+
+def test_failing_collection_does_not_stop_the_others():
+    memory_serv = memory_database_service()
+    _, consumer = _get_worker(memory_serv)
+    read_change_feed = memory_serv.read_change_feed
+
+    def failing_read_change_feed(collection_name, continuation=None):
+        if collection_name == "vessels":
+            raise ConnectionError()
+        return read_change_feed(collection_name, continuation)
+
+    memory_serv.read_change_feed = failing_read_change_feed
+    asyncio.run(consumer.poll_all())
+    assert consumer.stats["vessels"]["errors"] == 1
+    assert consumer.checkpoints["vessels"] is None
+    assert consumer.checkpoints["soil"] is not None
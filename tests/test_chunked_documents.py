@@ -0,0 +1,233 @@
+import asyncio
+import json
+import os
+import pytest
+from fastapi.testclient import TestClient
+from azure.cosmos.exceptions import CosmosResourceNotFoundError
+from app.services.analysis_dict_manipulator import extract_all_summary_results
+from app.services.async_database_service import as_async_database_service
+from app.services.local_database_service import memory_database_service
+from app.services.chunked_documents import (
+    LAYOUT_KEY,
+    assemble_document,
+    chunked_database_service,
+    split_document,
+)
+
+ANALYSIS_FILE = "tests/testfiles/models/analyses/analysis_1.json"
+LOCATION = "wh_datum"
+RESULT_TYPE = "bending moment local y"
+
+
+def _load():
+    with open(ANALYSIS_FILE) as f:
+        return json.load(f)
+
+
+@pytest.fixture
+def chunked_serv():
+    memory_serv = memory_database_service()
+    return chunked_database_service(
+        as_async_database_service(memory_serv), chunk_threshold_bytes=1000
+    ), memory_serv
+
+
+def _get_stored_chunks(memory_serv):
+    return [json.loads(c) for c in memory_serv.collections["analyses_chunks"].values()]
+
+
+def test_split_and_assemble():
+    document = _load()
+    header, chunks = split_document(document, "all_seastate_results")
+    assert "all_seastate_results" not in header
+    assert [c["meta"] for c in header[LAYOUT_KEY]["chunks"]] == [
+        c["meta"] for c in document["all_seastate_results"]
+    ]
+    assert all(c["parent_id"] == document["id"] for c in chunks)
+    chunk_dict = {c["id"]: c for c in chunks}
+    assembled = assemble_document(header, chunk_dict)
+    assert json.dumps(assembled) == json.dumps(document)
+    del chunk_dict[chunks[1]["id"]]
+    assert assemble_document(header, chunk_dict) is None
+
+
+def test_large_documents_are_chunked(chunked_serv):
+    serv, memory_serv = chunked_serv
+    document = _load()
+
+    async def run():
+        posted = await serv.post_one_document("analyses", _load())
+        id = posted["id"]
+        header = memory_serv.get_one_document_by_id("analyses", id)
+        assert "all_seastate_results" not in header
+        assert len(_get_stored_chunks(memory_serv)) == 3
+        full, etag = await serv.get_one_document_with_etag("analyses", id)
+        assert full == {**document, "id": id}
+        assert await serv.get_one_document_with_etag("analyses", id, etag) == (
+            None,
+            etag,
+        )
+        assert await serv.get_one_document_by_id("analyses", id) == full
+        assert await serv.get_all_documents("analyses") == [full]
+        short = await serv.get_all_documents_short("analyses", ["metadata.client"])
+        assert short == [{"metadata": {"client": document["metadata"]["client"]}}]
+        many = await serv.get_many_documents_by_id(
+            "analyses", [id, "missing"], ["all_seastate_results"]
+        )
+        assert many == [
+            {"id": id, "all_seastate_results": document["all_seastate_results"]},
+            None,
+        ]
+        pages = [
+            page async for page in serv.iter_document_pages("analyses", page_size=1)
+        ]
+        assert pages == [[full]]
+
+    asyncio.run(run())
+
+
+def test_split_items_reads_selected_chunks(chunked_serv):
+    serv, memory_serv = chunked_serv
+    document = _load()
+
+    async def run():
+        id = (await serv.post_one_document("analyses", _load()))["id"]
+        memory_serv.read_count = 0
+        query_documents = memory_serv._query_documents
+
+        def counting_query_documents(*args, **kwargs):
+            documents = query_documents(*args, **kwargs)
+            if args[0] == "analyses_chunks":
+                memory_serv.read_count += len(documents)
+            return documents
+
+        memory_serv._query_documents = counting_query_documents
+        items, etag = await serv.get_split_items_with_etag(
+            "analyses", id, {"location": LOCATION, "result_type": RESULT_TYPE}
+        )
+        assert items == [document["all_seastate_results"][1]]
+        assert etag is not None
+        assert memory_serv.read_count == 1
+        assert await serv.get_split_items_with_etag("analyses", "missing") == (
+            None,
+            None,
+        )
+
+    asyncio.run(run())
+
+
+def test_writes_replace_and_delete_chunks(chunked_serv):
+    serv, memory_serv = chunked_serv
+
+    async def run():
+        id = (await serv.post_one_document("analyses", _load()))["id"]
+        old_chunk_ids = {c["id"] for c in _get_stored_chunks(memory_serv)}
+        patched = await serv.patch_one_document(
+            "analyses",
+            id,
+            [
+                {
+                    "op": "replace",
+                    "path": "/all_seastate_results/0/meta/unit",
+                    "value": "Nm",
+                }
+            ],
+        )
+        assert patched["all_seastate_results"][0]["meta"]["unit"] == "Nm"
+        chunks = _get_stored_chunks(memory_serv)
+        assert len(chunks) == 3
+        assert old_chunk_ids.isdisjoint(c["id"] for c in chunks)
+        full = await serv.get_one_document_by_id("analyses", id)
+        assert full == patched
+
+        small = {**_load(), "all_seastate_results": []}
+        await serv.replace_one_document("analyses", id, small)
+        assert _get_stored_chunks(memory_serv) == []
+        assert await serv.get_one_document_by_id("analyses", id) == {**small, "id": id}
+
+        await serv.replace_one_document("analyses", id, _load())
+        await serv.delete_one_document_by_id("analyses", id)
+        assert _get_stored_chunks(memory_serv) == []
+        with pytest.raises(CosmosResourceNotFoundError):
+            await serv.patch_one_document("analyses", id, [])
+
+    asyncio.run(run())
+
+
+def test_layout_disabled_for_writes():
+    memory_serv = memory_database_service()
+    serv = chunked_database_service(as_async_database_service(memory_serv))
+    assert serv.chunk_threshold_bytes is None
+    id = asyncio.run(serv.post_one_document("analyses", _load()))["id"]
+    assert "all_seastate_results" in memory_serv.get_one_document_by_id("analyses", id)
+
+
+def test_chunked_documents_cleaned_up_after_threshold_unset(chunked_serv):
+    serv, memory_serv = chunked_serv
+    unset_serv = chunked_database_service(as_async_database_service(memory_serv))
+    read_ids = []
+    get_one_document_by_id = memory_serv.get_one_document_by_id
+
+    def recording_get_one_document_by_id(collection_name, document_id):
+        read_ids.append(document_id)
+        return get_one_document_by_id(collection_name, document_id)
+
+    memory_serv.get_one_document_by_id = recording_get_one_document_by_id
+
+    async def run():
+        first = (await serv.post_one_document("analyses", _load()))["id"]
+        second = (await serv.post_one_document("analyses", _load()))["id"]
+        assert serv.created_chunk_collections == {"analyses_chunks"}
+        assert len(_get_stored_chunks(memory_serv)) == 6
+
+        assert await unset_serv.get_one_document_by_id("analyses", first) == {
+            **_load(),
+            "id": first,
+        }
+        assert read_ids == [first]
+
+        await unset_serv.delete_one_document_by_id("analyses", first)
+        assert {c["parent_id"] for c in _get_stored_chunks(memory_serv)} == {second}
+
+        patched = await unset_serv.patch_one_document(
+            "analyses",
+            second,
+            [{"op": "replace", "path": "/metadata/comment", "value": "unsplit"}],
+        )
+        assert patched["metadata"]["comment"] == "unsplit"
+        assert _get_stored_chunks(memory_serv) == []
+        stored = get_one_document_by_id("analyses", second)
+        assert LAYOUT_KEY not in stored
+        assert stored["all_seastate_results"] == _load()["all_seastate_results"]
+
+    asyncio.run(run())
+
+
+def test_seastate_routes_with_chunked_layout(monkeypatch):
+    os.environ["ENVIRONMENT"] = "development"
+    from app.fast_api_app import get_app
+
+    monkeypatch.setenv("ANALYSES_STORE_CHUNK_THRESHOLD_BYTES", "1000")
+    document = _load()
+    with TestClient(get_app(db_serv=memory_database_service())) as client:
+        id = client.post("/api/analyses", json=document).json()["id"]
+        response = client.get(f"/api/analyses/{id}")
+        assert response.json()["id"] == id
+        assert (
+            response.json()["all_seastate_results"] == document["all_seastate_results"]
+        )
+        response = client.get(
+            f"/api/analyses/{id}/seastate_results",
+            params={"location": LOCATION, "result_type": RESULT_TYPE},
+        )
+        assert response.status_code == 200
+        assert response.json() == extract_all_summary_results(
+            {"all_seastate_results": document["all_seastate_results"][1:2]}
+        )
+        response = client.get(
+            f"/api/analyses/{id}/drio_time_series_ids",
+            params={"result_type": RESULT_TYPE},
+        )
+        assert list(response.json()) == [f"{LOCATION}__{RESULT_TYPE}"]
+        response = client.get("/api/analyses/missing/drio_time_series_ids")
+        assert response.status_code == 404
@@ -0,0 +1,38 @@
+import json
+import os
+import subprocess
+import sys
+
+# The import time itself is timed by the cold_start_import benchmark in
+# benchmarks/run_benchmarks.py
+DEFERRED_PACKAGES = ["numpy", "pandas", "scipy"]
+
+IMPORT_SCRIPT = """
+import json, sys
+from app.fast_api_app import get_app
+app = get_app()
+print(json.dumps(sorted(c for c in %r if c in sys.modules)))
+"""
+
+
+def _get_imported_deferred_packages():
+    env = {**os.environ, "ANALYSES_STORE_BACKEND": "cosmos"}
+    result = subprocess.run(
+        [sys.executable, "-c", IMPORT_SCRIPT % DEFERRED_PACKAGES],
+        capture_output=True,
+        text=True,
+        env=env,
+        check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def test_import_does_not_load_deferred_packages():
+    assert _get_imported_deferred_packages() == []
+
+
+def test_warm_up_imports_deferred_modules():
+    from app.services.warm_up import DEFERRED_MODULES, import_deferred_modules
+
+    import_deferred_modules()
+    assert all(c in sys.modules for c in DEFERRED_MODULES)
@@ -0,0 +1,184 @@
+import gzip
+import json
+import os
+import brotli
+import pytest
+from fastapi.testclient import TestClient
+from app.services.compression import get_accepted_encoding
+from app.services.json_responses import (
+    etag_matches,
+    format_http_date,
+    parse_http_date,
+)
+from app.services.local_database_service import memory_database_service
+
+VESSEL_ID = "286a7312-6241-4a2a-91c1-49e095b180c3"
+
+
+@pytest.fixture
+def client():
+    os.environ["ENVIRONMENT"] = "development"
+    from app.fast_api_app import get_app
+
+    with open("tests/testfiles/models/analyses/analysis_1.json") as f:
+        analysis = json.load(f)
+    memory_serv = memory_database_service()
+    memory_serv.upsert_documents("vessels", [{"id": VESSEL_ID, "name": "rig one"}])
+    memory_serv.upsert_documents("analyses", [analysis])
+    with TestClient(get_app(db_serv=memory_serv)) as client:
+        client.analysis_id = analysis["id"]
+        yield client
+
+
+def _get_uncompressed(client, url, **headers):
+    return client.get(url, headers={"Accept-Encoding": "identity", **headers})
+
+
+def test_document_etag_and_not_modified(client):
+    url = f"/api/analyses/{client.analysis_id}"
+    response = _get_uncompressed(client, url)
+    etag = response.headers["etag"]
+    assert response.status_code == 200
+    response = _get_uncompressed(client, url, **{"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["etag"] == etag
+    response = _get_uncompressed(client, url, **{"If-None-Match": f'"other", W/{etag}'})
+    assert response.status_code == 304
+
+    client.patch(url, json=[{"op": "replace", "path": "/metadata/comment", "value": "x"}])
+    response = _get_uncompressed(client, url, **{"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json()["metadata"]["comment"] == "x"
+    assert response.headers["etag"] != etag
+
+
+@pytest.mark.parametrize(
+    "url", ["/api/vessels", "/api/analyses/summary/result_summary"]
+)
+def test_list_etag_and_not_modified(client, url):
+    response = _get_uncompressed(client, url)
+    etag = response.headers["etag"]
+    response = _get_uncompressed(client, url, **{"If-None-Match": etag})
+    assert response.status_code == 304
+    client.patch(
+        f"/api/vessels/{VESSEL_ID}",
+        json=[{"op": "replace", "path": "/name", "value": "rig 2"}],
+    )
+    response = _get_uncompressed(client, url, **{"If-None-Match": etag})
+    assert response.status_code == 200
+
+
+def test_document_last_modified_and_if_modified_since(client):
+    url = f"/api/analyses/{client.analysis_id}"
+    response = _get_uncompressed(client, url)
+    last_modified = response.headers["last-modified"]
+    since = parse_http_date(last_modified)
+    response = _get_uncompressed(client, url, **{"If-Modified-Since": last_modified})
+    assert response.status_code == 304
+    assert response.headers["last-modified"] == last_modified
+    for if_modified_since in [format_http_date(since - 1), "not a date"]:
+        response = _get_uncompressed(
+            client, url, **{"If-Modified-Since": if_modified_since}
+        )
+        assert response.status_code == 200
+    # If-Modified-Since is ignored when If-None-Match is sent
+    response = _get_uncompressed(
+        client, url, **{"If-None-Match": '"other"', "If-Modified-Since": last_modified}
+    )
+    assert response.status_code == 200
+
+
+def test_list_last_modified_and_if_modified_since(client, monkeypatch):
+    monkeypatch.setattr("app.services.json_responses.time.time", lambda: 1700000000.5)
+    response = _get_uncompressed(client, "/api/vessels")
+    last_modified = response.headers["last-modified"]
+    assert last_modified == "Tue, 14 Nov 2023 22:13:20 GMT"
+    response = _get_uncompressed(
+        client, "/api/vessels", **{"If-Modified-Since": last_modified}
+    )
+    assert response.status_code == 304
+    monkeypatch.setattr("app.services.json_responses.time.time", lambda: 1700000100.0)
+    client.patch(
+        f"/api/vessels/{VESSEL_ID}",
+        json=[{"op": "replace", "path": "/name", "value": "rig 2"}],
+    )
+    response = _get_uncompressed(
+        client, "/api/vessels", **{"If-Modified-Since": last_modified}
+    )
+    assert response.status_code == 200
+    assert parse_http_date(response.headers["last-modified"]) == 1700000100
+
+
+@pytest.mark.parametrize(
+    "accept_encoding, content_encoding, decompress",
+    [
+        ("gzip, br", "br", brotli.decompress),
+        ("gzip;q=1.0, br;q=0", "gzip", gzip.decompress),
+        ("identity", None, lambda c: c),
+    ],
+)
+def test_compression(client, accept_encoding, content_encoding, decompress):
+    url = f"/api/analyses/{client.analysis_id}"
+    expected = _get_uncompressed(client, url).content
+    with client.stream("GET", url, headers={"Accept-Encoding": accept_encoding}) as r:
+        body = b"".join(r.iter_raw())
+        assert r.headers.get("content-encoding") == content_encoding
+        assert r.headers["vary"] == "Accept-Encoding"
+        assert r.headers["etag"].startswith("W/") == (content_encoding is not None)
+    assert len(body) < len(expected) / 3 or content_encoding is None
+    assert decompress(body) == expected
+    response = client.get("/ping", headers={"Accept-Encoding": "br"})
+    assert "content-encoding" not in response.headers
+
+
+def test_accepted_encoding_and_etag_matches():
+    assert get_accepted_encoding("gzip, deflate, br", ["br", "gzip"]) == "br"
+    assert get_accepted_encoding("*;q=0.5", ["br", "gzip"]) == "br"
+    assert get_accepted_encoding("deflate", ["br", "gzip"]) is None
+    assert get_accepted_encoding(None, ["br", "gzip"]) is None
+    assert etag_matches('W/"a", "b"', '"a"')
+    assert etag_matches("*", '"a"')
+    assert not etag_matches('"a"', None)
+    assert not etag_matches(None, '"a"')
+
+
+@pytest.mark.parametrize(
+    "accept_encoding, decompress",
+    [("br", brotli.decompress), ("gzip", gzip.decompress)],
+)
+def test_compression_of_streamed_and_excluded_responses(accept_encoding, decompress):
+    from app.services.compression import compression_middleware
+
+    chunks = [json.dumps({"row": i}).encode() * 100 for i in range(5)]
+
+    async def app(scope, receive, send):
+        content_type = b"image/png" if scope["path"] == "/image" else b"application/json"
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [(b"content-type", content_type), (b"etag", b'"a"')],
+            }
+        )
+        for i, chunk in enumerate(chunks):
+            await send(
+                {
+                    "type": "http.response.body",
+                    "body": chunk,
+                    "more_body": i < len(chunks) - 1,
+                }
+            )
+
+    client = TestClient(compression_middleware(app, thread_minimum_size=512))
+    with client.stream("GET", "/", headers={"Accept-Encoding": accept_encoding}) as r:
+        body = b"".join(r.iter_raw())
+        assert r.headers["content-encoding"] == accept_encoding
+        assert "content-length" not in r.headers
+        assert r.headers["etag"] == 'W/"a"'
+    assert decompress(body) == b"".join(chunks)
+    with client.stream(
+        "GET", "/image", headers={"Accept-Encoding": accept_encoding}
+    ) as r:
+        assert "content-encoding" not in r.headers
+        assert b"".join(r.iter_raw()) == b"".join(chunks)
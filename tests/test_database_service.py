@@ -1,6 +1,13 @@
 import pytest
 from unittest.mock import patch, Mock, MagicMock, call
 from app.services.database_service import database_service
+from app.services.request_metrics import record_cosmos_request, record_cosmos_response
+from azure.cosmos.exceptions import (
+    CosmosAccessConditionFailedError,
+    CosmosResourceNotFoundError,
+)
+from app.services.document_patch import MAX_PATCH_ATTEMPTS
+from azure.core import MatchConditions
 
 
 @pytest.fixture
@@ -12,12 +19,21 @@ def mock_sql_client(cosmos_client_mock: MagicMock, os_mock: MagicMock):
     return_client.get_database_client.return_value = "dummy"
     cosmos_client_mock.return_value = return_client
     serv = database_service()
+    assert serv.client is None
+    cosmos_client_mock.assert_not_called()
+    serv.open()
+    serv.open()
     return cosmos_client_mock, os_mock, serv
 
 
 def test_database_service_constructor(mock_sql_client):
     cosmos_client_mock, os_mock, mocked_serv = mock_sql_client
-    cosmos_client_mock.assert_called_once_with("os_val_1", "os_val_2")
+    cosmos_client_mock.assert_called_once_with(
+        "os_val_1",
+        "os_val_2",
+        raw_request_hook=record_cosmos_request,
+        raw_response_hook=record_cosmos_response,
+    )
     os_getenv_calls = os_mock.getenv.call_args_list
     assert os_getenv_calls[0] == call("SQLAZURECONNSTR_AZURE_COSMOS_DB_HOST")
     assert os_getenv_calls[1] == call("SQLAZURECONNSTR_AZURE_COSMOS_DB_MASTER_KEY")
@@ -27,12 +43,64 @@ def test_database_service_constructor(mock_sql_client):
 @patch("app.services.database_service._remove_internal_dict_keys")
 def test_database_service_get_one_document_by_id(
     remove_dict_keys_mock, mock_sql_client
+):
+    remove_dict_keys_mock.side_effect = ["res_1", "res_2", "res_3", "res_4", "res_5"]
+    db_read_result = {"key1": "key1item1", "key2": "key2item1"}
+    _, _, database_service_mockedDB = mock_sql_client
+    database_service_mockedDB.data_base_proxy = MagicMock()
+    cosmos_container_client_mock = MagicMock(id="CosmosContainerClientMock")
+    cosmos_container_client_mock.read.return_value = {
+        "partitionKey": {"paths": ["/id"]}
+    }
+    database_service_mockedDB.data_base_proxy.get_container_client.return_value = (
+        cosmos_container_client_mock
+    )
+    cosmos_container_client_mock.read_item.return_value = db_read_result
+    return_value = database_service_mockedDB.get_one_document_by_id(
+        "dummy_collection", "my_id_1"
+    )
+    assert return_value == "res_1"
+    cosmos_container_client_mock.read_item.assert_called_once_with(
+        item="my_id_1", partition_key="my_id_1"
+    )
+    cosmos_container_client_mock.query_items.assert_not_called()
+    remove_dict_keys_mock.assert_called_once_with(db_read_result)
+    database_service_mockedDB.get_one_document_by_id("dummy_collection", "my_id_2")
+    database_service_mockedDB.data_base_proxy.get_container_client.assert_called_once_with(
+        "dummy_collection"
+    )
+    cosmos_container_client_mock.read.assert_called_once_with()
+
+
+def test_database_service_get_one_document_by_id_not_found(mock_sql_client):
+    _, _, database_service_mockedDB = mock_sql_client
+    database_service_mockedDB.data_base_proxy = MagicMock()
+    cosmos_container_client_mock = MagicMock(id="CosmosContainerClientMock")
+    cosmos_container_client_mock.read.return_value = {
+        "partitionKey": {"paths": ["/id"]}
+    }
+    database_service_mockedDB.data_base_proxy.get_container_client.return_value = (
+        cosmos_container_client_mock
+    )
+    cosmos_container_client_mock.read_item.side_effect = CosmosResourceNotFoundError()
+    assert (
+        database_service_mockedDB.get_one_document_by_id("dummy_collection", "my_id")
+        == []
+    )
+
+
+@patch("app.services.database_service._remove_internal_dict_keys")
+def test_database_service_get_one_document_by_id_other_partition_key(
+    remove_dict_keys_mock, mock_sql_client
 ):
     remove_dict_keys_mock.side_effect = ["res_1", "res_2", "res_3", "res_4", "res_5"]
     db_query_results = [{"key1": "key1item1", "key2": "key2item1"}]
     _, _, database_service_mockedDB = mock_sql_client
     database_service_mockedDB.data_base_proxy = MagicMock()
     cosmos_container_client_mock = MagicMock(id="CosmosContainerClientMock")
+    cosmos_container_client_mock.read.return_value = {
+        "partitionKey": {"paths": ["/project_id"]}
+    }
     database_service_mockedDB.data_base_proxy.get_container_client.return_value = (
         cosmos_container_client_mock
     )
@@ -46,11 +114,41 @@ def test_database_service_get_one_document_by_id(
         parameters=[{"name": "@id", "value": "my_id_1"}],
         enable_cross_partition_query=True,
     )
-    for call_num, mock_call in enumerate(remove_dict_keys_mock.call_args_list):
-        assert call(db_query_results[call_num]) == mock_call
-    database_service_mockedDB.data_base_proxy.get_container_client.assert_called_once_with(
-        "dummy_collection"
+    cosmos_container_client_mock.read_item.assert_not_called()
+
+
+def test_database_service_build_container_registry(mock_sql_client):
+    _, _, database_service_mockedDB = mock_sql_client
+    database_service_mockedDB.data_base_proxy = MagicMock()
+    database_service_mockedDB.data_base_proxy.list_containers.return_value = [
+        {"id": "analyses", "partitionKey": {"paths": ["/id"]}},
+        {"id": "vessels", "partitionKey": {"paths": ["/imo"]}},
+    ]
+    database_service_mockedDB.build_container_registry()
+    assert database_service_mockedDB.containers["analyses"]["partition_key_path"] == "/id"
+    assert database_service_mockedDB.containers["vessels"]["partition_key_path"] == "/imo"
+    database_service_mockedDB.get_one_document_by_id("analyses", "my_id")
+    database_service_mockedDB.get_one_document_by_id("vessels", "my_id")
+    assert database_service_mockedDB.data_base_proxy.get_container_client.call_count == 2
+
+
+def test_database_service_create_collection_if_not_exists(mock_sql_client):
+    _, _, database_service_mockedDB = mock_sql_client
+    database_service_mockedDB.data_base_proxy = MagicMock()
+    container = database_service_mockedDB.data_base_proxy.create_container_if_not_exists.return_value
+    container.read.return_value = {"partitionKey": {"paths": ["/parent_id"]}}
+    database_service_mockedDB.create_collection_if_not_exists(
+        "analyses_chunks", "/parent_id"
     )
+    kwargs = (
+        database_service_mockedDB.data_base_proxy.create_container_if_not_exists.call_args.kwargs
+    )
+    assert kwargs["id"] == "analyses_chunks"
+    assert kwargs["partition_key"]["paths"] == ["/parent_id"]
+    assert database_service_mockedDB.containers["analyses_chunks"] == {
+        "client": container,
+        "partition_key_path": "/parent_id",
+    }
 
 
 def test_database_service_delete_one_document_by_id(mock_sql_client):
@@ -61,6 +159,9 @@ def test_database_service_delete_one_document_by_id(mock_sql_client):
     database_service_mockedDB.data_base_proxy.get_container_client.return_value = (
         cosmos_container_client_mock
     )
+    cosmos_container_client_mock.read.return_value = {
+        "partitionKey": {"paths": ["/id"]}
+    }
     cosmos_container_client_mock.delete_item.return_value = db_query_results
     return_value = database_service_mockedDB.delete_one_document_by_id(
         "dummy_collection", "my_id_1"
@@ -122,40 +223,85 @@ def test_database_service_replace_one_document(remove_dict_keys_mock, mock_sql_c
     )
 
 
-@patch("app.services.database_service.jsonpatch")
-@patch("app.services.database_service._remove_internal_dict_keys")
-def test_database_service_replace_one_document(
-    remove_dict_keys_mock, jsonpatch_mock, mock_sql_client
-):
-    remove_dict_keys_mock.side_effect = ["res_1", "res_2", "res_3", "res_4", "res_5"]
-    _, _, database_service_mockedDB = mock_sql_client
-    database_service_mockedDB.data_base_proxy = MagicMock()
-    database_service_mockedDB.data_base_proxy.replace_item.return_value = {
-        "title": "return_replace_document"
-    }
-    database_service_mockedDB.get_one_document_by_id = MagicMock(
-        return_value={"title": "document_from_db"}
-    )
-    database_service_mockedDB.replace_one_document = MagicMock(
-        return_value={"title": "return_value_from_dbserv_replace"}
+def _get_patch_serv(mock_sql_client, partition_key_path):
+    _, _, serv = mock_sql_client
+    serv.data_base_proxy = MagicMock()
+    container = MagicMock(id="CosmosContainerClientMock")
+    container.read.return_value = {"partitionKey": {"paths": [partition_key_path]}}
+    serv.data_base_proxy.get_container_client.return_value = container
+    return serv, container
+
+
+def test_database_service_patch_one_document_with_patch_item(mock_sql_client):
+    serv, container = _get_patch_serv(mock_sql_client, "/id")
+    container.patch_item.return_value = {"id": "my_doc_id", "a": 1}
+    updates = [
+        {"op": "replace", "path": "/a", "value": 1},
+        {"op": "remove", "path": "/b"},
+        {"op": "set", "path": "/c/0", "value": "x"},
+    ]
+    res = serv.patch_one_document("analysis", "my_doc_id", updates)
+    assert res == {"id": "my_doc_id", "a": 1}
+    container.patch_item.assert_called_once_with(
+        item="my_doc_id", partition_key="my_doc_id", patch_operations=updates
     )
-    jsonpatch_mock.apply_patch.return_value = {"doc_id": "patch_ret_doc"}
-    patch_obj = [{"op": "replace", "path": "my_path/", "value": "my_value"}]
-    res = database_service_mockedDB.patch_one_document(
-        "analysis", "my_doc_id", patch_obj
+    container.read_item.assert_not_called()
+    container.replace_item.assert_not_called()
+
+
+@pytest.mark.parametrize(
+    "partition_key_path, updates",
+    [
+        ("/id", [{"op": "move", "from": "/a", "path": "/b"}]),
+        ("/id", [{"op": "replace", "path": "/id", "value": "x"}]),
+        ("/id", [{"op": "add", "path": "/a", "value": 1}] * 11),
+        ("/metadata/vessel_id", [{"op": "replace", "path": "/a", "value": 2}]),
+    ],
+)
+def test_database_service_patch_one_document_falls_back_to_replace(
+    mock_sql_client, partition_key_path, updates
+):
+    serv, _ = _get_patch_serv(mock_sql_client, partition_key_path)
+    serv.get_one_document_with_etag = MagicMock(
+        side_effect=[
+            ({"id": "my_doc_id", "a": 1}, "etag_1"),
+            ({"id": "my_doc_id", "a": 2}, "etag_2"),
+        ]
     )
-    database_service_mockedDB.get_one_document_by_id.assert_called_once_with(
-        collection_name="analysis", document_id="my_doc_id"
+    serv.replace_one_document = MagicMock(
+        side_effect=[CosmosAccessConditionFailedError(), {"title": "replaced"}]
     )
-    jsonpatch_mock.apply_patch.assert_called_once_with(
-        {"title": "document_from_db"}, patch_obj
+    res = serv.patch_one_document("analysis", "my_doc_id", updates)
+    assert res == {"title": "replaced"}
+    assert serv.replace_one_document.call_count == 2
+    assert serv.replace_one_document.call_args.kwargs["etag"] == "etag_2"
+    assert serv.replace_one_document.call_args.kwargs["doc_id"] == "my_doc_id"
+
+
+def test_database_service_patch_one_document_gives_up(mock_sql_client):
+    serv, _ = _get_patch_serv(mock_sql_client, "/id")
+    updates = [{"op": "test", "path": "/a", "value": 1}]
+    serv.get_one_document_with_etag = MagicMock(return_value=({"a": 1}, "etag_1"))
+    serv.replace_one_document = MagicMock(
+        side_effect=CosmosAccessConditionFailedError()
     )
-    database_service_mockedDB.replace_one_document.assert_called_once_with(
-        collection_name="analysis",
-        doc_id="my_doc_id",
-        replace_item={"doc_id": "patch_ret_doc"},
+    with pytest.raises(CosmosAccessConditionFailedError):
+        serv.patch_one_document("analysis", "my_doc_id", updates)
+    assert serv.replace_one_document.call_count == MAX_PATCH_ATTEMPTS
+    serv.get_one_document_with_etag = MagicMock(return_value=([], None))
+    with pytest.raises(CosmosResourceNotFoundError):
+        serv.patch_one_document("analysis", "my_doc_id", updates)
+
+
+def test_database_service_replace_one_document_with_etag(mock_sql_client):
+    serv, container = _get_patch_serv(mock_sql_client, "/id")
+    serv.replace_one_document("analysis", "my_doc_id", {"a": 1}, etag="etag_1")
+    container.replace_item.assert_called_once_with(
+        item="my_doc_id",
+        body={"a": 1},
+        etag="etag_1",
+        match_condition=MatchConditions.IfNotModified,
     )
-    assert res == {"title": "return_value_from_dbserv_replace"}
 
 
 def test_get_analysis_id_by_vesselid(mock_sql_client):
@@ -179,3 +325,176 @@ def test_get_analysis_id_by_vesselid(mock_sql_client):
     )
     assert response == [{"foo1": "bar1"}, {"foo1": "bar1"}]
     print(response)
+
+
+@pytest.mark.parametrize(
+    "etag, read_result, expected",
+    [
+        (
+            None,
+            {"id": "my_id", "_etag": "etag_1", "_ts": 1700000000},
+            ({"id": "my_id"}, "etag_1", 1700000000),
+        ),
+        ("etag_1", {}, (None, "etag_1", None)),
+        (
+            "etag_0",
+            {"id": "my_id", "_etag": "etag_1", "_ts": 1700000000},
+            ({"id": "my_id"}, "etag_1", 1700000000),
+        ),
+        (None, CosmosResourceNotFoundError(), ([], None, None)),
+    ],
+)
+def test_database_service_get_one_document_with_version(
+    mock_sql_client, etag, read_result, expected
+):
+    _, _, database_service_mockedDB = mock_sql_client
+    database_service_mockedDB.data_base_proxy = MagicMock()
+    cosmos_container_client_mock = MagicMock(id="CosmosContainerClientMock")
+    cosmos_container_client_mock.read.return_value = {
+        "partitionKey": {"paths": ["/id"]}
+    }
+    database_service_mockedDB.data_base_proxy.get_container_client.return_value = (
+        cosmos_container_client_mock
+    )
+    cosmos_container_client_mock.read_item.side_effect = [read_result]
+    res = database_service_mockedDB.get_one_document_with_version(
+        "dummy_collection", "my_id", etag
+    )
+    assert res == expected
+    call_kwargs = cosmos_container_client_mock.read_item.call_args.kwargs
+    if etag is None:
+        assert "etag" not in call_kwargs
+    else:
+        assert call_kwargs["etag"] == etag
+        assert call_kwargs["match_condition"] == MatchConditions.IfModified
+
+
+class _pager:
+    def __init__(self, pages, continuation_token):
+        self.pages = iter(pages)
+        self.continuation_token = continuation_token
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self.pages)
+
+
+def test_database_service_get_documents_page(mock_sql_client):
+    _, _, database_service_mockedDB = mock_sql_client
+    database_service_mockedDB.data_base_proxy = MagicMock()
+    cosmos_container_client_mock = MagicMock(id="CosmosContainerClientMock")
+    database_service_mockedDB.data_base_proxy.get_container_client.return_value = (
+        cosmos_container_client_mock
+    )
+    query_result = cosmos_container_client_mock.query_items.return_value
+    query_result.by_page.return_value = _pager(
+        [iter([{"id": "1", "_ts": 1}, {"id": "2"}])], "next_token"
+    )
+    res = database_service_mockedDB.get_documents_page(
+        "dummy_collection", 2, "this_token", selected_keys=["id", "metadata"]
+    )
+    assert res == ([{"id": "1"}, {"id": "2"}], "next_token")
+    cosmos_container_client_mock.query_items.assert_called_once_with(
+        query="SELECT VALUE {id: d.id,metadata: d.metadata} FROM d",
+        parameters=[],
+        enable_cross_partition_query=True,
+        max_item_count=2,
+    )
+    query_result.by_page.assert_called_once_with("this_token")
+
+
+def test_database_service_iter_document_pages(mock_sql_client):
+    _, _, database_service_mockedDB = mock_sql_client
+    database_service_mockedDB.data_base_proxy = MagicMock()
+    cosmos_container_client_mock = MagicMock(id="CosmosContainerClientMock")
+    database_service_mockedDB.data_base_proxy.get_container_client.return_value = (
+        cosmos_container_client_mock
+    )
+    cosmos_container_client_mock.query_items.return_value.by_page.return_value = (
+        _pager([iter([{"id": "1"}, {"id": "2"}]), iter([{"id": "3"}])], None)
+    )
+    pages = list(database_service_mockedDB.iter_document_pages("dummy_collection", 2))
+    assert pages == [[{"id": "1"}, {"id": "2"}], [{"id": "3"}]]
+    assert (
+        cosmos_container_client_mock.query_items.call_args.kwargs["query"]
+        == "SELECT * FROM d"
+    )
+
+
+def test_database_service_get_many_documents_by_id(mock_sql_client):
+    _, _, database_service_mockedDB = mock_sql_client
+    database_service_mockedDB.data_base_proxy = MagicMock()
+    container = MagicMock()
+    container.read.return_value = {"partitionKey": {"paths": ["/id"]}}
+    database_service_mockedDB.data_base_proxy.get_container_client.return_value = (
+        container
+    )
+    container.read_items.return_value = [
+        {"id": "b", "_etag": "etag_b"},
+        {"id": "a", "_etag": "etag_a"},
+    ]
+    res = database_service_mockedDB.get_many_documents_by_id(
+        "analyses", ["a", "missing", "b", "a"]
+    )
+    assert res == [{"id": "a"}, None, {"id": "b"}, {"id": "a"}]
+    container.read_items.assert_called_once_with(
+        items=[("a", "a"), ("missing", "missing"), ("b", "b")]
+    )
+    container.query_items.assert_not_called()
+
+    container.query_items.return_value = [{"id": "b", "metadata": {}}]
+    res = database_service_mockedDB.get_many_documents_by_id(
+        "analyses", ["a", "b"], selected_keys=["metadata"]
+    )
+    assert res == [None, {"id": "b", "metadata": {}}]
+    container.query_items.assert_called_once_with(
+        query="SELECT VALUE {id: d.id,metadata: d.metadata} FROM d "
+        "WHERE ARRAY_CONTAINS(@ids, d.id)",
+        parameters=[{"name": "@ids", "value": ["a", "b"]}],
+        enable_cross_partition_query=True,
+    )
+    assert database_service_mockedDB.get_many_documents_by_id("analyses", []) == []
+
+
+def test_database_service_iter_many_documents_by_id(mock_sql_client):
+    _, _, database_service_mockedDB = mock_sql_client
+    database_service_mockedDB.data_base_proxy = MagicMock()
+    container = MagicMock()
+    container.read.return_value = {"partitionKey": {"paths": ["/project_id"]}}
+    database_service_mockedDB.data_base_proxy.get_container_client.return_value = (
+        container
+    )
+    container.query_items.side_effect = [[{"id": "1"}, {"id": "2"}], [{"id": "3"}]]
+    pages = list(
+        database_service_mockedDB.iter_many_documents_by_id(
+            "analyses", ["1", "2", "3"], chunk_size=2
+        )
+    )
+    assert pages == [[{"id": "1"}, {"id": "2"}], [{"id": "3"}]]
+    assert container.query_items.call_args_list[0] == call(
+        query="SELECT * FROM d WHERE ARRAY_CONTAINS(@ids, d.id)",
+        parameters=[{"name": "@ids", "value": ["1", "2"]}],
+        enable_cross_partition_query=True,
+    )
+
+
+def test_database_service_get_all_documents_short_with_filters(mock_sql_client):
+    _, _, database_service_mockedDB = mock_sql_client
+    database_service_mockedDB.data_base_proxy = MagicMock()
+    container = MagicMock()
+    container.read.return_value = {"partitionKey": {"paths": ["/id"]}}
+    database_service_mockedDB.data_base_proxy.get_container_client.return_value = (
+        container
+    )
+    container.query_items.return_value = [{"id": "1", "_etag": "etag"}]
+    res = database_service_mockedDB.get_all_documents_short(
+        "analyses", ["id"], [("metadata.xt", "=", True)]
+    )
+    assert res == [{"id": "1"}]
+    container.query_items.assert_called_once_with(
+        query="SELECT VALUE {id: d.id} FROM d WHERE d.metadata.xt = @p0",
+        parameters=[{"name": "@p0", "value": True}],
+        enable_cross_partition_query=True,
+    )
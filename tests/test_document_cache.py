@@ -0,0 +1,110 @@
+import asyncio
+import pytest
+from unittest.mock import create_autospec, patch
+from app.services.async_database_service import async_database_service
+from app.services.document_cache import document_cache, cached_database_service
+
+
+@pytest.fixture
+def cached_serv():
+    db_serv_mock = create_autospec(async_database_service)
+    db_serv_mock.get_one_document_with_version.return_value = (
+        {"id": "my_id"},
+        "etag_1",
+        1700000000,
+    )
+    cache = document_cache(max_entries=2, ttl_seconds=10.0)
+    return cached_database_service(db_serv_mock, cache), db_serv_mock
+
+
+def test_get_one_document_read_through(cached_serv):
+    serv, db_serv_mock = cached_serv
+    assert asyncio.run(serv.get_one_document_by_id("analyses", "my_id")) == {
+        "id": "my_id"
+    }
+    assert asyncio.run(serv.get_one_document_by_id("analyses", "my_id")) == {
+        "id": "my_id"
+    }
+    db_serv_mock.get_one_document_with_version.assert_awaited_once_with(
+        "analyses", "my_id"
+    )
+    stats = serv.get_cache_stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["entries"] == 1
+
+
+def test_get_one_document_revalidates_stale_entry(cached_serv):
+    serv, db_serv_mock = cached_serv
+    with patch("app.services.document_cache.time") as time_mock:
+        time_mock.monotonic.return_value = 100.0
+        asyncio.run(serv.get_one_document_by_id("analyses", "my_id"))
+        time_mock.monotonic.return_value = 200.0
+        db_serv_mock.get_one_document_with_version.return_value = (
+            None,
+            "etag_1",
+            None,
+        )
+        res = asyncio.run(serv.get_one_document_by_id("analyses", "my_id"))
+        version = asyncio.run(serv.get_one_document_with_version("analyses", "my_id"))
+    assert res == {"id": "my_id"}
+    # the modification time is kept when the entry is revalidated as not modified
+    assert version == ({"id": "my_id"}, "etag_1", 1700000000)
+    db_serv_mock.get_one_document_with_version.assert_awaited_with(
+        "analyses", "my_id", "etag_1"
+    )
+    assert serv.get_cache_stats()["not_modified"] == 1
+
+
+def test_get_one_document_with_matching_etag_returns_none(cached_serv):
+    serv, _ = cached_serv
+    asyncio.run(serv.get_one_document_by_id("analyses", "my_id"))
+    assert asyncio.run(
+        serv.get_one_document_with_etag("analyses", "my_id", "etag_1")
+    ) == (None, "etag_1")
+
+
+def test_cache_evicts_least_recently_used(cached_serv):
+    serv, _ = cached_serv
+    for document_id in ["id_1", "id_2", "id_1", "id_3"]:
+        asyncio.run(serv.get_one_document_by_id("analyses", document_id))
+    assert serv.cache.get_document_entry("analyses", "id_2") is None
+    assert serv.cache.get_document_entry("analyses", "id_1") is not None
+    assert serv.get_cache_stats()["evictions"] == 1
+
+
+@pytest.mark.parametrize(
+    "method_name, args",
+    [
+        ("replace_one_document", ("analyses", "my_id", {"id": "my_id"})),
+        ("delete_one_document_by_id", ("analyses", "my_id")),
+    ],
+)
+def test_writes_invalidate_cache(cached_serv, method_name, args):
+    serv, db_serv_mock = cached_serv
+    db_serv_mock.get_all_documents.return_value = [{"id": "my_id"}]
+    asyncio.run(serv.get_one_document_by_id("analyses", "my_id"))
+    asyncio.run(serv.get_all_documents("analyses"))
+    asyncio.run(getattr(serv, method_name)(*args))
+    assert serv.cache.get_document_entry("analyses", "my_id") is None
+    assert serv.cache.get_collection("analyses") is None
+
+
+def test_patch_and_post_invalidate_cache(cached_serv):
+    serv, db_serv_mock = cached_serv
+    db_serv_mock.get_all_documents.return_value = [{"id": "my_id"}]
+    asyncio.run(serv.get_one_document_by_id("analyses", "my_id"))
+    asyncio.run(serv.patch_one_document("analyses", "my_id", []))
+    assert serv.cache.get_document_entry("analyses", "my_id") is None
+    asyncio.run(serv.get_all_documents("analyses"))
+    asyncio.run(serv.post_one_document("analyses", {}))
+    assert serv.cache.get_collection("analyses") is None
+    asyncio.run(serv.get_all_documents("analyses"))
+    assert db_serv_mock.get_all_documents.await_count == 2
+
+
+def test_not_found_is_not_cached(cached_serv):
+    serv, db_serv_mock = cached_serv
+    db_serv_mock.get_one_document_with_version.return_value = ([], None, None)
+    assert asyncio.run(serv.get_one_document_by_id("analyses", "my_id")) == []
+    assert serv.cache.get_document_entry("analyses", "my_id") is None
@@ -0,0 +1,52 @@
+import pytest
+import jsonpatch
+from app.services.document_patch import apply_patch, to_cosmos_patch_operations
+
+
+def test_to_cosmos_patch_operations():
+    updates = [
+        {"op": "add", "path": "/a/-", "value": 1},
+        {"op": "remove", "path": "/b", "value": None},
+        {"op": "set", "path": "/c/d", "value": "x"},
+    ]
+    assert to_cosmos_patch_operations(updates, "/id") == [
+        {"op": "add", "path": "/a/-", "value": 1},
+        {"op": "remove", "path": "/b"},
+        {"op": "set", "path": "/c/d", "value": "x"},
+    ]
+
+
+@pytest.mark.parametrize(
+    "updates",
+    [
+        [],
+        [{"op": "move", "from": "/a", "path": "/b"}],
+        [{"op": "test", "path": "/a", "value": 1}],
+        [{"op": "replace", "path": "/id", "value": "x"}],
+        [{"op": "replace", "path": "/metadata/vessel_id", "value": "x"}],
+        [{"op": "replace", "path": "/metadata", "value": "x"}],
+        [{"op": "replace", "path": "/a~1b", "value": "x"}],
+        [{"op": "replace", "path": "", "value": "x"}],
+        [{"op": "replace", "path": "/a"}],
+        [{"op": "replace", "path": "/a", "value": 1}] * 11,
+    ],
+)
+def test_updates_not_mapped_to_cosmos(updates):
+    assert to_cosmos_patch_operations(updates, "/metadata/vessel_id") is None
+
+
+def test_apply_patch():
+    document = {"a": [1, 2], "b": {"c": 1}}
+    result = apply_patch(
+        document,
+        [
+            {"op": "set", "path": "/a/0", "value": 5},
+            {"op": "set", "path": "/a/2", "value": 6},
+            {"op": "set", "path": "/b/d", "value": 7},
+            {"op": "move", "from": "/b/c", "path": "/e"},
+            {"op": "remove", "path": "/a/1"},
+        ],
+    )
+    assert result == {"a": [5, 6], "b": {"d": 7}, "e": 1}
+    with pytest.raises(jsonpatch.JsonPatchConflict):
+        apply_patch(document, [{"op": "replace", "path": "/f", "value": 1}])
@@ -0,0 +1,63 @@
+import glob
+import json
+import os
+import pytest
+from unittest.mock import create_autospec
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from fastapi.testclient import TestClient
+from app.services.database_service import database_service
+from app.services.seastate_matrix import from_document, extract_dynamic_interpolator
+from benchmarks.legacy_implementations import get_dynamic_interpolator
+from benchmarks.synthetic_analysis import get_synthetic_analysis
+
+ANALYSIS_FILES = sorted(glob.glob("tests/testfiles/models/analyses/*.json"))
+
+
+def _load(file_name):
+    with open(file_name) as f:
+        return json.load(f)
+
+
+def _get_documents():
+    documents = [_load(c) for c in ANALYSIS_FILES]
+    documents.append(get_synthetic_analysis(num_scatters=25, num_hs=6, num_tp=5))
+    return documents
+
+
+@pytest.fixture
+def client_and_db_serv():
+    os.environ["ENVIRONMENT"] = "development"
+    from app.fast_api_app import get_app
+
+    db_serv_mock = create_autospec(database_service)
+    return TestClient(get_app(db_serv=db_serv_mock)), db_serv_mock
+
+
+@pytest.mark.parametrize("document", _get_documents())
+def test_route_is_byte_identical_to_pandas_implementation(client_and_db_serv, document):
+    client, db_serv_mock = client_and_db_serv
+    db_serv_mock.get_one_document_with_etag.return_value = (document, "etag_1")
+    response = client.get("/api/analyses/my_id/dynamic_interpolator")
+    assert response.status_code == 200
+    expected = JSONResponse(jsonable_encoder(get_dynamic_interpolator(document)))
+    assert response.content == expected.body
+
+
+def test_repeated_methods_and_merged_scatters():
+    document = _load(ANALYSIS_FILES[0])
+    first_scatter = document["all_seastate_results"][0]
+    first_scatter["data"][0]["result"]["summary_values"].append(
+        {"method": "std", "value": 1.5}
+    )
+    document["all_seastate_results"].append(first_scatter)
+    assert extract_dynamic_interpolator(
+        from_document(document)
+    ) == get_dynamic_interpolator(document)
+
+
+def test_not_found(client_and_db_serv):
+    client, db_serv_mock = client_and_db_serv
+    db_serv_mock.get_one_document_with_etag.return_value = ([], None)
+    response = client.get("/api/analyses/my_id/dynamic_interpolator")
+    assert response.status_code == 404
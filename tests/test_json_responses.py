@@ -0,0 +1,29 @@
+import json
+import numpy as np
+from unittest.mock import patch
+from app.services import json_responses
+from app.services.json_responses import orjson_response, serialized_document_cache
+
+
+def test_orjson_response():
+    response = orjson_response({1: np.float64(2.5), "a": np.array([1, 2]), "n": None})
+    assert json.loads(response.body) == {"1": 2.5, "a": [1, 2], "n": None}
+    assert response.headers["content-type"] == "application/json"
+
+
+def test_serialized_document_cache():
+    cache = serialized_document_cache(max_bytes=30)
+    with patch.object(json_responses, "dumps", wraps=json_responses.dumps) as dumps:
+        first = cache.get("vessels", "v1", {"name": "one"}, "etag_1")
+        assert cache.get("vessels", "v1", {"name": "changed"}, "etag_1") is first
+        assert dumps.call_count == 1
+        assert cache.get("vessels", "v1", {"name": "two"}, "etag_2") == b'{"name":"two"}'
+        assert cache.get("vessels", "v2", {"name": "three"}, None) == b'{"name":"three"}'
+        assert dumps.call_count == 3
+    assert list(cache.entries) == [("vessels", "v1")]
+    cache.get("vessels", "v3", {"name": "four"}, "etag_3")
+    cache.get("vessels", "v4", {"name": "five"}, "etag_4")
+    assert list(cache.entries) == [("vessels", "v3"), ("vessels", "v4")]
+    assert cache.total_bytes == 30
+    cache.get("vessels", "v5", {"name": "x" * 30}, "etag_5")
+    assert "v5" not in [c[1] for c in cache.entries]
@@ -0,0 +1,205 @@
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from fastapi.testclient import TestClient
+from azure.cosmos.exceptions import (
+    CosmosAccessConditionFailedError,
+    CosmosResourceNotFoundError,
+)
+from app.services.local_database_service import (
+    local_database_service,
+    memory_database_service,
+    sqlite_database_service,
+)
+from app.services.database_backends import get_database_service
+from app.services.document_patch import apply_patch
+
+ANALYSIS_FILE = "tests/testfiles/models/analyses/analysis_1.json"
+
+
+def _get_documents():
+    return [
+        {"id": "1", "metadata": {"water_depth": 100, "xt": True, "client": "a"}},
+        {"id": "2", "metadata": {"water_depth": 200, "xt": False, "client": "b"}},
+        {"id": "3", "metadata": {"water_depth": 300, "xt": True, "client": "c"}},
+        {"id": "4", "other": 1},
+    ]
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def db_serv(request, tmp_path):
+    if request.param == "memory":
+        serv = memory_database_service()
+    else:
+        serv = sqlite_database_service(str(tmp_path / "store.sqlite3"))
+    serv.upsert_documents("analyses", _get_documents())
+    return serv
+
+
+def test_point_reads_and_etags(db_serv):
+    assert db_serv.get_one_document_by_id("analyses", "1") == _get_documents()[0]
+    assert db_serv.get_one_document_by_id("analyses", "missing") == []
+    document, etag = db_serv.get_one_document_with_etag("analyses", "1")
+    assert document == _get_documents()[0]
+    assert db_serv.get_one_document_with_etag("analyses", "1", etag) == (None, etag)
+    db_serv.replace_one_document("analyses", "1", {"metadata": {}})
+    document, new_etag = db_serv.get_one_document_with_etag("analyses", "1", etag)
+    assert document == {"id": "1", "metadata": {}}
+    assert new_etag != etag
+    assert db_serv.get_one_document_with_etag("analyses", "missing") == ([], None)
+    document, version_etag, last_modified = db_serv.get_one_document_with_version(
+        "analyses", "1"
+    )
+    assert version_etag == new_etag
+    assert isinstance(last_modified, int)
+    assert "_ts" not in document
+
+
+def test_incomplete_subclass_fails_at_construction():
+    class incomplete_database_service(local_database_service):
+        def _read_document(self, collection_name, document_id):
+            return None
+
+    with pytest.raises(TypeError, match="_query_documents"):
+        incomplete_database_service()
+
+
+def test_concurrent_patches_are_not_lost(db_serv, monkeypatch):
+    def slow_apply_patch(document, updates):
+        # every thread reads the document before any of them writes it
+        time.sleep(0.05)
+        return apply_patch(document, updates)
+
+    monkeypatch.setattr(
+        "app.services.local_database_service.apply_patch", slow_apply_patch
+    )
+    db_serv.upsert_documents("analyses", [{"id": "n", "n": []}])
+    patch = [{"op": "add", "path": "/n/-", "value": 0}]
+    with ThreadPoolExecutor(max_workers=5) as executor:
+        futures = [
+            executor.submit(db_serv.patch_one_document, "analyses", "n", patch)
+            for _ in range(5)
+        ]
+        for future in futures:
+            future.result()
+    assert db_serv.get_one_document_by_id("analyses", "n")["n"] == [0] * 5
+
+
+def test_etag_guarded_replace(db_serv):
+    _, etag = db_serv.get_one_document_with_etag("analyses", "1")
+    db_serv.replace_one_document("analyses", "1", {"a": 1}, etag)
+    with pytest.raises(CosmosAccessConditionFailedError):
+        db_serv.replace_one_document("analyses", "1", {"a": 2}, etag)
+    with pytest.raises(CosmosResourceNotFoundError):
+        db_serv.replace_one_document("analyses", "missing", {"a": 2})
+    assert db_serv.get_one_document_by_id("analyses", "1") == {"id": "1", "a": 1}
+
+
+def test_returned_documents_are_copies(db_serv):
+    document = db_serv.get_one_document_by_id("analyses", "1")
+    document["metadata"]["client"] = "changed"
+    assert db_serv.get_one_document_by_id("analyses", "1")["metadata"]["client"] == "a"
+
+
+def test_filters_and_projections(db_serv):
+    res = db_serv.get_all_documents_short(
+        "analyses",
+        ["id", "metadata.client"],
+        [("metadata.water_depth", ">=", 150), ("metadata.xt", "=", True)],
+    )
+    assert res == [{"id": "3", "metadata": {"client": "c"}}]
+    res = db_serv.get_all_documents_short(
+        "analyses", ["id"], [("metadata.client", "in", ["a", "b", "x"])]
+    )
+    assert res == [{"id": "1"}, {"id": "2"}]
+    res = db_serv.get_all_documents_short("analyses", ["id", "metadata.client"])
+    assert res[-1] == {"id": "4"}
+    with pytest.raises(ValueError):
+        db_serv.get_all_documents_short("analyses", None, [("id) OR (1", "=", 1)])
+
+
+def test_paging(db_serv):
+    documents, continuation = db_serv.get_documents_page("analyses", 3)
+    assert [c["id"] for c in documents] == ["1", "2", "3"]
+    documents, continuation = db_serv.get_documents_page("analyses", 3, continuation)
+    assert [c["id"] for c in documents] == ["4"]
+    assert continuation is None
+    pages = list(
+        db_serv.iter_document_pages(
+            "analyses", 1, ["id"], [("metadata.xt", "=", True)]
+        )
+    )
+    assert pages == [[{"id": "1"}], [{"id": "3"}]]
+
+
+def test_many_documents(db_serv):
+    res = db_serv.get_many_documents_by_id("analyses", ["3", "missing", "1"], ["other"])
+    assert res == [{"id": "3"}, None, {"id": "1"}]
+
+
+def test_writes(db_serv):
+    posted = db_serv.post_one_document("analyses", {"metadata": {"xt": False}})
+    assert db_serv.get_one_document_by_id("analyses", posted["id"]) == posted
+    patched = db_serv.patch_one_document(
+        "analyses", "2", [{"op": "replace", "path": "/metadata/client", "value": "z"}]
+    )
+    assert patched["metadata"]["client"] == "z"
+    assert db_serv.get_one_document_by_id("analyses", "2")["metadata"]["client"] == "z"
+    patched = db_serv.patch_one_document(
+        "analyses",
+        "2",
+        [
+            {"op": "set", "path": "/metadata/comment", "value": "c"},
+            {"op": "move", "from": "/metadata/client", "path": "/metadata/owner"},
+        ],
+    )
+    assert patched["metadata"]["comment"] == "c"
+    assert patched["metadata"]["owner"] == "z"
+    assert "client" not in patched["metadata"]
+    etag = db_serv.get_one_document_with_etag("analyses", "2")[1]
+    db_serv.replace_one_document("analyses", "2", patched, etag)
+    with pytest.raises(CosmosAccessConditionFailedError):
+        db_serv.replace_one_document("analyses", "2", patched, etag)
+    db_serv.delete_one_document_by_id("analyses", "2")
+    assert db_serv.get_one_document_by_id("analyses", "2") == []
+    for write in [
+        lambda: db_serv.delete_one_document_by_id("analyses", "2"),
+        lambda: db_serv.replace_one_document("analyses", "2", {}),
+        lambda: db_serv.patch_one_document("analyses", "2", []),
+    ]:
+        with pytest.raises(CosmosResourceNotFoundError):
+            write()
+
+
+def test_get_database_service(monkeypatch):
+    monkeypatch.setenv("ANALYSES_STORE_BACKEND", "memory")
+    assert isinstance(get_database_service(), memory_database_service)
+    monkeypatch.setenv("ANALYSES_STORE_SQLITE_PATH", ":memory:")
+    assert isinstance(get_database_service("sqlite"), sqlite_database_service)
+    with pytest.raises(ValueError):
+        get_database_service("unknown")
+
+
+def test_app_with_memory_backend(monkeypatch):
+    os.environ["ENVIRONMENT"] = "development"
+    from app.fast_api_app import get_app
+
+    monkeypatch.setenv("ANALYSES_STORE_BACKEND", "memory")
+    with open(ANALYSIS_FILE) as f:
+        analysis = json.load(f)
+    with TestClient(get_app()) as client:
+        response = client.post("/api/analyses", json=analysis)
+        assert response.status_code == 200
+        id = response.json()["id"]
+        response = client.get(f"/api/analyses/{id}/seastate_results")
+        assert response.status_code == 200
+        assert len(response.json()) > 0
+        response = client.get(
+            "/api/analyses",
+            params={"fields": ["id"], "project_id": analysis["metadata"]["project_id"]},
+        )
+        assert response.json() == [{"id": id}]
+        response = client.get("/api/analyses", params={"project_id": 1})
+        assert response.json() == []
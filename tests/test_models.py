@@ -1,9 +1,10 @@
 import os, glob, json
 from app.models.vessel import vessel
-from app.models.analyses import analysis_result
+from app.models.analyses import analysis_result, analysis_result_document
 from app.models.soil import soil_data
 from app.models.analysis_input import analysis_input
 import pytest
+from pydantic import ValidationError
 TEST_FILE_LOCATION = r'tests/testfiles/models'
 
 # def test_dummy():
@@ -28,3 +29,40 @@ def test_json_files(path_to_json_files, validation_object):
         with open(file, 'r+') as f:
             obj_dict = json.load(f)
             validation_object(**obj_dict)
+
+
+def _get_seastate_variants():
+    with open(os.path.join(TEST_FILE_LOCATION, 'analyses', 'analysis_1.json')) as f:
+        analysis = json.load(f)
+    variants = [analysis]
+    for change in [
+        lambda c: c.update(hs=0.0),
+        lambda c: c.update(tp="x"),
+        lambda c: c.update(extra=1),
+        lambda c: c["result"].update(time_series_id="ts_1"),
+        lambda c: c["result"].pop("time_series_id", None),
+        lambda c: c["result"].update(summary_values=[{"method": "p90", "value": 1}]),
+        lambda c: c["result"]["summary_values"].append({"method": "max"}),
+    ]:
+        variant = json.loads(json.dumps(analysis))
+        change(variant["all_seastate_results"][0]["data"][0])
+        variants.append(variant)
+    variant = json.loads(json.dumps(analysis))
+    variant["all_seastate_results"][0]["meta"]["unit"] = "furlong"
+    variants.append(variant)
+    return variants
+
+
+@pytest.mark.parametrize("analysis", _get_seastate_variants())
+def test_analysis_result_document_mode(analysis):
+    body = json.dumps(analysis)
+    try:
+        expected = analysis_result.model_validate_json(body).model_dump()
+    except ValidationError as e:
+        with pytest.raises(ValidationError) as document_error:
+            analysis_result_document.validate_document_json(body)
+        assert [c["loc"] for c in document_error.value.errors()] == [
+            c["loc"] for c in e.errors()
+        ]
+        return
+    assert analysis_result_document.validate_document_json(body) == expected
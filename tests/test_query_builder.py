@@ -0,0 +1,76 @@
+import pytest
+from app.services.query_builder import build_query, document_matches, project_document
+
+
+def test_build_query_without_projection_and_filters():
+    assert build_query() == ("SELECT * FROM d", [])
+
+
+def test_build_query_nested_projection():
+    query, parameters = build_query(
+        ["id", "metadata.well.name", "metadata.vessel_id", "general_results"]
+    )
+    assert query == (
+        "SELECT VALUE {id: d.id,metadata: {well: {name: d.metadata.well.name},"
+        "vessel_id: d.metadata.vessel_id},general_results: d.general_results} FROM d"
+    )
+    assert parameters == []
+
+
+def test_build_query_parent_key_includes_children():
+    query, _ = build_query(["metadata.well.name", "metadata", "metadata.xt"])
+    assert query == "SELECT VALUE {metadata: d.metadata} FROM d"
+
+
+def test_build_query_filters_are_parameterized():
+    query, parameters = build_query(
+        ["id"],
+        [
+            ("metadata.client", "=", "x' OR 1=1 --"),
+            ("metadata.water_depth", ">=", 100),
+            ("metadata.project_id", "in", [2011, 2012]),
+        ],
+    )
+    assert query == (
+        "SELECT VALUE {id: d.id} FROM d WHERE d.metadata.client = @p0 AND "
+        "d.metadata.water_depth >= @p1 AND ARRAY_CONTAINS(@p2, d.metadata.project_id)"
+    )
+    assert parameters == [
+        {"name": "@p0", "value": "x' OR 1=1 --"},
+        {"name": "@p1", "value": 100},
+        {"name": "@p2", "value": [2011, 2012]},
+    ]
+
+
+@pytest.mark.parametrize(
+    "selected_keys, filters",
+    [
+        (["id} FROM d --"], None),
+        (["metadata..well"], None),
+        (None, [("metadata.xt = true OR d.id", "=", 1)]),
+        (None, [("metadata.xt", "LIKE", 1)]),
+    ],
+)
+def test_build_query_rejects_unsafe_input(selected_keys, filters):
+    with pytest.raises(ValueError):
+        build_query(selected_keys, filters)
+
+
+def test_project_document():
+    document = {"id": "1", "metadata": {"well": {"name": "w", "x": 1}, "xt": True}}
+    assert project_document(document, ["id", "metadata.well.name", "missing.key"]) == {
+        "id": "1",
+        "metadata": {"well": {"name": "w"}},
+    }
+
+
+def test_document_matches():
+    document = {"id": "1", "metadata": {"water_depth": 100, "client": "a"}}
+    assert document_matches(document, None)
+    assert document_matches(
+        document,
+        [("metadata.water_depth", ">=", 100), ("metadata.client", "in", ["a", "b"])],
+    )
+    assert not document_matches(document, [("metadata.water_depth", ">", "x")])
+    assert not document_matches(document, [("metadata.missing", "!=", 1)])
+
@@ -0,0 +1,74 @@
+import asyncio
+import json
+import os
+from unittest.mock import create_autospec
+from fastapi.testclient import TestClient
+from app.services.async_database_service import async_database_service
+from app.services.change_events import document_change_hub
+from app.services.reference_data_cache import reference_data_cache
+
+
+def _get_db_serv_mock(vessels):
+    db_serv_mock = create_autospec(async_database_service)
+    db_serv_mock.get_all_documents.return_value = vessels
+    return db_serv_mock
+
+
+def test_lookup_is_memoized_per_version():
+    db_serv_mock = _get_db_serv_mock([{"id": "v1", "name": "rig one"}])
+    cache = reference_data_cache(db_serv_mock, ["vessels"])
+
+    async def run():
+        first = await cache.get_lookup("vessels", "id", "name")
+        second = await cache.get_lookup("vessels", "id", "name")
+        return first, second, await cache.get_version("vessels")
+
+    first, second, version = asyncio.run(run())
+    assert first == {"v1": "rig one"}
+    assert first is second
+    assert version == 1
+    db_serv_mock.get_all_documents.assert_awaited_once_with("vessels")
+
+
+def test_invalidate_reloads_in_background():
+    db_serv_mock = _get_db_serv_mock([{"id": "v1", "name": "rig one"}])
+    cache = reference_data_cache(db_serv_mock, ["vessels"])
+    hub = document_change_hub()
+    hub.subscribe(cache.invalidate)
+
+    async def run():
+        await cache.get_documents("vessels")
+        db_serv_mock.get_all_documents.return_value = [{"id": "v1", "name": "rig 2"}]
+        hub.publish("vessels", "v1")
+        hub.publish("analyses", "a1")
+        await asyncio.sleep(0)
+        return await cache.get_lookup("vessels", "id", "name")
+
+    assert asyncio.run(run()) == {"v1": "rig 2"}
+    assert db_serv_mock.get_all_documents.await_count == 2
+    assert cache.entries["vessels"]["version"] == 2
+
+
+def test_result_summary_uses_cached_vessels():
+    os.environ["ENVIRONMENT"] = "development"
+    from app.fast_api_app import get_app
+
+    db_serv_mock = _get_db_serv_mock([{"id": "v1", "name": "rig one"}])
+    with open("tests/testfiles/models/analyses/analysis_1.json") as f:
+        analysis = json.load(f)
+    analysis["metadata"]["vessel_id"] = "v1"
+    db_serv_mock.get_all_documents_short.return_value = [analysis]
+    db_serv_mock.patch_one_document.return_value = {"id": "v1"}
+    client = TestClient(get_app(db_serv=db_serv_mock))
+    for _ in range(3):
+        response = client.get("/api/analyses/summary/result_summary")
+        assert response.status_code == 200
+        assert response.json()[0]["vessel"] == "rig one"
+    db_serv_mock.get_all_documents.assert_awaited_once_with("vessels")
+
+    db_serv_mock.get_all_documents.return_value = [{"id": "v1", "name": "rig 2"}]
+    client.patch(
+        "/api/vessels/v1", json=[{"op": "replace", "path": "/name", "value": "rig 2"}]
+    )
+    response = client.get("/api/analyses/summary/result_summary")
+    assert response.json()[0]["vessel"] == "rig 2"
@@ -0,0 +1,93 @@
+import json
+import os
+from types import SimpleNamespace
+from unittest.mock import create_autospec
+from fastapi.testclient import TestClient
+from app.services.database_service import database_service
+from app.services.request_metrics import (
+    metrics_registry,
+    request_stats,
+    record_cosmos_request,
+    record_cosmos_response,
+)
+
+
+def _get_cosmos_response(request_charge):
+    request = SimpleNamespace(context={})
+    record_cosmos_request(request)
+    return SimpleNamespace(
+        context=request.context,
+        http_response=SimpleNamespace(headers={"x-ms-request-charge": request_charge}),
+    )
+
+
+def _get_client(server_timing):
+    os.environ["ENVIRONMENT"] = "development"
+    from app.fast_api_app import get_app
+
+    db_serv_mock = create_autospec(database_service)
+    return TestClient(get_app(db_serv=db_serv_mock, server_timing=server_timing)), db_serv_mock
+
+
+def test_cosmos_calls_are_recorded_from_the_threadpool():
+    client, db_serv_mock = _get_client(server_timing=True)
+
+    def get_one_document_with_version(collection_name, document_id):
+        record_cosmos_response(_get_cosmos_response("2.5"))
+        record_cosmos_response(_get_cosmos_response("1"))
+        return {"id": document_id}, "etag_1", 1700000000
+
+    db_serv_mock.get_one_document_with_version.side_effect = (
+        get_one_document_with_version
+    )
+    response = client.get("/api/analyses/my_id")
+    assert response.status_code == 200
+    server_timing = response.headers["server-timing"]
+    assert server_timing.startswith("total;dur=")
+    assert "database;dur=" in server_timing
+    assert "cosmos;dur=" in server_timing
+    assert 'cosmos_ru;desc="2 calls, 3.50 RU"' in server_timing
+
+    metrics = client.get("/metrics").text
+    labels = 'method="GET",route="/api/analyses/{id}"'
+    assert f'analyses_store_cosmos_calls_total{{{labels}}} 2' in metrics
+    assert f'analyses_store_cosmos_request_charge_total{{{labels}}} 3.5' in metrics
+    assert f'analyses_store_request_duration_seconds_count{{{labels},status="200"}} 1' in metrics
+    assert f'analyses_store_phase_seconds_total{{{labels},phase="serialization"}}' in metrics
+
+
+def test_route_templates_and_no_server_timing_by_default():
+    client, db_serv_mock = _get_client(server_timing=None)
+    db_serv_mock.get_one_document_with_etag.return_value = ([], None)
+    for id in ["a", "b"]:
+        response = client.get(f"/api/analyses/{id}/seastate_results")
+        assert response.status_code == 404
+        assert "server-timing" not in response.headers
+    client.get("/not/a/route")
+    metrics = client.get("/metrics")
+    assert metrics.headers["content-type"].startswith("text/plain")
+    labels = 'method="GET",route="/api/analyses/{id}/seastate_results",status="404"'
+    assert f"analyses_store_request_duration_seconds_count{{{labels}}} 2" in metrics.text
+    assert 'route="unmatched"' in metrics.text
+    assert 'route="/api/analyses/a' not in metrics.text
+
+
+def test_metrics_and_cache_stats_require_authorization(monkeypatch):
+    client, _ = _get_client(server_timing=None)
+    monkeypatch.setattr("app.auth.authorization.ENVIRONMENT", "production")
+    for url in ["/metrics", "/cache_stats"]:
+        assert client.get(url).status_code == 401
+    assert client.get("/ping").status_code == 200
+
+
+def test_registry_histogram_and_label_escaping():
+    registry = metrics_registry()
+    for seconds in [0.001, 0.3, 20.0]:
+        stats = request_stats()
+        stats.total_seconds = seconds
+        registry.observe("GET", '/a"b', 200, stats)
+    text = registry.render()
+    labels = 'method="GET",route="/a\\"b",status="200"'
+    assert f'analyses_store_request_duration_seconds_bucket{{{labels},le="0.005"}} 1' in text
+    assert f'analyses_store_request_duration_seconds_bucket{{{labels},le="0.5"}} 2' in text
+    assert f'analyses_store_request_duration_seconds_bucket{{{labels},le="+Inf"}} 3' in text
@@ -0,0 +1,130 @@
+import asyncio
+import json
+import os
+from fastapi.testclient import TestClient
+from app.services.async_database_service import as_async_database_service
+from app.services.change_events import document_change_hub
+from app.services.local_database_service import memory_database_service
+from app.services.reference_data_cache import reference_data_cache
+from app.services.result_summary_view import result_summary_view
+
+VESSEL_ID = "286a7312-6241-4a2a-91c1-49e095b180c3"
+
+
+def _load(id):
+    with open("tests/testfiles/models/analyses/analysis_1.json") as f:
+        analysis = json.load(f)
+    analysis["id"] = id
+    return analysis
+
+
+def _get_memory_serv(ids):
+    memory_serv = memory_database_service()
+    memory_serv.upsert_documents("vessels", [{"id": VESSEL_ID, "name": "rig one"}])
+    memory_serv.upsert_documents("analyses", [_load(c) for c in ids])
+    return memory_serv
+
+
+def _get_view(memory_serv):
+    db_serv = as_async_database_service(memory_serv)
+    reference_cache = reference_data_cache(db_serv, ["vessels"])
+    view = result_summary_view(db_serv, reference_cache)
+    hub = document_change_hub()
+    hub.subscribe(reference_cache.invalidate)
+    hub.subscribe(view.invalidate)
+    return view, hub
+
+
+def test_view_is_updated_incrementally():
+    memory_serv = _get_memory_serv(["a1", "a2"])
+    view, hub = _get_view(memory_serv)
+
+    get_all_documents_short = memory_serv.get_all_documents_short
+    queried = []
+
+    def recording_get_all_documents_short(collection_name, *args):
+        queried.append(collection_name)
+        return get_all_documents_short(collection_name, *args)
+
+    memory_serv.get_all_documents_short = recording_get_all_documents_short
+
+    async def run():
+        rows, _ = await view.get_rows("simple")
+        assert [c["id"] for c in rows] == ["a1", "a2"]
+        assert rows[0]["vessel"] == "rig one"
+
+        memory_serv.upsert_documents("analyses", [_load("a3")])
+        hub.publish("analyses", "a3")
+        memory_serv.delete_one_document_by_id("analyses", "a1")
+        hub.publish("analyses", "a1")
+        changed = _load("a2")
+        changed["metadata"]["water_depth"] = 1000.0
+        memory_serv.upsert_documents("analyses", [changed])
+        hub.publish("analyses", "a2")
+        rows, _ = await view.get_rows("simple")
+        assert [(c["id"], c["water_depth"]) for c in rows] == [
+            ("a2", 1000.0),
+            ("a3", _load("a3")["metadata"]["water_depth"]),
+        ]
+
+        memory_serv.upsert_documents("vessels", [{"id": VESSEL_ID, "name": "rig 2"}])
+        hub.publish("vessels", VESSEL_ID)
+        rows, _ = await view.get_rows("detailed")
+        assert [c["vessel"] for c in rows] == ["rig 2", "rig 2"]
+        assert queried.count("analyses") == 1
+
+    asyncio.run(run())
+
+
+def test_filters_pages_and_rebuild():
+    memory_serv = _get_memory_serv(["a1", "a2", "a3"])
+    view, _ = _get_view(memory_serv)
+
+    async def run():
+        rows, next_offset = await view.get_rows("full", offset=0, limit=2)
+        assert [c["id"] for c in rows] == ["a1", "a2"]
+        rows, next_offset = await view.get_rows("full", offset=next_offset, limit=2)
+        assert [c["id"] for c in rows] == ["a3"]
+        assert next_offset is None
+        rows, _ = await view.get_rows("full", [("metadata.project_id", "=", 1)])
+        assert rows == []
+        pages = [c async for c in view.iter_row_pages("full", 2)]
+        assert [len(c) for c in pages] == [2, 1]
+
+        memory_serv.upsert_documents("analyses", [_load("a4")])
+        assert await view.rebuild() == 4
+
+    asyncio.run(run())
+
+
+def test_result_summary_routes():
+    os.environ["ENVIRONMENT"] = "development"
+    from app.fast_api_app import get_app
+
+    memory_serv = _get_memory_serv(["a1"])
+    with TestClient(get_app(db_serv=memory_serv)) as client:
+        for result_type in ["simple", "detailed", "full"]:
+            response = client.get(
+                "/api/analyses/summary/result_summary",
+                params={"result_type": result_type},
+            )
+            assert response.status_code == 200
+            assert [c["id"] for c in response.json()] == ["a1"]
+        analysis = _load("a2")
+        del analysis["id"]
+        id = client.post("/api/analyses", json=analysis).json()["id"]
+        response = client.get(
+            "/api/analyses/summary/result_summary", params={"page_size": 1}
+        )
+        assert response.json()["continuation"] == "1"
+        response = client.get(
+            "/api/analyses/summary/result_summary",
+            params={"page_size": 1, "continuation": "1"},
+        )
+        assert [c["id"] for c in response.json()["documents"]] == [id]
+        client.delete(f"/api/analyses/{id}")
+        response = client.get("/api/analyses/summary/result_summary")
+        assert [c["id"] for c in response.json()] == ["a1"]
+        memory_serv.upsert_documents("analyses", [_load("a3")])
+        response = client.post("/api/analyses/summary/result_summary/rebuild")
+        assert response.json() == {"analyses": 2}
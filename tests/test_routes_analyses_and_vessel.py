@@ -1,3 +1,4 @@
+import json
 import os
 from fastapi.testclient import TestClient
 from unittest.mock import MagicMock
@@ -93,9 +94,11 @@ def test_get_vessel_not_in_db(
 ):
     client = TestClient(app["app"])
     #    db_response = {'foo': 'bar'}
-    app["db_serv"].get_one_document_by_id.side_effect = dbserv_sideeffect
+    app["db_serv"].get_one_document_with_version.side_effect = dbserv_sideeffect
     response = client.get(route + r"/my_id")
-    app["db_serv"].get_one_document_by_id.assert_called_once_with(called_with, "my_id")
+    app["db_serv"].get_one_document_with_version.assert_called_once_with(
+        called_with, "my_id"
+    )
     assert response.status_code == status_code
     assert response.text == response_text
 
@@ -110,9 +113,13 @@ def test_get_vessel_not_in_db(
 def test_get_vessel(app, route, called_with):
     client = TestClient(app["app"])
     db_response = {"foo": "bar"}
-    app["db_serv"].get_one_document_by_id.return_value = db_response
+    app["db_serv"].get_one_document_with_version.return_value = (
+        db_response,
+        "etag_1",
+        1700000000,
+    )
     response = client.get(route + r"/my_vessel_id")
-    app["db_serv"].get_one_document_by_id.assert_called_once_with(
+    app["db_serv"].get_one_document_with_version.assert_called_once_with(
         called_with, "my_vessel_id"
     )
     assert response.status_code == 200
@@ -294,3 +301,157 @@ def test_patch_vessel(
     #    print(response.status_code, response.json())
     assert response.status_code == expected_status_code
     assert response.json() == expected_json
+
+
+@pytest.mark.parametrize("route, called_with", [("/api/vessels", "vessels")])
+def test_get_all_paginated(app, route, called_with):
+    client = TestClient(app["app"])
+    app["db_serv"].get_documents_page.return_value = ([{"foo": "bar"}], "token_2")
+    response = client.get(route, params={"page_size": 1, "continuation": "token_1"})
+    assert response.status_code == 200
+    assert response.json() == {"documents": [{"foo": "bar"}], "continuation": "token_2"}
+    app["db_serv"].get_documents_page.assert_called_once_with(
+        called_with, 1, "token_1", selected_keys=None, filters=[]
+    )
+    app["db_serv"].get_all_documents.assert_not_called()
+
+
+def test_get_all_streamed(app):
+    client = TestClient(app["app"])
+    app["db_serv"].iter_document_pages.return_value = iter(
+        [[{"id": "1"}, {"id": "2"}], [{"id": "3"}]]
+    )
+    response = client.get("/api/analyses", params={"stream": True, "page_size": 2})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert response.text == '{"id":"1"}\n{"id":"2"}\n{"id":"3"}\n'
+    app["db_serv"].iter_document_pages.assert_called_once_with(
+        "analyses", 2, selected_keys=None, filters=[]
+    )
+
+
+def test_get_all_with_fields_and_filters(app):
+    client = TestClient(app["app"])
+    app["db_serv"].get_all_documents_short.return_value = [{"id": "1"}]
+    response = client.get(
+        "/api/analyses",
+        params={
+            "fields": ["id", "metadata.well.name"],
+            "vessel_id": "v1",
+            "xt": True,
+            "water_depth_min": 100,
+            "water_depth_max": 300,
+        },
+    )
+    assert response.status_code == 200
+    assert response.json() == [{"id": "1"}]
+    app["db_serv"].get_all_documents_short.assert_called_once_with(
+        "analyses",
+        ["id", "metadata.well.name"],
+        [
+            ("metadata.vessel_id", "=", "v1"),
+            ("metadata.xt", "=", True),
+            ("metadata.water_depth", ">=", 100.0),
+            ("metadata.water_depth", "<=", 300.0),
+        ],
+    )
+    app["db_serv"].get_all_documents.assert_not_called()
+
+
+@pytest.mark.parametrize(
+    "route, params",
+    [
+        ("/api/analyses", {"fields": "id) FROM d --"}),
+        ("/api/analyses", {"current": "100yr"}),
+        ("/api/analyses/summary/result_summary", {"project_id": "abc"}),
+    ],
+)
+def test_get_all_invalid_fields_and_filters(app, route, params):
+    client = TestClient(app["app"])
+    response = client.get(route, params=params)
+    assert response.status_code == 422
+    app["db_serv"].get_all_documents_short.assert_not_called()
+
+
+def test_get_all_invalid_page_size(app):
+    client = TestClient(app["app"])
+    response = client.get("/api/analyses", params={"page_size": 0})
+    assert response.status_code == 422
+
+
+def test_batch_get(app):
+    client = TestClient(app["app"])
+    app["db_serv"].iter_many_documents_by_id.return_value = iter(
+        [[{"id": "1", "metadata": {}}, None], [{"id": "3", "metadata": {}}]]
+    )
+    response = client.post(
+        "/api/analyses/batch_get",
+        json={"ids": ["1", "2", "3"], "selected_keys": ["metadata"]},
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = [json.loads(c) for c in response.text.splitlines()]
+    assert lines == [
+        {"id": "1", "found": True, "document": {"id": "1", "metadata": {}}},
+        {"id": "2", "found": False},
+        {"id": "3", "found": True, "document": {"id": "3", "metadata": {}}},
+    ]
+    app["db_serv"].iter_many_documents_by_id.assert_called_once_with(
+        "analyses", ["1", "2", "3"], ["metadata"]
+    )
+
+
+@pytest.mark.parametrize(
+    "body", [{"ids": []}, {"ids": ["1"], "selected_keys": ["d.id FROM d --"]}]
+)
+def test_batch_get_invalid_input(app, body):
+    client = TestClient(app["app"])
+    response = client.post("/api/analyses/batch_get", json=body)
+    assert response.status_code == 422
+
+
+@pytest.mark.parametrize(
+    "patch_list, expected_status_code",
+    [
+        ([{"op": "remove", "path": "/a"}], 200),
+        ([{"op": "move", "from": "/a", "path": "/b"}], 200),
+        ([{"op": "add", "path": "/a"}], 422),
+        ([{"op": "copy", "path": "/a"}], 422),
+        ([{"op": "rename", "path": "/a", "value": "b"}], 422),
+    ],
+)
+def test_patch_operation_arguments(app, patch_list, expected_status_code):
+    app["db_serv"].patch_one_document.return_value = {"foo": "bar"}
+    client = TestClient(app["app"])
+    response = client.patch("/api/vessels/my_id", json=patch_list)
+    assert response.status_code == expected_status_code
+    if expected_status_code == 200:
+        app["db_serv"].patch_one_document.assert_called_once_with(
+            collection_name="vessels", document_id="my_id", updates=patch_list
+        )
+
+
+def test_post_analysis_validates_raw_json(app):
+    from app.models.analyses import analysis_result
+
+    client = TestClient(app["app"])
+    with open("tests/testfiles/models/analyses/analysis_1.json") as f:
+        analysis = json.load(f)
+    app["db_serv"].post_one_document.return_value = {"id": "new_id"}
+    response = client.post("/api/analyses", content=json.dumps(analysis))
+    assert response.status_code == 200
+    app["db_serv"].post_one_document.assert_called_once_with(
+        "analyses", analysis_result(**analysis).model_dump()
+    )
+
+    analysis["all_seastate_results"][0]["data"][0]["hs"] = -1.0
+    response = client.post("/api/analyses", content=json.dumps(analysis))
+    assert response.status_code == 422
+    assert response.json()["detail"][0]["loc"] == [
+        "body", "all_seastate_results", 0, "data", 0, "hs"
+    ]
+    request_body = client.get("/openapi.json").json()["paths"]["/api/analyses"][
+        "post"
+    ]["requestBody"]
+    schema = request_body["content"]["application/json"]["schema"]
+    assert "all_seastate_results" in schema["required"]
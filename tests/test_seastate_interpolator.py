@@ -0,0 +1,122 @@
+import json
+import os
+import numpy as np
+import pytest
+from unittest.mock import create_autospec, patch
+from fastapi.testclient import TestClient
+from app.services.database_service import database_service
+from app.services.seastate_matrix import from_document
+from app.services.seastate_interpolator import (
+    seastate_interpolator,
+    from_seastate_matrices,
+)
+
+ANALYSIS_FILE = "tests/testfiles/models/analyses/analysis_1.json"
+LOCATION = "wh_datum"
+RESULT_TYPE = "bending moment local x"
+
+
+def _load():
+    with open(ANALYSIS_FILE) as f:
+        return json.load(f)
+
+
+def test_full_grid_is_bilinear():
+    hs, tp = np.meshgrid([1.0, 2.0, 3.0], [4.0, 5.0, 6.0], indexing="ij")
+    interpolator = seastate_interpolator(hs.ravel(), tp.ravel(), (10 * hs + tp).ravel())
+    np.testing.assert_allclose(
+        interpolator([1.5, 2.0, 3.5], [4.5, 6.0, 5.0]), [19.5, 26.0, np.nan]
+    )
+
+
+def test_scattered_points_and_duplicates():
+    rng = np.random.default_rng(0)
+    hs = rng.uniform(0.5, 5.0, 50)
+    tp = rng.uniform(3.0, 15.0, 50)
+    interpolator = seastate_interpolator(
+        np.append(hs, hs[0]), np.append(tp, tp[0]), np.append(2 * hs + tp, 0.0)
+    )
+    assert interpolator.num_points == 50
+    values = interpolator(hs[1:], tp[1:])
+    np.testing.assert_allclose(values, 2 * hs[1:] + tp[1:])
+    assert interpolator([hs[0]], [tp[0]])[0] == pytest.approx((2 * hs[0] + tp[0]) / 2)
+    assert np.isnan(interpolator([20.0], [8.0])[0])
+
+
+@pytest.mark.parametrize(
+    "hs, tp, values, query_hs, query_tp, expected",
+    [
+        ([1.0, 1.0, 1.0], [3.0, 5.0, 4.0], [1.0, 3.0, 2.0], [1.0, 1.0, 2.0], [3.5, 6.0, 4.0], [1.5, np.nan, np.nan]),
+        ([1.0, 3.0, 2.0], [4.0, 4.0, 4.0], [1.0, 3.0, 2.0], [2.5, 2.0], [4.0, 5.0], [2.5, np.nan]),
+        ([1.0, 2.0], [3.0, 5.0], [1.0, 2.0], [1.0, 1.5], [3.0, 4.0], [1.0, np.nan]),
+    ],
+)
+def test_degenerate_scatters(hs, tp, values, query_hs, query_tp, expected):
+    interpolator = seastate_interpolator(np.array(hs), np.array(tp), np.array(values))
+    np.testing.assert_allclose(interpolator(query_hs, query_tp), expected)
+
+
+def test_from_seastate_matrices_reproduces_seastates():
+    document = _load()
+    matrices = from_document(document)
+    interpolator = from_seastate_matrices(matrices, LOCATION, RESULT_TYPE, "std")
+    data = document["all_seastate_results"][0]["data"]
+    values = interpolator([c["hs"] for c in data], [c["tp"] for c in data])
+    np.testing.assert_allclose(
+        values, [c["result"]["summary_values"][0]["value"] for c in data]
+    )
+    assert from_seastate_matrices(matrices, LOCATION, RESULT_TYPE, "max") is None
+
+
+@pytest.fixture
+def client_and_db_serv():
+    os.environ["ENVIRONMENT"] = "development"
+    from app.fast_api_app import get_app
+
+    db_serv_mock = create_autospec(database_service)
+    db_serv_mock.get_one_document_with_etag.return_value = (_load(), "etag_1")
+    return TestClient(get_app(db_serv=db_serv_mock)), db_serv_mock
+
+
+def _get_query(**kwargs):
+    return {
+        "location": LOCATION,
+        "result_type": RESULT_TYPE,
+        "method": "std",
+        "hs": [0.5, 0.5, 30.0],
+        "tp": [3.5, 4.0, 3.5],
+        **kwargs,
+    }
+
+
+def test_interpolate_route(client_and_db_serv):
+    client, db_serv_mock = client_and_db_serv
+    first_seastate = _load()["all_seastate_results"][0]["data"][0]
+    with patch(
+        "app.services.seastate_interpolator.from_seastate_matrices",
+        side_effect=from_seastate_matrices,
+    ) as from_matrices_mock:
+        for _ in range(2):
+            response = client.post("/api/analyses/my_id/interpolate", json=_get_query())
+            assert response.status_code == 200
+            result = response.json()
+            assert result["meta"]["method"] == "std"
+            assert result["z"][0] == pytest.approx(
+                first_seastate["result"]["summary_values"][0]["value"]
+            )
+            assert result["z"][1] is not None
+            assert result["z"][2] is None
+        from_matrices_mock.assert_called_once()
+
+
+def test_interpolate_route_errors(client_and_db_serv):
+    client, db_serv_mock = client_and_db_serv
+    response = client.post(
+        "/api/analyses/my_id/interpolate", json=_get_query(method="max")
+    )
+    assert response.status_code == 404
+    response = client.post("/api/analyses/my_id/interpolate", json=_get_query(tp=[1.0]))
+    assert response.status_code == 422
+    db_serv_mock.get_one_document_with_etag.return_value = ([], None)
+    response = client.post("/api/analyses/my_id/interpolate", json=_get_query())
+    assert response.status_code == 404
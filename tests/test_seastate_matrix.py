@@ -0,0 +1,192 @@
+import glob
+import json
+import os
+import numpy as np
+import pytest
+from unittest.mock import create_autospec
+from fastapi.testclient import TestClient
+from app.services.database_service import database_service
+from app.services.analysis_dict_manipulator import extract_all_summary_results
+from app.services.seastate_matrix import (
+    seastate_matrix,
+    from_document,
+    get_summary_columns,
+)
+
+ANALYSIS_FILES = sorted(glob.glob("tests/testfiles/models/analyses/*.json"))
+
+
+@pytest.fixture
+def irregular_scatter():
+    return {
+        "meta": {"location": "wh_datum", "result_type": "angle rx", "unit": "deg"},
+        "data": [
+            {
+                "hs": 1.0,
+                "tp": 2.0,
+                "result": {
+                    "summary_values": [
+                        {"method": "max", "value": 1.0},
+                        {"method": "std", "value": 2.0},
+                    ],
+                    "time_series_id": None,
+                },
+            },
+            {
+                "hs": 1.0,
+                "tp": 3.0,
+                "result": {
+                    "summary_values": [
+                        {"method": "std", "value": 3.0},
+                        {"method": "std", "value": 4.0},
+                    ]
+                },
+            },
+            {"hs": 2.0, "tp": 3.0, "result": {"summary_values": []}},
+        ],
+    }
+
+
+def _load(file_name):
+    with open(file_name) as f:
+        return json.load(f)
+
+
+@pytest.mark.parametrize("file_name", ANALYSIS_FILES)
+def test_round_trip_is_lossless(file_name):
+    document = _load(file_name)
+    matrices = from_document(document)
+    assert [c.to_result_scatter() for c in matrices] == document["all_seastate_results"]
+
+
+@pytest.mark.parametrize("file_name", ANALYSIS_FILES)
+def test_summary_rows_equal_extract_all_summary_results(file_name):
+    document = _load(file_name)
+    rows = [row for c in from_document(document) for row in c.get_summary_rows()]
+    assert rows == extract_all_summary_results(document)
+
+
+def test_irregular_scatter_round_trip(irregular_scatter):
+    matrix = seastate_matrix.from_result_scatter(irregular_scatter)
+    assert list(matrix.irregular_summary_values) == [1]
+    assert matrix.to_result_scatter() == irregular_scatter
+    assert matrix.get_summary_rows() == extract_all_summary_results(
+        {"all_seastate_results": [irregular_scatter]}
+    )
+    hs, tp, values = matrix.get_method_values("std")
+    np.testing.assert_array_equal(values, [2.0, 3.0, 4.0])
+    np.testing.assert_array_equal(tp, [2.0, 3.0, 3.0])
+
+
+@pytest.fixture
+def client_and_db_serv():
+    os.environ["ENVIRONMENT"] = "development"
+    from app.fast_api_app import get_app
+
+    db_serv_mock = create_autospec(database_service)
+    return TestClient(get_app(db_serv=db_serv_mock)), db_serv_mock
+
+
+def test_seastate_results_route(client_and_db_serv):
+    client, db_serv_mock = client_and_db_serv
+    document = _load(ANALYSIS_FILES[0])
+    db_serv_mock.get_one_document_with_etag.return_value = (document, "etag_1")
+    for _ in range(2):
+        response = client.get("/api/analyses/my_id/seastate_results")
+        assert response.status_code == 200
+        assert response.json() == extract_all_summary_results(document)
+
+
+def _with_integer_hs_tp(document):
+    for scatter in document["all_seastate_results"]:
+        for i, seastate in enumerate(scatter["data"]):
+            seastate["hs"] = i + 1
+            seastate["tp"] = 10
+    return document
+
+
+@pytest.mark.parametrize("integer_hs_tp", [False, True])
+def test_drio_time_series_ids_route(client_and_db_serv, integer_hs_tp):
+    client, db_serv_mock = client_and_db_serv
+    document = _load(ANALYSIS_FILES[0])
+    if integer_hs_tp:
+        document = _with_integer_hs_tp(document)
+    db_serv_mock.get_one_document_with_etag.return_value = (document, "etag_1")
+    response = client.get("/api/analyses/my_id/drio_time_series_ids")
+    assert response.status_code == 200
+    result = response.json()
+    one_scatter = document["all_seastate_results"][0]
+    one_seastate = one_scatter["data"][0]
+    key = f"{one_scatter['meta']['location']}__{one_scatter['meta']['result_type']}"
+    hs_tp_key = f"H{int(one_seastate['hs']*100):04d}_T{int(one_seastate['tp']*100):04d}"
+    assert result[key][hs_tp_key] == {
+        "hs": one_seastate["hs"],
+        "tp": one_seastate["tp"],
+        "time_series_id": one_seastate["result"]["time_series_id"],
+        **one_scatter["meta"],
+    }
+    # integer hs and tp are returned as integers, as they are stored
+    assert type(result[key][hs_tp_key]["hs"]) is type(one_seastate["hs"])
+    assert type(result[key][hs_tp_key]["tp"]) is type(one_seastate["tp"])
+    assert len(result[key]) == len(one_scatter["data"])
+
+
+def test_seastate_results_not_found(client_and_db_serv):
+    client, db_serv_mock = client_and_db_serv
+    db_serv_mock.get_one_document_with_etag.return_value = ([], None)
+    response = client.get("/api/analyses/my_id/seastate_results")
+    assert response.status_code == 404
+    assert response.text == "document with id my_id not found in analyses"
+
+
+def _get_rows_from_columns(summary_columns):
+    dictionaries = summary_columns["dictionaries"]
+    columns = summary_columns["columns"]
+    return [
+        {
+            key: dictionaries[key][column[i]] if key in dictionaries else column[i]
+            for key, column in columns.items()
+        }
+        for i in range(len(columns["value"]))
+    ]
+
+
+@pytest.mark.parametrize("file_name", ANALYSIS_FILES)
+def test_summary_columns_equal_summary_rows(file_name, irregular_scatter):
+    document = _load(file_name)
+    document["all_seastate_results"].insert(1, irregular_scatter)
+    matrices = from_document(document)
+    summary_columns = get_summary_columns(matrices)
+    assert _get_rows_from_columns(summary_columns) == extract_all_summary_results(
+        document
+    )
+    methods = summary_columns["dictionaries"]["method"]
+    assert len(set(methods)) == len(methods)
+    assert get_summary_columns([]) == {
+        "dictionaries": {"method": []},
+        "columns": {"hs": [], "tp": [], "method": [], "value": []},
+    }
+
+
+def test_meta_and_methods_are_interned(irregular_scatter):
+    first, second = [
+        seastate_matrix.from_result_scatter(json.loads(json.dumps(irregular_scatter)))
+        for _ in range(2)
+    ]
+    assert first.location is second.location
+    assert first.methods[0] is second.methods[0]
+
+
+def test_seastate_results_route_columnar(client_and_db_serv):
+    client, db_serv_mock = client_and_db_serv
+    document = _load(ANALYSIS_FILES[0])
+    db_serv_mock.get_one_document_with_etag.return_value = (document, "etag_1")
+    response = client.get(
+        "/api/analyses/my_id/seastate_results", params={"format": "columnar"}
+    )
+    assert response.status_code == 200
+    assert _get_rows_from_columns(response.json()) == extract_all_summary_results(
+        document
+    )
+    rows_response = client.get("/api/analyses/my_id/seastate_results")
+    assert len(response.content) < len(rows_response.content) / 2